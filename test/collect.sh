@@ -31,6 +31,8 @@ function main() {
 	SCRIPT_DIR="$(realpath "$(dirname "$SCRIPT_PATH")")"
 
 	COLLECT_PY=$(realpath "$SCRIPT_DIR/scripts/collection/collect.py")
+	SCHEDTESTS_PY=$(realpath "$SCRIPT_DIR/scripts/generation/schedtests.py")
+	TASKSETS_CORPUS="$SCRIPT_DIR/tasksets/corpus.tsc"
 	SCHEDULERS=(global apedf-ff apedf-wf)
 	GOVERNORS=(performance schedutil)
 
@@ -46,6 +48,15 @@ function main() {
 		return 1
 	fi
 
+	# Predict the outcome of each taskset using offline schedulability tests,
+	# so that it can be compared with the observed one
+	analysis_args=()
+	if [ -f "$TASKSETS_CORPUS" ]; then
+		echo " - Analyzing tasksets in '$TASKSETS_CORPUS'"
+		"$SCHEDTESTS_PY" -o "$TEST_OUTDIR/verdicts.csv" "$TASKSETS_CORPUS"
+		analysis_args=(-a "$TEST_OUTDIR/verdicts.csv")
+	fi
+
 	for scheduler in "${SCHEDULERS[@]}"; do
 		for governor in "${GOVERNORS[@]}"; do
 			curdir="$TEST_OUTDIR/$scheduler/$governor"
@@ -61,6 +72,8 @@ function main() {
 				-o "$1/$scheduler/tsets-$governor.csv" \
 				-O "$1/$scheduler/tasks-$governor.csv" \
 				-m \
+				"${analysis_args[@]}" \
+				-s "$scheduler" \
 				-D "$curdir"
 		done
 	done
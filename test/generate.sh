@@ -138,88 +138,6 @@ function get_utils_list() {
     gen_utils_list
 }
 
-# Generates a single taskset. Arguments:
-#  1. The seed to use for taskgen.
-#  2. The number of tasks in the taskset.
-#  3. The total utilization.
-function generate_taskset() {
-    local seed="$1"
-    local ntasks="$2"
-    local util="$3"
-
-    # Quick argument reference for taskgen:
-    # - -S seed for the random number generator
-    # - -d distribution of the periods (=logunif ->
-    #   logarithmic uniform distribution)
-    # - -s number of tasksets to generate (=1)
-    # - -n number of tasks per taskset
-    # - -u total taskset utilization
-    # - -p minimum period
-    # - -q maximum period
-    # - -g period granularity
-    # - --round-C rounds execution times to the nearest
-    #   integer
-    # - -f output format as a python template string.
-
-    "$TASKGEN3" \
-        -S "$seed" \
-        -d logunif \
-        -s 1 \
-        -n "$ntasks" \
-        -u "$util" \
-        -p 100000 \
-        -q 1200000 \
-        -g 10000 \
-        --round-C \
-        -f "%(C)d %(T)d"
-
-}
-
-function check_runtimes() {
-    printf '%s' $(sed '/^[[:space:]]*$/d' <"$1" | awk ' { if ($1 < 4000) print nope } ' | wc -l)
-}
-
-function fix_runtimes() {
-    local infile=$1
-    local min_value
-    local multiplier
-
-    min_value=$(sort -nk 1 "$infile" | head -n 1 | cut -d' ' -f1)
-    # echo "MIN_VALUE = $min_value" >&2
-    multiplier=$(bc <<EOF
-define ceil_divide(dividend, divisor) {
-    return (dividend + divisor - 1) / divisor
-}
-ceil_divide(5000, $min_value)
-EOF
-)
-    # echo "MULTIPLIER = $multiplier" >&2
-    awk -v multiplier=$multiplier  '{ print $1*multiplier, $2*multiplier }' <"$1"
-}
-
-# Checks that the total utilization provided by taskgen is
-# not above the maximum
-function check_utilization() {
-    local sum_util=0
-
-    sum_util=$(
-        (
-            sed '/^[[:space:]]*$/d' |
-                awk '
-            {
-                sum_util += ($1 / $2)
-            } END {
-                print sum_util
-            }
-        '
-        ) <"$1"
-    )
-
-    # printf -v sum_util "%.4f" "${sum_util}"
-
-    echo -e "CHECK:\texpected\t$2\tgot\t${sum_util}"
-}
-
 (
     set -e
 
@@ -273,6 +191,63 @@ function check_utilization() {
     # mantaining the same GT_SEED value.
     GT_SEEDS_LIST=()
 
+    # Where the seed of each taskset comes from:
+    # - list: one seed per taskset index from GT_SEEDS_LIST (the tasksets in
+    #   the repository have been generated this way)
+    # - sequence: each (num_tasks, util, index) cell gets an independent
+    #   numpy SeedSequence stream derived from GT_SEED, which does not depend
+    #   on the awk implementation and allows generating cells in parallel
+    #   (GT_SAMPLER is ignored, tasksets are always drawn in batches)
+    GT_SEED_MODE=list
+
+    # Number of processes generating tasksets in parallel (0 to use all the
+    # available CPUs). The output does not depend on this value.
+    GT_JOBS=1
+
+    # How tasksets are spread over the parameters space:
+    # - grid: GT_NUM_TASKSETS tasksets for each number of tasks in
+    #   GT_NUM_TASKS_LIST and each utilization in GT_UTILS_LIST
+    # - lhs, sobol: GT_DESIGN_BUDGET tasksets sampled with a Latin hypercube
+    #   or a Sobol sequence (from GT_SEED), each one with its own number of
+    #   tasks (from GT_NUM_TASKS_LIST), utilization (between the extremes of
+    #   GT_UTILS_LIST), minimum and maximum period and maximum task
+    #   utilization (within the ranges below). Their names are extended with
+    #   the last three values and they are listed in design.tsv, test.sh runs
+    #   them in that order. A maximum task utilization below 1 requires the
+    #   uunifast or dirichlet GT_UTIL_GENERATOR.
+    GT_DESIGN=grid
+    GT_DESIGN_BUDGET=200
+    GT_DESIGN_PMIN_RANGE=(100000 100000)
+    GT_DESIGN_PMAX_RANGE=(1200000 1200000)
+    GT_DESIGN_UMAX_RANGE=(1.0 1.0)
+
+    # The distribution of the task periods (between 100ms and 1.2s):
+    # - logunif: log-uniform (the tasksets in the repository use this one)
+    # - unif: uniform
+    # - hyperdiv: log-uniform over the divisors of GT_HYPERPERIOD, so that
+    #   each taskset hyperperiod divides it and a run of GT_HYPERPERIOD
+    #   covers whole hyperperiods (e.g., 7200000 for 7.2 seconds)
+    GT_PERIOD_DIST=logunif
+
+    # The base hyperperiod in us, used only by the hyperdiv distribution.
+    GT_HYPERPERIOD=7200000
+
+    # The generator of the task utilizations of each taskset (see taskgen3.py):
+    # - stafford: randfixedsum (the tasksets in the repository use this one)
+    # - uunifast: UUniFast-Discard
+    # - dirichlet: Dirichlet with parameter GT_DIRICHLET_ALPHA (1 gives the
+    #   same distribution of the other two, larger values more balanced
+    #   tasksets)
+    GT_UTIL_GENERATOR=stafford
+    GT_DIRICHLET_ALPHA=1.0
+
+    # How tasksets with a too small task runtime are replaced:
+    # - reseed: generate again with the next unused seed (the tasksets in
+    #   the repository have been generated this way)
+    # - batch: draw candidates in batches using the same seed and keep the
+    #   first valid one
+    GT_SAMPLER=reseed
+
     # The maximum fraction of the reserved runtime the task can actually run
     # for. Must be between 0 and 1.
     GT_RT_FRACTION=.95
@@ -286,6 +261,12 @@ function check_utilization() {
     # without removing too runtime.
     GT_RT_REMOVE=0
 
+    # How runtimes are reduced when the utilization of a taskset exceeds the
+    # maximum one in GT_UTILS_LIST (see taskset2json.py): legacy (the
+    # tasksets in the repository use this one), proportional, largest or
+    # waterfill.
+    GT_QUOTA_POLICY=legacy
+
     # The minimum test duration in seconds.
     GT_RT_MIN_DURATION=20
 
@@ -298,6 +279,11 @@ function check_utilization() {
     # - big     core @ 1.4 GHz => 92
     GT_RT_CALIBRATION=92
 
+    # Tasksets whose parameters did not change since the last generation in
+    # GT_OUT_DIR are not generated again. Taskset files in GT_OUT_DIR that are
+    # not part of the grid anymore are reported; set this to 1 to remove them.
+    GT_PRUNE=0
+
     # ==================================================== #
     # ----------------------- MAIN ----------------------- #
     # ==================================================== #
@@ -306,8 +292,8 @@ function check_utilization() {
     SCRIPT_NAME="$(basename "${BASH_SOURCE[0]}")"
     SCRIPT_DIR="$(realpath "$(dirname "$SCRIPT_PATH")")"
 
-    TASKGEN3="$(realpath "$SCRIPT_DIR"/scripts/generation/taskgen3.py)"
-    TASKSET2JSON="$(realpath "$SCRIPT_DIR"/scripts/generation/taskset2json.py)"
+    TASKGRID="$(realpath "$SCRIPT_DIR"/scripts/generation/taskgrid.py)"
+    TSCORPUS="$(realpath "$SCRIPT_DIR"/scripts/generation/tscorpus.py)"
 
     if [ $# -gt 0 ]; then
         echo "WARNING: using the first parameter as a fixed configuration script!" >&2
@@ -322,8 +308,6 @@ function check_utilization() {
     GT_UTILS_NUM="${#GT_UTILS_LIST[@]}"
     GT_NUM_TASKS_NUM="${#GT_NUM_TASKS_LIST[@]}"
 
-    max_quota="${GT_UTILS_LIST[-1]}"
-
     echo ""
     echo "Generating tasksets with the following utils:"
     echo "${GT_UTILS_LIST[*]}"
@@ -333,88 +317,48 @@ function check_utilization() {
     echo "${GT_SEEDS_LIST[*]}"
     echo ""
 
-    mkdir -p "$GT_OUT_DIR"
-    tset_name=
-    tset_file=
-    text_file=
-    json_file=
-
-    tested_seeds=()
-
-    # for each number of tasks
-    for ((k = 0; k < $GT_NUM_TASKS_NUM; k++)); do
-        num_tasks="${GT_NUM_TASKS_LIST[$k]}"
-
-        printf -v num_tasks_dd "%02d" "$num_tasks"
-        curdir="$GT_OUT_DIR/$num_tasks_dd"
-        mkdir -p "$curdir"
-
-        # for each utilization
-        for ((j = 0; j < "$GT_UTILS_NUM"; j++)); do
-            util="${GT_UTILS_LIST[$j]}"
-
-            if (($(echo "0 >= $util" | bc -l))); then
-                continue
-            fi
+    taskgrid_extra_args=()
+    if [ "$GT_PRUNE" = 1 ]; then
+        taskgrid_extra_args+=(--prune)
+    fi
 
-            tested_seeds=()
-
-            # for each repetition
-            for ((i = 0; i < "$GT_NUM_TASKSETS"; i++)); do
-                seed="${GT_SEEDS_LIST[$i]}"
-
-                doitagain=1
-
-                while [ "$doitagain" = 1 ]; do
-                    printf 'Generating taskset with %02d tasks, util %.4f, index %02d, (seed %d)' \
-                        "$num_tasks" "$util" "$i" "$seed"
-
-                    tested_seeds+=("${seed}")
-
-                    # Printing to variable tset_file
-                    printf -v tset_name \
-                        'ts_n%s_i%02d_u%.4f' "$num_tasks_dd" "$i" "$util"
-
-                    tset_file="${curdir}/${tset_name}"
-                    text_file="${tset_file}.txt"
-                    json_file="${tset_file}.json"
-
-                    generate_taskset "$seed" "$num_tasks" "$util" \
-                        >"$text_file" # 2>/dev/null
-
-                    printf " Runtimes check:"
-                    num_tasks_below_threshold=$(check_runtimes "$text_file")
-                    if [ $num_tasks_below_threshold -gt 0 ]; then
-                        printf " had to fix!"
-                        seed=$((seed+1))
-                        while [[ " ${GT_SEEDS_LIST[*]} ${tested_seeds[*]} " =~ " ${seed} " ]]; do
-                            seed=$((seed+1))
-                        done
-                    else
-                        printf " OK!"
-                        doitagain=0
-                    fi
-
-                    printf '\n'
-                done
-
-                # # NOTE: this could be necessary if the tasks exceed the maximum
-                # check_utilization "$text_file" "$util"
-
-                "$TASKSET2JSON" \
-                    -r "$GT_RT_FRACTION" \
-                    -R "$GT_RT_REMOVE" \
-                    -m "$GT_RT_MIN_DURATION" \
-                    -M "$GT_RT_MAX_DURATION" \
-                    -c "$GT_RT_CALIBRATION" \
-                    -q "$max_quota" \
-                    <"$text_file" >"$json_file"
-                # Option -l is not used anymore
-                # -l "$tset_name" \
-
-            done
-        done
-    done
+    # All tasksets are generated by a single process, which applies the same
+    # steps of taskgen3.py and taskset2json.py (including the minimum runtime
+    # check) to each taskset of the grid
+    "$TASKGRID" \
+        -o "$GT_OUT_DIR" \
+        -n "${GT_NUM_TASKS_LIST[@]}" \
+        -u "${GT_UTILS_LIST[@]}" \
+        -s "${GT_SEEDS_LIST[@]}" \
+        -N "$GT_NUM_TASKSETS" \
+        -r "$GT_RT_FRACTION" \
+        -R "$GT_RT_REMOVE" \
+        -m "$GT_RT_MIN_DURATION" \
+        -M "$GT_RT_MAX_DURATION" \
+        -c "$GT_RT_CALIBRATION" \
+        -d "$GT_PERIOD_DIST" \
+        -H "$GT_HYPERPERIOD" \
+        -g "$GT_UTIL_GENERATOR" \
+        -a "$GT_DIRICHLET_ALPHA" \
+        -p "$GT_QUOTA_POLICY" \
+        -S "$GT_SAMPLER" \
+        --seed "$GT_SEED" \
+        --seed-mode "$GT_SEED_MODE" \
+        --design "$GT_DESIGN" \
+        -B "$GT_DESIGN_BUDGET" \
+        --pmin-range "${GT_DESIGN_PMIN_RANGE[@]}" \
+        --pmax-range "${GT_DESIGN_PMAX_RANGE[@]}" \
+        --umax-range "${GT_DESIGN_UMAX_RANGE[@]}" \
+        -j "$GT_JOBS" \
+        "${taskgrid_extra_args[@]}"
+
+    # Pack all tasksets in the output directory in a single file, test.sh
+    # uses it (when present) instead of looking up individual files. The
+    # names of design points do not fit in the corpus, test.sh looks them up
+    # using design.tsv instead.
+    if [ "$GT_DESIGN" = grid ]; then
+        "$TSCORPUS" build -o "$GT_OUT_DIR/corpus.tsc" "$GT_OUT_DIR"
+    fi
 
     params_file="$GT_OUT_DIR/params.sh"
 
@@ -447,5 +391,17 @@ export GT_RT_REMOVE="${GT_RT_REMOVE}"
 export GT_RT_MIN_DURATION="${GT_RT_MIN_DURATION}"
 export GT_RT_MAX_DURATION="${GT_RT_MAX_DURATION}"
 export GT_RT_CALIBRATION="${GT_RT_CALIBRATION}"
+export GT_QUOTA_POLICY="${GT_QUOTA_POLICY}"
+export GT_PERIOD_DIST="${GT_PERIOD_DIST}"
+export GT_HYPERPERIOD="${GT_HYPERPERIOD}"
+export GT_UTIL_GENERATOR="${GT_UTIL_GENERATOR}"
+export GT_DIRICHLET_ALPHA="${GT_DIRICHLET_ALPHA}"
+export GT_SAMPLER="${GT_SAMPLER}"
+export GT_SEED_MODE="${GT_SEED_MODE}"
+export GT_DESIGN="${GT_DESIGN}"
+export GT_DESIGN_BUDGET="${GT_DESIGN_BUDGET}"
+export GT_DESIGN_PMIN_RANGE=(${GT_DESIGN_PMIN_RANGE[@]})
+export GT_DESIGN_PMAX_RANGE=(${GT_DESIGN_PMAX_RANGE[@]})
+export GT_DESIGN_UMAX_RANGE=(${GT_DESIGN_UMAX_RANGE[@]})
 EOF
 )
@@ -1,13 +1,22 @@
 #!/usr/bin/env python3
 
 import argparse
+import io
 import os
 import parse
+import re
 import sys
 
 import pandas as pd
 import numpy as np
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'execution'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'generation'))
+
+import slogbin
+import thermbin
+from schedtests import SCHEDULER_VERDICTS
+
 
 def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
@@ -36,12 +45,50 @@ def arguments_parser():
                         action='store_true',
                         help="Discard tasksets for which there is at least one overrun (exec time greather than dl_runtime)",
                         )
+    parser.add_argument('-a', "--analysis",
+                        default=None,
+                        help="A verdict table produced by schedtests.py, to add a predicted column to the stats of each taskset",
+                        )
+    parser.add_argument('-p', "--power-checksum",
+                        default='none',
+                        choices=POWER_CHECKSUMS,
+                        help="How the last field of each power log row is checked: sum or xor modulo 256 of the bytes before the last comma, or not at all",
+                        )
+    parser.add_argument('-s', "--scheduler",
+                        default=None,
+                        choices=list(SCHEDULER_VERDICTS),
+                        help="The scheduler variant the data refers to, selects the verdict used as prediction",
+                        )
     return parser
 
 
+TSET_KEYS = ['num_tasks', 'util', 'tset_idx']
+
+# Taskset directories are named after the taskset, optionally followed by the
+# extended dimensions of design points (see taskgrid.py), each one becoming a
+# column, e.g. ts_n08_i12_u2.0513_pmin100000_pmax1200000_umax1.0000.out.d
+TSET_DIR_RE = re.compile(
+    r'ts_n(\d+)_i(\d+)_u(\d+\.\d+)((?:_[a-z]+\d+(?:\.\d+)?)*)\.out\.d$')
+TSET_DIM_RE = re.compile(r'_([a-z]+)(\d+(?:\.\d+)?)')
+
+# Power logs (see slogger.py) have one row per sample, with 17 comma-separated
+# numeric fields and CRLF line endings; the last field may be a checksum of the
+# bytes of the row before the last comma, which is not checked by default
+# because the scheme of the power meter has not been verified yet
+POWER_NUM_FIELDS = 17
+# The field with the power drawn by the board (the one checked by
+# powerstuck.awk), in mW
+POWER_FIELD = 7
+POWER_SCALE = 1e-3
+POWER_CHECKSUMS = ['sum8', 'xor8', 'none']
+# Above this ratio of rejected rows the power logs are not in the expected
+# format (or the checksum is wrong) and collection fails
+POWER_REJECTED_FATAL = 0.99
+
 DISCARD_SMALL = False
 DISCARD_OVERRUN = False
 PRINT_MISSES = False
+POWER_CHECKSUM = 'none'
 
 
 class TooShort(Exception):
@@ -208,12 +255,145 @@ def weighted_percentile(data, weights, perc):
     cdf = (np.cumsum(weights) - 0.5 * weights) / np.sum(weights) # 'like' a CDF function
     return np.interp(perc, cdf, data)
 
+def read_therm_bin(fname):
+    """
+    Returns the CLOCK_MONOTONIC times in seconds and the (num_samples,
+    num_zones) temperatures in Celsius recorded by thermsampler.py.
+    """
+    names, times, temps = thermbin.read_samples(fname)
+    return (np.asarray(times, dtype=np.float64),
+            np.asarray(temps, dtype=np.float64).reshape(len(times), len(names)))
+
+
+def read_therm(tset_dir):
+    # The temperatures of a run, one row per sample, or None if not sampled
+    if os.path.isfile(f"{tset_dir}/therm.bin"):
+        return read_therm_bin(f"{tset_dir}/therm.bin")[1]
+    if os.path.isfile(f"{tset_dir}/therm.log"):
+        # Written by older versions of test.sh
+        return pd.read_csv(f"{tset_dir}/therm.log", sep=' ', header=None).to_numpy()
+    return None
+
+
+def read_cooldown(tset_dir):
+    # The time in seconds the run waited for the board to cool down before
+    # starting (see thermsampler.py cooldown), nan if not logged
+    fname = f"{tset_dir}/cooldown.log"
+    if not os.path.isfile(fname):
+        return float('nan')
+    return pd.read_csv(fname)['duration'].iloc[-1]
+
+
+def read_capture(fname):
+    """
+    Returns the byte stream of a binary capture of the serial and the
+    CLOCK_MONOTONIC time in seconds at which each of its bytes was received,
+    assuming a constant byte rate within each block.
+    """
+    bits, baudrate, stream, ends, stamps = slogbin.read_capture(fname)
+    stream = np.frombuffer(stream, dtype=np.uint8)
+    ends = np.asarray(ends, dtype=np.int64)
+    block = np.searchsorted(ends, np.arange(1, len(stream) + 1))
+    times = (np.asarray(stamps, dtype=np.float64)[block]
+             - (ends[block] - np.arange(1, len(stream) + 1)) * bits * 1e9 / baudrate) / 1e9
+    return stream, times
+
+
+def parse_power_rows(buf, checksum):
+    """
+    Splits a power log (a uint8 array) into rows, returning a (num_rows,
+    POWER_NUM_FIELDS) float array with NaN rows for invalid ones (wrong number
+    of fields, non-numeric fields or wrong checksum) and the position of the
+    last byte of each row. The last field is only required to be numeric when
+    the checksum is checked. A last row without line ending is ignored.
+    """
+    newlines = np.flatnonzero(buf == ord('\n'))
+    starts = np.concatenate([[0], newlines[:-1] + 1]).astype(np.int64)
+    # Strip CR
+    stops = newlines - (buf[np.maximum(newlines - 1, 0)] == ord('\r'))
+    stops = np.maximum(stops, starts)
+
+    is_comma = buf == ord(',')
+    commas = np.concatenate([[0], np.cumsum(is_comma, dtype=np.int64)])
+    num_fields = commas[stops] - commas[starts] + 1
+    good = (num_fields == POWER_NUM_FIELDS) & (stops > starts)
+
+    rows = np.full((len(starts), POWER_NUM_FIELDS), np.nan)
+    if not good.any():
+        return rows, newlines
+
+    # All the fields of the good rows are parsed at once
+    text = b'\n'.join(bytes(buf[a:b]) for a, b in zip(starts[good], stops[good]))
+    fields = pd.read_csv(io.BytesIO(text), header=None, names=range(POWER_NUM_FIELDS),
+                         dtype=str, keep_default_na=False)
+    values = fields.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+    rows[good] = values
+    valid = good & ~np.isnan(rows[:, :-1]).any(axis=1)
+
+    if checksum != 'none':
+        comma_pos = np.flatnonzero(is_comma)
+        last_comma = comma_pos[np.maximum(commas[stops] - 1, 0)]
+        if checksum == 'sum8':
+            prefix = np.concatenate([[0], np.cumsum(buf, dtype=np.uint64)])
+            computed = (prefix[last_comma] - prefix[starts]) % 256
+        else:
+            prefix = np.concatenate([[0], np.bitwise_xor.accumulate(buf)]).astype(np.uint64)
+            computed = prefix[last_comma] ^ prefix[starts]
+        valid &= rows[:, -1] == computed
+    rows[~valid] = np.nan
+
+    return rows, newlines
+
+
+def read_power(tset_dir):
+    """
+    Returns the average power (W) and energy (J) measured during a run and the
+    ratio of rejected power log rows; the energy is only known for runs whose
+    serial was captured with timestamps (power.bin). All nan if there is no
+    power log.
+    """
+    if os.path.isfile(f"{tset_dir}/power.bin"):
+        buf, byte_times = read_capture(f"{tset_dir}/power.bin")
+    elif os.path.isfile(f"{tset_dir}/power.log") and os.path.getsize(f"{tset_dir}/power.log") > 0:
+        buf = np.memmap(f"{tset_dir}/power.log", dtype=np.uint8, mode='r')
+        byte_times = None
+    else:
+        return float('nan'), float('nan'), float('nan')
+
+    rows, ends = parse_power_rows(buf, POWER_CHECKSUM)
+    valid = ~np.isnan(rows[:, :-1]).any(axis=1)
+    rejected = 1 - valid.mean() if len(rows) else float('nan')
+    if not valid.any():
+        return float('nan'), float('nan'), rejected
+
+    power = rows[valid, POWER_FIELD] * POWER_SCALE
+    energy = float('nan')
+    if byte_times is not None and valid.sum() > 1:
+        # Each row is stamped with the time its line ending was received
+        times = byte_times[ends[valid]]
+        energy = ((power[1:] + power[:-1]) / 2 * np.diff(times)).sum()
+    return power.mean(), energy, rejected
+
+
+def parse_tset_dirname(tset_dirname):
+    match = TSET_DIR_RE.match(tset_dirname)
+    if match is None:
+        return None
+
+    tset_info = {
+        'num_tasks': int(match[1]),
+        'tset_idx': int(match[2]),
+        'util': float(match[3]),
+    }
+    for name, value in TSET_DIM_RE.findall(match[4]):
+        tset_info[name] = float(value) if '.' in value else int(value)
+    return tset_info
+
 def parse_taskset(tset_dir):
     global tsets_type
 
     tset_dirname = os.path.basename(tset_dir)
-    tset_info = parse.parse("ts_n{num_tasks:2d}_i{tset_idx:2d}_u{util:f}.out.d",
-                            tset_dirname)
+    tset_info = parse_tset_dirname(tset_dirname)
     mperiod_info = parse.parse("{period:d}.out.d", tset_dirname)
 
     if tset_info is None and mperiod_info is None:
@@ -223,7 +403,7 @@ def parse_taskset(tset_dir):
 
     # Special for dhall-effect tasks
     if tset_info is None:
-        tset_info = mperiod_info
+        tset_info = mperiod_info.named
         if tsets_type is not None and tsets_type != 'dhall':
             eprint(f"Multiple taskset types (both {tsets_type} and dhall)")
             sys.exit(1)
@@ -234,18 +414,16 @@ def parse_taskset(tset_dir):
             sys.exit(1)
         tsets_type = 'regular'
 
-    # Get dictionary from parse result type
-    tset_info = tset_info.named
-
-    therm_data = pd.read_csv(f"{tset_dir}/therm.log", sep=' ', header=None)
+    # Simulated runs (see dlsim.py) have no thermal data
+    therm_max = float('nan')
+    therm_data = read_therm(tset_dir)
+    if therm_data is not None and therm_data.size > 0:
+        # The fifth column should refer to the GPU, we will discard it for now
+        # Get the maximum among the maximum values of each of the first 4 columns
+        therm_max = therm_data[:, :4].max()
 
-    # The fifth column should refer to the GPU, we will discard it for now
-    # Get the maximum among the maximum values of each of the first 4 columns
-    therm_max = therm_data.iloc[:, :4].max().max()
 
-
-    # TODO
-    # power_data = pd.read_csv(f"{tset_dir}/therm.log", sep=',')
+    power_avg, energy, power_rejected = read_power(tset_dir)
 
     tset_stats = {
         **tset_info,
@@ -257,6 +435,10 @@ def parse_taskset(tset_dir):
         'migrations': 0,
         'migrations_ratio': 0,
         'therm_max': therm_max,
+        'cooldown': read_cooldown(tset_dir),
+        'power_avg': power_avg,
+        'energy': energy,
+        'power_rejected': power_rejected,
     }
 
     tasks_stats = []
@@ -354,12 +536,28 @@ def parse_taskset(tset_dir):
     # 2. List of the stats of each task
     return tset_stats, tasks_stats
 
+
+def add_predictions(tsets_stats, analysis_file, scheduler):
+    # Adds the verdict predicted by the offline analysis next to the observed
+    # miss ratio of each taskset (NaN for tasksets not in the table)
+    verdicts = pd.read_csv(analysis_file, sep='\t')
+    verdicts = verdicts[TSET_KEYS + [SCHEDULER_VERDICTS[scheduler]]]
+    verdicts = verdicts.rename(columns={SCHEDULER_VERDICTS[scheduler]: 'predicted'})
+
+    # Utilizations are matched with the precision used in taskset names
+    for df in [tsets_stats, verdicts]:
+        df['util_key'] = (df['util'] * 10000).round().astype(int)
+    merged = tsets_stats.merge(verdicts.drop(columns='util'),
+                               on=['num_tasks', 'util_key', 'tset_idx'], how='left')
+    return merged.drop(columns='util_key')
+
 tsets_type = None
 
 def main():
     global PRINT_MISSES
     global DISCARD_OVERRUN
     global DISCARD_SMALL
+    global POWER_CHECKSUM
 
     parser = arguments_parser()
     args = parser.parse_args()
@@ -367,6 +565,7 @@ def main():
     PRINT_MISSES = args.print_misses
     DISCARD_OVERRUN = args.discard_overrun
     DISCARD_SMALL = args.discard_small
+    POWER_CHECKSUM = args.power_checksum
 
     tasks_rows = []
     tsets_rows = []
@@ -397,7 +596,21 @@ def main():
     tasks_stats = pd.DataFrame(tasks_rows)
     tsets_stats = pd.DataFrame(tsets_rows)
 
+    if tsets_stats['power_rejected'].notna().any():
+        eprint(f"Power log rows rejected: {tsets_stats['power_rejected'].mean():.2%} on average, "
+               f"{tsets_stats['power_rejected'].max():.2%} at most")
+        if tsets_stats['power_rejected'].mean() >= POWER_REJECTED_FATAL:
+            eprint(f"ERROR: almost all power log rows were rejected with --power-checksum "
+                   f"{POWER_CHECKSUM}, check the format of the power logs!")
+            return 1
+
     global tsets_type
+    if args.analysis is not None and tsets_type == 'regular':
+        if args.scheduler is None:
+            eprint('ERROR: the scheduler is required to use the verdict table!')
+            return 1
+        tsets_stats = add_predictions(tsets_stats, args.analysis, args.scheduler)
+
     if tsets_type == 'dhall':
         tsets_cols_order = ['period']
     else:
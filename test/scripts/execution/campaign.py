@@ -0,0 +1,628 @@
+#!/usr/bin/env python3
+
+"""\
+Keeps the state of an experimental campaign (one run for each combination of
+scheduler variant, governor and taskset) in a SQLite database, so that test.sh
+can resume it after reboots and crashes and change kernel as few times as
+possible.
+
+Each run is in one of the following states:
+- planned: the run must be executed
+- running: the run was handed to test.sh; runs still in this state when the
+  next run is requested were interrupted (by a crash or a reboot) and they are
+  planned again
+- done: the results of the run are in OUTDIR/SCHEDULER/GOVERNOR/TASKSET.out.d
+- invalid: the run was discarded (e.g., the power meter got stuck), its
+  partial results are kept in OUTDIR/.invalid; use replan to execute it again
+  (runs aborted by runguard.py are retried automatically, see retry)
+
+Runs are handed out grouped by kernel: all the runs of the running kernel are
+executed first (grouped by governor), then test.sh is asked to switch to the
+next kernel with planned runs, so that each kernel is booted once.
+
+The output of each run is written in a staging directory in OUTDIR/.staging
+and moved to its final place with a single rename when the run is committed,
+so a directory in OUTDIR always holds the complete output of a run.
+
+The taskset manifest (the name and the rt-app configuration of each taskset to
+execute) is computed once by plan: tasksets are taken from the design table
+when it exists (see taskgrid.py --design), from the corpus otherwise (see
+tscorpus.py) or found in the tasksets directory, and only the ones listed in
+the selection file are kept when it exists (see tsfeatures.py select). plan
+refuses a corpus older than any ts_*.json file of the tasksets directory.
+Configurations of tasksets that are only in the corpus are exported to the
+export directory on demand.
+
+When a campaign is sharded across multiple boards (see test-on-boards.py), the
+shard file lists the runs assigned to this board, one per line as
+SCHEDULER<TAB>GOVERNOR<TAB>TASKSET, and plan only keeps those runs.
+
+Commands:
+  plan     compute the manifest and add the missing runs to the campaign
+  next     print the next run to execute on the running kernel, or the kernel
+           to switch to, as tab-separated fields:
+             RUN ID DONE TOTAL SCHEDULER GOVERNOR TASKSET FILE_IN DIR_OUT
+             KERNEL SCHEDULER DONE TOTAL
+             END DONE TOTAL
+  upcoming print the kernel that will be booted after the running one, if
+           any, so that test.sh can load it in advance
+  commit   move the output of a run to its final place and mark it as done
+  invalid  mark a run as invalid
+  retry    mark a run as invalid and plan it again, unless it was already
+           attempted too many times; prints the new state of the run
+  replan   plan again the runs in a given state
+  status   print the number of runs in each state
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'generation'))
+
+import taskset2json
+import tscorpus
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+class CampaignError(Exception):
+    pass
+
+
+STATES = ['planned', 'running', 'done', 'invalid']
+
+STAGING_DIR = '.staging'
+INVALID_DIR = '.invalid'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS tasksets (
+    name TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    path TEXT
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    scheduler TEXT NOT NULL,
+    governor TEXT NOT NULL,
+    taskset TEXT NOT NULL,
+    sched_order INTEGER NOT NULL,
+    gov_order INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'planned',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    started REAL,
+    finished REAL,
+    message TEXT,
+    UNIQUE (scheduler, governor, taskset)
+);
+CREATE INDEX IF NOT EXISTS runs_order ON runs (state, sched_order, gov_order, position);
+"""
+
+
+# ------------------------------- DATABASE ------------------------------- #
+
+def connect(fname):
+    os.makedirs(os.path.dirname(os.path.abspath(fname)), exist_ok=True)
+    conn = sqlite3.connect(fname)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def get_meta(conn, key):
+    row = conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    if row is None:
+        raise CampaignError("campaign not planned yet!")
+    return row['value']
+
+
+def set_meta(conn, **values):
+    conn.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', values.items())
+
+
+def get_run(conn, run_id):
+    row = conn.execute('SELECT * FROM runs WHERE id = ?', (run_id,)).fetchone()
+    if row is None:
+        raise CampaignError(f"run {run_id} not found!")
+    return row
+
+
+def counts(conn):
+    # Returns the number of completed (done or invalid) runs and of all runs
+    row = conn.execute("SELECT COUNT(*) AS total, "
+                       "COALESCE(SUM(state IN ('done', 'invalid')), 0) AS completed "
+                       "FROM runs").fetchone()
+    return row['completed'], row['total']
+
+
+# ------------------------------- MANIFEST ------------------------------- #
+
+def read_design(fname):
+    with open(fname) as infile:
+        next(infile)
+        return [line.split('\t', 1)[0].strip() for line in infile if line.strip()]
+
+
+def read_selection(fname):
+    with open(fname) as infile:
+        return {line.strip() for line in infile if line.strip()}
+
+
+def read_shard(fname):
+    with open(fname) as infile:
+        return {tuple(line.rstrip('\n').split('\t')) for line in infile if line.strip()}
+
+
+def find_files(tasksets_dir):
+    # Maps the name of each taskset to its rt-app configuration, like the
+    # find that test.sh used to run for each step
+    paths = {}
+    for dirpath, _, files in os.walk(tasksets_dir):
+        for f in sorted(files):
+            name, ext = os.path.splitext(f)
+            if ext == '.json' and name.startswith('ts_'):
+                paths.setdefault(name, os.path.abspath(os.path.join(dirpath, f)))
+    return paths
+
+
+def check_corpus(corpus, tasksets_dir):
+    # The corpus is built from the taskset files (see generate.sh), a corpus
+    # older than any of them would silently ignore the changes
+    built = os.path.getmtime(corpus)
+    for name, path in find_files(tasksets_dir).items():
+        if os.path.getmtime(path) > built:
+            raise CampaignError(f"{corpus} is older than {path}, build it again with "
+                                f"tscorpus.py build!")
+
+
+def grid_order(name):
+    # Tasksets of the grid are executed by index first, so that an
+    # interrupted campaign still covers every (num_tasks, util) cell
+    params = tscorpus.parse_taskset_name(name)
+    if params is None:
+        return (float('inf'), 0, 0, name)
+    num_tasks, tset_idx, util = params
+    return (tset_idx, num_tasks, util, name)
+
+
+def make_manifest(args):
+    """
+    Returns the list of (name, path) of the tasksets to execute, in order;
+    path is None for the tasksets that must be exported from the corpus.
+    """
+    if os.path.isfile(args.design):
+        paths = find_files(args.tasksets)
+        manifest = [(name, paths.get(name)) for name in read_design(args.design)]
+        missing = [name for name, path in manifest if path is None]
+        if missing:
+            raise CampaignError(f"{len(missing)} tasksets of {args.design} not found, "
+                                f"e.g. {missing[0]}!")
+    elif os.path.isfile(args.corpus):
+        check_corpus(args.corpus, args.tasksets)
+        corpus = tscorpus.Corpus(args.corpus)
+        names = sorted((corpus.name(pos) for pos in range(len(corpus))), key=grid_order)
+        manifest = [(name, None) for name in names]
+    else:
+        paths = find_files(args.tasksets)
+        manifest = [(name, paths[name]) for name in sorted(paths, key=grid_order)]
+
+    if os.path.isfile(args.selection):
+        selected = read_selection(args.selection)
+        manifest = [(name, path) for name, path in manifest if name in selected]
+    return manifest
+
+
+def run_dir(outdir, run):
+    return os.path.join(outdir, run['scheduler'], run['governor'], run['taskset'] + '.out.d')
+
+
+def staging_dir(outdir, run):
+    return os.path.join(outdir, STAGING_DIR, str(run['id']))
+
+
+def is_nonempty_dir(path):
+    return os.path.isdir(path) and len(os.listdir(path)) > 0
+
+
+def plan(conn, args):
+    """
+    Replaces the manifest and adds the runs of the new tasksets; planned runs
+    of tasksets that are no longer in the manifest (or in the shard, when
+    there is one) are removed, while done and invalid runs are always kept.
+    Runs whose output directory already exists (from campaigns executed before
+    this database) are marked as done. Returns the number of runs added.
+    """
+    manifest = make_manifest(args)
+    outdir = os.path.abspath(args.outdir)
+    now = time.time()
+
+    runs = [(scheduler, governor, name, s, g, pos)
+            for s, scheduler in enumerate(args.schedulers)
+            for g, governor in enumerate(args.governors)
+            for pos, (name, _) in enumerate(manifest)]
+    shard = read_shard(args.shard) if os.path.isfile(args.shard) else None
+    if shard is not None:
+        runs = [run for run in runs if run[:3] in shard]
+
+    with conn:
+        set_meta(conn,
+                 outdir=outdir,
+                 corpus=os.path.abspath(args.corpus),
+                 export_dir=os.path.abspath(args.export_dir))
+
+        conn.execute('DELETE FROM tasksets')
+        conn.executemany('INSERT INTO tasksets (name, position, path) VALUES (?, ?, ?)',
+                         [(name, pos, path) for pos, (name, path) in enumerate(manifest)])
+
+        conn.execute("DELETE FROM runs WHERE state = 'planned' AND ("
+                     "taskset NOT IN (SELECT name FROM tasksets) "
+                     f"OR scheduler NOT IN ({','.join('?' * len(args.schedulers))}) "
+                     f"OR governor NOT IN ({','.join('?' * len(args.governors))}))",
+                     args.schedulers + args.governors)
+        if shard is not None:
+            conn.executemany('DELETE FROM runs WHERE id = ?',
+                             [(run['id'],) for run in conn.execute(
+                                 "SELECT * FROM runs WHERE state = 'planned'").fetchall()
+                              if (run['scheduler'], run['governor'], run['taskset']) not in shard])
+
+        before = conn.total_changes
+        conn.executemany(
+            'INSERT OR IGNORE INTO runs (scheduler, governor, taskset, sched_order, gov_order, position) '
+            'VALUES (?, ?, ?, ?, ?, ?)', runs)
+        added = conn.total_changes - before
+
+        # Orders may have changed, e.g. if the list of schedulers changed
+        conn.executemany('UPDATE runs SET sched_order = ? WHERE scheduler = ?',
+                         list(enumerate(args.schedulers)))
+        conn.executemany('UPDATE runs SET gov_order = ? WHERE governor = ?',
+                         list(enumerate(args.governors)))
+        conn.execute('UPDATE runs SET position = '
+                     '(SELECT position FROM tasksets WHERE name = runs.taskset) '
+                     'WHERE taskset IN (SELECT name FROM tasksets)')
+
+        imported = [run['id'] for run in conn.execute("SELECT * FROM runs WHERE state = 'planned'")
+                    if is_nonempty_dir(run_dir(outdir, run))]
+        conn.executemany("UPDATE runs SET state = 'done', finished = ?, message = 'imported' "
+                         "WHERE id = ?", [(now, run_id) for run_id in imported])
+
+    return added
+
+
+# -------------------------------- RUNS ---------------------------------- #
+
+def recover(conn, outdir):
+    """
+    Plans again the runs left running by an interrupted execution, unless
+    their output was already moved to its final place.
+    """
+    with conn:
+        for run in conn.execute("SELECT * FROM runs WHERE state = 'running'").fetchall():
+            if is_nonempty_dir(run_dir(outdir, run)):
+                conn.execute("UPDATE runs SET state = 'done', finished = ? WHERE id = ?",
+                             (time.time(), run['id']))
+            else:
+                conn.execute("UPDATE runs SET state = 'planned', message = 'interrupted' "
+                             "WHERE id = ?", (run['id'],))
+            shutil.rmtree(staging_dir(outdir, run), ignore_errors=True)
+
+
+def input_file(conn, name):
+    # Returns the path of the rt-app configuration of a taskset, or None
+    row = conn.execute('SELECT path FROM tasksets WHERE name = ?', (name,)).fetchone()
+    if row is None:
+        return None
+    if row['path'] is not None:
+        return row['path'] if os.path.isfile(row['path']) else None
+
+    corpus = tscorpus.Corpus(get_meta(conn, 'corpus'))
+    params = tscorpus.parse_taskset_name(name)
+    pos = None if params is None else corpus.find(*params)
+    if pos is None:
+        return None
+    export_dir = get_meta(conn, 'export_dir')
+    os.makedirs(export_dir, exist_ok=True)
+    fname = os.path.join(export_dir, name + '.json')
+    taskset2json.write_rtapp_config(corpus.rtapp_config(pos), fname)
+    return fname
+
+
+def next_run(conn, kernel):
+    """
+    Returns ('RUN', run, file_in, dir_out) with the next run of the given
+    kernel, which is marked as running, ('KERNEL', scheduler) with the next
+    kernel to boot or ('END',) when all runs are completed.
+    """
+    outdir = get_meta(conn, 'outdir')
+    recover(conn, outdir)
+
+    order = 'ORDER BY sched_order, gov_order, position LIMIT 1'
+    while True:
+        run = conn.execute(f"SELECT * FROM runs WHERE state = 'planned' AND scheduler = ? {order}",
+                           (kernel,)).fetchone()
+        if run is None:
+            break
+
+        file_in = input_file(conn, run['taskset'])
+        if file_in is None:
+            with conn:
+                conn.execute("UPDATE runs SET state = 'invalid', message = 'no input file' "
+                             "WHERE id = ?", (run['id'],))
+            continue
+
+        dir_out = staging_dir(outdir, run)
+        shutil.rmtree(dir_out, ignore_errors=True)
+        os.makedirs(dir_out)
+        with conn:
+            conn.execute("UPDATE runs SET state = 'running', attempts = attempts + 1, "
+                         "started = ?, message = NULL WHERE id = ?", (time.time(), run['id']))
+        return 'RUN', run, file_in, dir_out
+
+    scheduler = next_kernel(conn, kernel)
+    if scheduler is not None:
+        return 'KERNEL', scheduler
+    return ('END',)
+
+
+def next_kernel(conn, kernel):
+    # Returns the first kernel other than the given one with planned runs
+    run = conn.execute("SELECT scheduler FROM runs WHERE state = 'planned' AND scheduler != ? "
+                       "ORDER BY sched_order LIMIT 1", (kernel,)).fetchone()
+    return None if run is None else run['scheduler']
+
+
+def fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def commit(conn, run_id):
+    """
+    Moves the staging directory of a running run to its final place and marks
+    the run as done.
+    """
+    outdir = get_meta(conn, 'outdir')
+    run = get_run(conn, run_id)
+    if run['state'] != 'running':
+        raise CampaignError(f"run {run_id} is {run['state']}, not running!")
+
+    src = staging_dir(outdir, run)
+    dst = run_dir(outdir, run)
+    if not os.path.isdir(src):
+        raise CampaignError(f"staging directory {src} not found!")
+    if is_nonempty_dir(dst):
+        raise CampaignError(f"{dst} already exists!")
+
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if os.path.isdir(dst):
+        # Empty directories were created by older versions of test.sh
+        os.rmdir(dst)
+    os.rename(src, dst)
+    fsync_dir(os.path.dirname(dst))
+
+    with conn:
+        conn.execute("UPDATE runs SET state = 'done', finished = ? WHERE id = ?",
+                     (time.time(), run_id))
+
+
+def invalidate(conn, run_id, reason):
+    # Marks a run as invalid, keeping its partial output if any
+    outdir = get_meta(conn, 'outdir')
+    run = get_run(conn, run_id)
+
+    src = staging_dir(outdir, run)
+    if os.path.isdir(src):
+        dst = os.path.join(outdir, INVALID_DIR, run['scheduler'], run['governor'],
+                           '%s.%d.out.d' % (run['taskset'], run['attempts']))
+        shutil.rmtree(dst, ignore_errors=True)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        os.rename(src, dst)
+
+    with conn:
+        conn.execute("UPDATE runs SET state = 'invalid', finished = ?, message = ? WHERE id = ?",
+                     (time.time(), reason, run_id))
+
+
+def retry(conn, run_id, reason, max_attempts):
+    """
+    Marks a run as invalid and plans it again if it was attempted less than
+    max_attempts times. Returns the new state of the run.
+    """
+    invalidate(conn, run_id, reason)
+    if get_run(conn, run_id)['attempts'] >= max_attempts:
+        return 'invalid'
+    with conn:
+        conn.execute("UPDATE runs SET state = 'planned' WHERE id = ?", (run_id,))
+    return 'planned'
+
+
+def replan(conn, state):
+    with conn:
+        return conn.execute("UPDATE runs SET state = 'planned' WHERE state = ?", (state,)).rowcount
+
+
+def print_status(conn):
+    print('scheduler\tgovernor\t' + '\t'.join(STATES))
+    rows = conn.execute('SELECT scheduler, governor, state, COUNT(*) AS count FROM runs '
+                        'GROUP BY scheduler, governor, state '
+                        'ORDER BY sched_order, gov_order').fetchall()
+    table = {}
+    for row in rows:
+        table.setdefault((row['scheduler'], row['governor']), {})[row['state']] = row['count']
+    for (scheduler, governor), states in table.items():
+        print('\t'.join([scheduler, governor] + [str(states.get(s, 0)) for s in STATES]))
+
+    for run in conn.execute("SELECT * FROM runs WHERE state = 'invalid' ORDER BY id"):
+        eprint(f"invalid: {run['scheduler']} {run['governor']} {run['taskset']}: {run['message']}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    planp = subparsers.add_parser('plan', help="Compute the manifest and plan the runs")
+    planp.add_argument('database')
+    planp.add_argument('-o', '--outdir',
+                       default='./out',
+                       help="Where the output of the runs is saved",
+                       )
+    planp.add_argument('-t', '--tasksets',
+                       default='./tasksets',
+                       help="The directory of the tasksets",
+                       )
+    planp.add_argument('--corpus',
+                       default=None,
+                       help="The corpus of the tasksets (default: TASKSETS/corpus.tsc)",
+                       )
+    planp.add_argument('--design',
+                       default=None,
+                       help="The table of the design points (default: TASKSETS/design.tsv)",
+                       )
+    planp.add_argument('--selection',
+                       default=None,
+                       help="The names of the tasksets to execute (default: TASKSETS/selection.txt)",
+                       )
+    planp.add_argument('--shard',
+                       default=None,
+                       help="The runs assigned to this board (default: OUTDIR/shard.tsv)",
+                       )
+    planp.add_argument('--export-dir',
+                       default='/tmp/apedf-tasksets',
+                       help="Where the tasksets in the corpus are exported",
+                       )
+    planp.add_argument('-s', '--schedulers',
+                       nargs='+', required=True,
+                       help="The scheduler variants, in the order in which kernels are booted",
+                       )
+    planp.add_argument('-g', '--governors',
+                       nargs='+', required=True,
+                       help="The governors, in the order in which they are tested",
+                       )
+
+    nextp = subparsers.add_parser('next', help="Print the next run or kernel")
+    nextp.add_argument('database')
+    nextp.add_argument('-k', '--kernel',
+                       required=True,
+                       help="The scheduler variant of the running kernel",
+                       )
+
+    upcomingp = subparsers.add_parser('upcoming', help="Print the kernel to boot next")
+    upcomingp.add_argument('database')
+    upcomingp.add_argument('-k', '--kernel',
+                           required=True,
+                           help="The scheduler variant of the running kernel",
+                           )
+
+    commitp = subparsers.add_parser('commit', help="Save the output of a run")
+    commitp.add_argument('database')
+    commitp.add_argument('run', type=int)
+
+    invalidp = subparsers.add_parser('invalid', help="Mark a run as invalid")
+    invalidp.add_argument('database')
+    invalidp.add_argument('run', type=int)
+    invalidp.add_argument('-r', '--reason',
+                          default='',
+                          help="Why the run is invalid",
+                          )
+
+    retryp = subparsers.add_parser('retry', help="Mark a run as invalid and plan it again")
+    retryp.add_argument('database')
+    retryp.add_argument('run', type=int)
+    retryp.add_argument('-r', '--reason',
+                        default='',
+                        help="Why the run is invalid",
+                        )
+    retryp.add_argument('-m', '--max-attempts',
+                        type=int, default=3,
+                        help="The number of attempts after which the run stays invalid",
+                        )
+
+    replanp = subparsers.add_parser('replan', help="Plan again the runs in a state")
+    replanp.add_argument('database')
+    replanp.add_argument('state',
+                         nargs='?', default='invalid',
+                         choices=['invalid', 'done'],
+                         )
+
+    statusp = subparsers.add_parser('status', help="Print the number of runs in each state")
+    statusp.add_argument('database')
+
+    args = parser.parse_args()
+    if args.command == 'plan':
+        for option, fname in [('corpus', 'corpus.tsc'),
+                              ('design', 'design.tsv'),
+                              ('selection', 'selection.txt')]:
+            if getattr(args, option) is None:
+                setattr(args, option, os.path.join(args.tasksets, fname))
+        if args.shard is None:
+            args.shard = os.path.join(args.outdir, 'shard.tsv')
+    return args
+
+
+def main():
+    args = parse_args()
+
+    try:
+        conn = connect(args.database)
+
+        if args.command == 'plan':
+            added = plan(conn, args)
+            completed, total = counts(conn)
+            print(f"{added} runs added, {completed}/{total} runs completed")
+
+        elif args.command == 'next':
+            result = next_run(conn, args.kernel)
+            completed, total = counts(conn)
+            if result[0] == 'RUN':
+                _, run, file_in, dir_out = result
+                # The run being handed out is not completed yet
+                fields = ['RUN', run['id'], completed, total, run['scheduler'],
+                          run['governor'], run['taskset'], file_in, dir_out]
+            elif result[0] == 'KERNEL':
+                fields = ['KERNEL', result[1], completed, total]
+            else:
+                fields = ['END', completed, total]
+            print('\t'.join(str(f) for f in fields))
+
+        elif args.command == 'upcoming':
+            print(next_kernel(conn, args.kernel) or '')
+
+        elif args.command == 'commit':
+            commit(conn, args.run)
+
+        elif args.command == 'invalid':
+            invalidate(conn, args.run, args.reason)
+
+        elif args.command == 'retry':
+            print(retry(conn, args.run, args.reason, args.max_attempts))
+
+        elif args.command == 'replan':
+            print(f"{replan(conn, args.state)} runs planned again")
+
+        elif args.command == 'status':
+            print_status(conn)
+
+    except (OSError, sqlite3.Error, tscorpus.CorpusFormatError, CampaignError) as error:
+        eprint(f"ERROR: {error}")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+
+"""\
+Discrete-event simulator of SCHED_DEADLINE running rt-app tasksets, to compare
+scheduler variants without a board (and without rebooting it).
+
+Each task is a periodic rt-app thread (absolute timer, run/period from its
+JSON configuration) served by a CBS reservation (dl-runtime, dl-period): a
+task waking up with a deadline in the past or with too much residual budget
+gets a new deadline, and a task that exhausts its budget is throttled until
+its deadline. Execution times are scaled by the capacity of each CPU.
+
+Supported scheduler variants:
+- global: global EDF, the m earliest-deadline tasks run (like push/pull do)
+- apedf-ff, apedf-wf: adaptively partitioned EDF, tasks migrate only when a
+  new job is released on a CPU whose bandwidth (the sum of the bandwidths of
+  the tasks on it) exceeds the per-CPU limit, to the first CPU (or the least
+  loaded one) where they fit; if none, they fall back to global EDF and
+  migrate to an idle CPU or to the one running the latest deadline (see
+  REPORT-2022-11.md)
+
+For each taskset and scheduler the simulator writes an output directory like
+the ones produced by test.sh (OUT/scheduler/governor/taskset.out.d), with one
+rt-app-taskNN-0.log file per task in the format read by collect.py.
+"""
+
+import argparse
+import concurrent.futures
+import heapq
+import json
+import os
+import sys
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+SCHEDULERS = ['global', 'apedf-ff', 'apedf-wf']
+
+# Where tasks are placed before their first activation:
+# - first: all on the first CPU (Core Principle 1 in REPORT-2022-11.md)
+# - spread: round-robin, similar to what CFS does before the tasks switch to
+#   SCHED_DEADLINE (what the kernel patches actually end up doing)
+INITIAL_CPUS = ['first', 'spread']
+
+SCHED_CAPACITY_SCALE = 1024
+
+# Defaults of the sched_rt_{runtime,period}_us sysctls
+RT_RUNTIME_US = 950000
+RT_PERIOD_US = 1000000
+
+# Frequency [kHz] written in the logs, the simulator does not model DVFS
+DEFAULT_FREQ = 1400000
+
+# Remaining execution times below this (us) are considered zero
+EPSILON = 1e-6
+
+# Event kinds, in the order in which events happening at the same time are
+# handled
+EV_REPLENISH = 0
+EV_RELEASE = 1
+EV_SCHED = 2
+
+LOG_COLUMNS = ['#idx', 'perf', 'run', 'period', 'start', 'end', 'rel_st',
+               'slack', 'c_duration', 'c_period', 'wu_lat', 'cpu', 'freq',
+               'dl_runtime', 'dl_period', 'dl_deadline']
+
+
+class Event:
+    __slots__ = ('time', 'kind', 'seq', 'task', 'version')
+
+    def __init__(self, time, kind, seq, task=None, version=0):
+        self.time = time
+        self.kind = kind
+        self.seq = seq
+        self.task = task
+        self.version = version
+
+    def __lt__(self, other):
+        return (self.time, self.kind, self.seq) < (other.time, other.kind, other.seq)
+
+
+class Job:
+    __slots__ = ('release', 'start', 'end', 'cpu')
+
+    def __init__(self, release):
+        self.release = release
+        self.start = None
+        self.end = None
+        self.cpu = None
+
+
+class Task:
+    __slots__ = ('idx', 'run', 'period', 'dl_runtime', 'dl_period', 'bw',
+                 'delay', 'cpu', 'budget', 'deadline', 'remaining', 'ready',
+                 'throttled', 'job', 'njob', 'jobs')
+
+    def __init__(self, idx, config):
+        self.idx = idx
+        self.run = config['run']
+        self.period = config['timer']['period']
+        self.dl_runtime = config['dl-runtime']
+        self.dl_period = config['dl-period']
+        self.bw = self.dl_runtime / self.dl_period
+        self.delay = config.get('delay', 0)
+        self.cpu = 0
+        self.budget = 0.0
+        self.deadline = 0.0
+        self.remaining = 0.0
+        self.ready = False
+        self.throttled = False
+        self.job = None
+        self.njob = 0
+        self.jobs = []
+
+    def key(self):
+        # EDF order, ties broken by task index
+        return (self.deadline, self.idx)
+
+
+# ------------------------------ SIMULATOR ------------------------------- #
+
+class Simulator:
+    """
+    Simulates a taskset on CPUs with the given capacities until end_time (us).
+    """
+
+    def __init__(self, tasks, scheduler, capacities, end_time,
+                 rt_runtime_us=RT_RUNTIME_US, rt_period_us=RT_PERIOD_US,
+                 initial_cpu='first'):
+        self.tasks = tasks
+        self.scheduler = scheduler
+        self.m = len(capacities)
+        self.rates = [c / SCHED_CAPACITY_SCALE for c in capacities]
+        self.end_time = end_time
+
+        # Per-CPU bandwidth limit, like AP-EDF does when placing tasks
+        limit = 1.0 if rt_runtime_us < 0 else rt_runtime_us / rt_period_us
+        self.max_bw = [limit * rate for rate in self.rates]
+
+        self.now = 0.0
+        self.running = [None] * self.m
+        self.events = []
+        self.seq = 0
+        self.version = 0
+        self.sched_time = None
+
+        for task in tasks:
+            task.cpu = 0 if initial_cpu == 'first' else task.idx % self.m
+            self.push(task.delay, EV_RELEASE, task)
+
+    def push(self, time, kind, task=None, version=0):
+        self.seq += 1
+        heapq.heappush(self.events, Event(time, kind, self.seq, task, version))
+
+    def run(self):
+        events = self.events
+        while True:
+            self.drop_stale()
+            if not events or events[0].time > self.end_time:
+                break
+
+            time = events[0].time
+            self.advance(time)
+            while events and events[0].time <= time:
+                event = heapq.heappop(events)
+                if event.kind == EV_RELEASE:
+                    self.release(event.task)
+                elif event.kind == EV_REPLENISH:
+                    self.replenish(event.task)
+            self.schedule()
+
+    # --------------------------- ACCOUNTING ----------------------------- #
+
+    def advance(self, time):
+        # Runs the tasks on the CPUs until time, then handles the completions
+        # and the budget exhaustions happening at that time
+        elapsed = time - self.now
+        self.now = time
+        for cpu, task in enumerate(self.running):
+            if task is None:
+                continue
+            work = elapsed * self.rates[cpu]
+            task.remaining -= work
+            task.budget -= work
+
+            if task.remaining <= EPSILON:
+                self.running[cpu] = None
+                self.complete(task, cpu)
+            elif task.budget <= EPSILON:
+                self.running[cpu] = None
+                self.throttle(task)
+
+    def complete(self, task, cpu):
+        job = task.job
+        job.end = self.now
+        job.cpu = cpu
+        task.jobs.append(job)
+        task.njob += 1
+
+        # Absolute timer: the next job is released one period after the
+        # previous one, or right away if that time already passed (rt-app does
+        # not sleep in that case, so there is no wakeup)
+        release = task.delay + task.njob * task.period
+        if release <= self.now:
+            self.new_job(task, release)
+        else:
+            task.ready = False
+            self.push(release, EV_RELEASE, task)
+
+    def throttle(self, task):
+        task.ready = False
+        task.throttled = True
+        self.push(task.deadline, EV_REPLENISH, task)
+
+    def replenish(self, task):
+        while task.budget <= EPSILON:
+            task.deadline += task.dl_period
+            task.budget += task.dl_runtime
+        task.throttled = False
+        task.ready = True
+
+    def new_job(self, task, release):
+        task.job = Job(release)
+        task.remaining = float(task.run)
+        task.ready = not task.throttled
+
+    def release(self, task):
+        # CBS wakeup rule: keep the current budget and deadline only if the
+        # deadline is in the future and the residual bandwidth is not larger
+        # than the reserved one
+        laxity = task.deadline - self.now
+        if laxity <= 0 or task.budget * task.dl_period > laxity * task.dl_runtime:
+            task.deadline = self.now + task.dl_period
+            task.budget = float(task.dl_runtime)
+        self.new_job(task, self.now)
+
+        if self.scheduler != 'global':
+            task.cpu = self.select_cpu(task)
+
+    # ---------------------------- PLACEMENT ----------------------------- #
+
+    def cpu_bw(self):
+        bw = [0.0] * self.m
+        for task in self.tasks:
+            bw[task.cpu] += task.bw
+        return bw
+
+    def cpu_latest(self, cpu):
+        # The latest deadline among the tasks on the CPU, None if idle
+        task = self.running[cpu]
+        if task is None:
+            if any(t.ready and t.cpu == cpu for t in self.tasks):
+                return max(t.deadline for t in self.tasks if t.ready and t.cpu == cpu)
+            return None
+        return task.deadline
+
+    def select_cpu(self, task):
+        # AP-EDF placement at job release
+        bw = self.cpu_bw()
+        if bw[task.cpu] <= self.max_bw[task.cpu]:
+            return task.cpu
+
+        fits = [c for c in range(self.m)
+                if c != task.cpu and bw[c] + task.bw <= self.max_bw[c]]
+        if fits:
+            if self.scheduler == 'apedf-ff':
+                return fits[0]
+            return min(fits, key=lambda c: (bw[c] - self.max_bw[c], c))
+
+        # Fallback on global EDF: an idle CPU, or the one with the latest
+        # deadline if it is later than the one of the task
+        latest = [self.cpu_latest(c) for c in range(self.m)]
+        idle = [c for c in range(self.m) if latest[c] is None]
+        if idle:
+            return idle[0]
+        target = max(range(self.m), key=lambda c: (latest[c], -c))
+        if latest[target] > task.deadline:
+            return target
+        return task.cpu
+
+    # ---------------------------- SCHEDULING ---------------------------- #
+
+    def schedule(self):
+        ready = [t for t in self.tasks if t.ready]
+        if self.scheduler == 'global':
+            chosen = sorted(ready, key=Task.key)[:self.m]
+            running = [t if t in chosen else None for t in self.running]
+            free = [c for c in range(self.m) if running[c] is None]
+            for task in chosen:
+                if task not in running:
+                    running[free.pop(0)] = task
+        else:
+            running = [None] * self.m
+            for task in ready:
+                current = running[task.cpu]
+                if current is None or task.key() < current.key():
+                    running[task.cpu] = task
+        self.running = running
+
+        next_time = None
+        for cpu, task in enumerate(running):
+            if task is None:
+                continue
+            task.cpu = cpu
+            if task.job.start is None:
+                task.job.start = self.now
+            time = self.now + min(task.remaining, task.budget) / self.rates[cpu]
+            if next_time is None or time < next_time:
+                next_time = time
+
+        # Only the latest scheduling event is valid, older ones are discarded
+        # when they reach the top of the queue
+        if next_time != self.sched_time:
+            self.version += 1
+            self.sched_time = next_time
+            if next_time is not None:
+                self.push(next_time, EV_SCHED, version=self.version)
+
+    def drop_stale(self):
+        events = self.events
+        while events and events[0].kind == EV_SCHED and events[0].version != self.version:
+            heapq.heappop(events)
+
+
+# ------------------------------- OUTPUT --------------------------------- #
+
+def task_log_rows(task, calibration, freq):
+    jobs = task.jobs
+    first = jobs[0].start if jobs else 0
+    for i, job in enumerate(jobs):
+        start = round(job.start)
+        end = round(job.end)
+        next_start = round(jobs[i + 1].start) if i + 1 < len(jobs) else end
+        deadline = round(job.release) + task.period
+        yield [
+            task.idx,
+            task.run // max(calibration, 1),
+            end - start,
+            next_start - start,
+            start,
+            end,
+            start - round(first),
+            deadline - end,
+            task.run,
+            task.period,
+            start - round(job.release),
+            job.cpu,
+            freq,
+            task.dl_runtime * 1000,
+            task.dl_period * 1000,
+            task.dl_period * 1000,
+        ]
+
+
+def write_logs(tasks, names, config, dir_out, freq):
+    os.makedirs(dir_out, exist_ok=True)
+    calibration = config['global'].get('calibration', 1)
+    basename = config['global'].get('log_basename', 'rt-app')
+    for task, name in zip(tasks, names):
+        fname = os.path.join(dir_out, f"{basename}-{name}-0.log")
+        with open(fname, 'w') as outfile:
+            outfile.write(' '.join(LOG_COLUMNS) + '\n')
+            for row in task_log_rows(task, calibration, freq):
+                outfile.write(' '.join(str(v) for v in row) + '\n')
+
+
+# ------------------------------ CAMPAIGN -------------------------------- #
+
+def find_tasksets(paths):
+    fnames = []
+    for path in paths:
+        if os.path.isfile(path):
+            fnames.append(path)
+            continue
+        for dirpath, _, files in os.walk(path):
+            fnames += [os.path.join(dirpath, f) for f in files
+                       if f.startswith('ts_') and f.endswith('.json')]
+    return sorted(fnames)
+
+
+def simulate(fname, scheduler, args):
+    with open(fname, 'r') as infile:
+        config = json.load(infile)
+
+    names = list(config['tasks'])
+    tasks = [Task(i, config['tasks'][name]) for i, name in enumerate(names)]
+    end_time = config['global']['duration'] * 1000000
+    sim = Simulator(tasks, scheduler, args.capacities, end_time,
+                    args.rt_runtime_us, args.rt_period_us, args.initial_cpu)
+    sim.run()
+
+    taskset = os.path.splitext(os.path.basename(fname))[0]
+    dir_out = os.path.join(args.out_dir, scheduler, args.governor, taskset + '.out.d')
+    write_logs(tasks, names, config, dir_out, args.freq)
+    return dir_out
+
+
+def run_unit(unit):
+    # Entry point of worker processes
+    return simulate(*unit)
+
+
+def run_units(units, args):
+    if args.jobs == 1:
+        yield from map(run_unit, units)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        yield from executor.map(run_unit, units, chunksize=8)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    parser.add_argument('paths',
+                        nargs='+',
+                        help="rt-app taskset files, or directories to search for ts_*.json files",
+                        )
+
+    parser.add_argument('-o', '--out-dir',
+                        default='./out-sim',
+                        help="Where to create the output directories",
+                        )
+
+    parser.add_argument('-s', '--schedulers',
+                        nargs='+', choices=SCHEDULERS, default=SCHEDULERS,
+                        help="The scheduler variants to simulate",
+                        )
+
+    parser.add_argument('-g', '--governor',
+                        default='performance',
+                        help="The governor name used for the output directories (frequency is fixed)",
+                        )
+
+    parser.add_argument('-C', '--capacities',
+                        nargs='+', type=int, default=[SCHED_CAPACITY_SCALE] * 4,
+                        help="The capacity of each CPU",
+                        )
+
+    parser.add_argument('-r', '--rt-runtime-us',
+                        type=int, default=RT_RUNTIME_US,
+                        help="The value of kernel.sched_rt_runtime_us (-1 for no per-CPU limit)",
+                        )
+
+    parser.add_argument('-p', '--rt-period-us',
+                        type=int, default=RT_PERIOD_US,
+                        help="The value of kernel.sched_rt_period_us",
+                        )
+
+    parser.add_argument('-i', '--initial-cpu',
+                        choices=INITIAL_CPUS, default='first',
+                        help="Where AP-EDF tasks are placed before their first job",
+                        )
+
+    parser.add_argument('-f', '--freq',
+                        type=int, default=DEFAULT_FREQ,
+                        help="The CPU frequency [kHz] written in the logs",
+                        )
+
+    parser.add_argument('-j', '--jobs',
+                        type=int, default=1,
+                        help="Number of worker processes, 0 to use all CPUs",
+                        )
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.jobs == 0:
+        args.jobs = os.cpu_count()
+
+    fnames = find_tasksets(args.paths)
+    if not fnames:
+        eprint("ERROR: no tasksets found!")
+        return 1
+
+    units = [(fname, scheduler, args) for scheduler in args.schedulers for fname in fnames]
+    for dir_out in run_units(units, args):
+        print(dir_out)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
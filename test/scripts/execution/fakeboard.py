@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+"""\
+A stand-in for a board running test.sh, to try test-on-boards.py (or
+test-on-remote.py) without any board. It must be executed in the directory of
+the fake board, which plays the role of the test directory of the APEDF
+project: tasksets are read from ./tasksets and the output is written to ./out.
+
+It implements the same protocol of test.sh:
+  start           start the experiments in the background, logging to
+                  last_experiment.log
+  check_progress  print the progress of the experiments ([NN/MM], STARTING,
+                  END or RESTART, with exit code 1 when they must be started
+                  again)
+  watch_progress  print the progress of the experiments each time a line is
+                  written in the log, until they stop
+
+The experiments are executed through campaign.py like test.sh does (the shard
+file in ./out is honored), but each run only sleeps for a while and writes a
+fake log in its output directory. Kernel switches are simulated: the running
+kernel is kept in ./kernel and the experiments stop when it must be switched,
+like after a reboot.
+
+To simulate a board that dies, create the file ./DEAD in the directory of the
+board (or pass --die-after): all commands will fail as if the board was not
+reachable and the running experiments will stop.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+import campaign
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+LOG_FILE = 'last_experiment.log'
+PID_FILE = 'fakeboard.pid'
+KERNEL_FILE = 'kernel'
+DEAD_FILE = 'DEAD'
+OUTDIR = 'out'
+
+# Same exit code of ssh when the host is not reachable
+UNREACHABLE = 255
+
+PROGRESS_RE = re.compile(r'\[[0-9]+/[0-9]+\]')
+
+
+def is_dead():
+    return os.path.exists(DEAD_FILE)
+
+
+def is_running():
+    try:
+        with open(PID_FILE) as infile:
+            os.kill(int(infile.read()), 0)
+        return True
+    except (OSError, ValueError):
+        return False
+
+
+def get_kernel(args):
+    try:
+        with open(KERNEL_FILE) as infile:
+            return infile.read().strip()
+    except FileNotFoundError:
+        return args.schedulers[0]
+
+
+# ------------------------------- COMMANDS ------------------------------- #
+
+def start(args):
+    if is_running():
+        eprint("Cannot start experiment: already running!")
+        return 1
+
+    with open(LOG_FILE, 'w') as log:
+        process = subprocess.Popen([sys.executable, os.path.realpath(__file__)]
+                                   + sys.argv[1:-1] + ['run'],
+                                   stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                                   start_new_session=True)
+    with open(PID_FILE, 'w') as outfile:
+        print(process.pid, file=outfile)
+    return 0
+
+
+def get_progress(line):
+    # Same as get_progress in test.sh
+    if 'All tests successful' in line:
+        return 'END'
+    if 'Swapping kernel' in line:
+        return 'RESTART'
+    match = PROGRESS_RE.search(line)
+    return match.group(0) if match else ''
+
+
+def check_progress(args):
+    try:
+        with open(LOG_FILE) as infile:
+            lines = infile.read().splitlines()
+    except FileNotFoundError:
+        lines = []
+
+    for line in reversed(lines):
+        progress = get_progress(line)
+        if progress in ('END', 'RESTART'):
+            print(progress)
+            return 0 if progress == 'END' else 1
+        if progress:
+            if is_running():
+                print(progress)
+                return 0
+            print('RESTART')
+            return 1
+
+    # Still planning the campaign, before the first run
+    if is_running():
+        print('STARTING')
+        return 0
+
+    print('ERROR')
+    return 1
+
+
+def watch_progress(args):
+    check_progress(args)
+    if not is_running():
+        return 0
+
+    with open(LOG_FILE) as infile:
+        infile.seek(0, os.SEEK_END)
+        while is_running() and not is_dead():
+            line = infile.readline()
+            if not line:
+                time.sleep(0.1)
+                continue
+            progress = get_progress(line)
+            if progress:
+                print(progress, flush=True)
+
+    if is_dead():
+        return UNREACHABLE
+    return check_progress(args)
+
+
+def run(args):
+    database = os.path.join(OUTDIR, 'campaign.db')
+    conn = campaign.connect(database)
+    plan_args = argparse.Namespace(
+        outdir=OUTDIR,
+        tasksets=args.tasksets,
+        corpus=os.path.join(args.tasksets, 'corpus.tsc'),
+        design=os.path.join(args.tasksets, 'design.tsv'),
+        selection=os.path.join(args.tasksets, 'selection.txt'),
+        shard=os.path.join(OUTDIR, 'shard.tsv'),
+        export_dir=os.path.join(OUTDIR, '.export'),
+        schedulers=args.schedulers,
+        governors=args.governors,
+    )
+    print('Planning the experiments...', flush=True)
+    campaign.plan(conn, plan_args)
+
+    executed = 0
+    while not is_dead():
+        result = campaign.next_run(conn, get_kernel(args))
+        completed, total = campaign.counts(conn)
+
+        # Like after a reboot, the experiments are no longer running as soon
+        # as the swap (or the end) is visible in the log
+        if result[0] == 'KERNEL':
+            with open(KERNEL_FILE, 'w') as outfile:
+                print(result[1], file=outfile)
+            os.remove(PID_FILE)
+            print(f"+ {result[1]} kernel: Swapping kernel!", flush=True)
+            return 0
+
+        if result[0] == 'END':
+            os.remove(PID_FILE)
+            print(" + All tests successful!!", flush=True)
+            return 0
+
+        _, run, _, dir_out = result
+        print(f"+ [{completed + 1}/{total}] {run['scheduler']} {run['governor']} "
+              f"{run['taskset']}: Starting... ", end='', flush=True)
+        time.sleep(args.run_time)
+        with open(os.path.join(dir_out, 'fake.log'), 'w') as outfile:
+            print(get_kernel(args), run['governor'], run['taskset'], file=outfile)
+        campaign.commit(conn, run['id'])
+        print('DONE!', flush=True)
+
+        executed += 1
+        if args.die_after is not None and executed >= args.die_after:
+            open(DEAD_FILE, 'w').close()
+
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    parser.add_argument('-t', '--tasksets',
+                        default='./tasksets',
+                        help="The directory of the tasksets",
+                        )
+    parser.add_argument('-s', '--schedulers',
+                        nargs='+', default=['global', 'apedf-ff', 'apedf-wf'],
+                        help="The scheduler variants, like SCHEDULERS in test.sh",
+                        )
+    parser.add_argument('-g', '--governors',
+                        nargs='+', default=['performance', 'schedutil'],
+                        help="The governors, like GOVERNORS in test.sh",
+                        )
+    parser.add_argument('-r', '--run-time',
+                        type=float, default=0.1,
+                        help="How long each run lasts in seconds",
+                        )
+    parser.add_argument('-d', '--die-after',
+                        type=int, default=None,
+                        help="Die after executing this number of runs",
+                        )
+    parser.add_argument('command',
+                        choices=['start', 'check_progress', 'watch_progress', 'run'],
+                        )
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if is_dead():
+        eprint("ssh: connect to host fakeboard port 22: No route to host")
+        return UNREACHABLE
+
+    try:
+        if args.command == 'start':
+            return start(args)
+        if args.command == 'check_progress':
+            return check_progress(args)
+        if args.command == 'watch_progress':
+            return watch_progress(args)
+        return run(args)
+    except (OSError, campaign.CampaignError) as error:
+        eprint(f"ERROR: {error}")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+"""\
+Inventory of the boards supervised by test-on-boards.py and watched by
+test-on-remote.py, one board per line (# starts a comment):
+  NAME HOST TESTDIR [COMMAND]
+where HOST is the destination for ssh or - for a board on this machine,
+TESTDIR is the test directory of the APEDF project on the board and COMMAND
+is the command implementing the test.sh protocol, executed in TESTDIR. Names
+must be unique, they identify the board in the files of the supervisors.
+"""
+
+import shlex
+
+DEFAULT_COMMAND = './test.sh'
+
+
+class InventoryError(Exception):
+    pass
+
+
+class Board:
+    # A board of the inventory, commands are executed in its test directory
+    def __init__(self, name, host, testdir, command=DEFAULT_COMMAND):
+        self.name = name
+        self.host = host
+        self.testdir = testdir
+        self.command = command
+
+    def is_local(self):
+        return self.host == '-'
+
+    def ssh_options(self):
+        # Options of the ssh commands, extended by the supervisors
+        return ['-o', 'BatchMode=yes']
+
+    def argv(self, cmd):
+        # The command line executing a shell command in the test directory
+        cmd = f"cd {shlex.quote(self.testdir)} && {cmd}"
+        if self.is_local():
+            return ['sh', '-c', cmd]
+        return ['ssh', *self.ssh_options(), self.host, cmd]
+
+
+def read_inventory(fname, board_class=Board):
+    # Returns one board_class object per board of the inventory
+    boards = []
+    with open(fname) as infile:
+        for line in infile:
+            fields = line.split('#', 1)[0].strip().split(None, 3)
+            if not fields:
+                continue
+            if len(fields) < 3:
+                raise InventoryError(f"invalid inventory line: {line.strip()}")
+            boards.append(board_class(*fields))
+
+    names = [board.name for board in boards]
+    if not boards or len(set(names)) != len(names):
+        raise InventoryError(f"{fname}: board names must be unique and not empty!")
+    return boards
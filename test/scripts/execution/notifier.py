@@ -31,6 +31,10 @@ def notify_reboot():
     return notify_send("Performing reboot, please re-start experiment!!")
 
 
+def notify_kexec():
+    return notify_send("Switching kernel with kexec, the experiment will resume by itself")
+
+
 def notify_stuck():
     if len (sys.argv) > 2:
         return notify_send("Power Meter is " + ' '.join(sys.argv[2:]))
@@ -59,6 +63,7 @@ def main():
         'progress': notify_progress,
         'stuck': notify_stuck,
         'reboot': notify_reboot,
+        'kexec': notify_kexec,
         'finish': notify_finish,
     }
 
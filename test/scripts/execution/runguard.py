@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+
+"""\
+Watches a run while rt-app executes and kills it as soon as the run is bound
+to be invalid, instead of discovering it once the run is over:
+- the power meter is stuck: as in powerstuck.awk, the run is invalid if the
+  longest sequence of rows with the same value in the power column covers at
+  least 10% of the rows of the log; the run is killed when this holds even if
+  the meter keeps sending rows until the end of the run at (a margin above)
+  the rate observed so far
+- the power meter is empty: no rows were received for a while
+- a thermal excursion: a zone went above the discard temperature
+
+The guard follows the files written by the monitors in the ramfs (the binary
+capture of the serial of slogger.py --capture and the samples of
+thermsampler.py record), keeping incremental state, and kills every process in
+the cgroup of the tasksets when the run is invalid. The reason is written to
+the verdict file, which test.sh checks after the run to retry it.
+"""
+
+import argparse
+import json
+import math
+import os
+import signal
+import struct
+import sys
+import time
+
+import slogbin
+import thermbin
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+class Stop(Exception):
+    pass
+
+
+def stop_handler(signum, frame):
+    raise Stop()
+
+
+# Same constants of powerstuck.awk
+POWER_NUM_FIELDS = 17
+POWER_FIELD = 7
+POWER_STUCK_RATIO = 0.10
+POWER_MIN_ROWS = 10
+
+# The rate of the power meter is estimated on at least this many seconds of
+# the capture, and the rows it may still send are overestimated by this factor
+POWER_MIN_SPAN = 2.0
+POWER_RATE_MARGIN = 1.5
+
+# Tasks start after this delay (the delay of each task in taskset2json.py)
+RTAPP_DELAY = 0.5
+
+
+# ------------------------------- FOLLOWERS ------------------------------ #
+
+class Follower:
+    # Reads the bytes appended to a file since the last call
+    def __init__(self, fname):
+        self.fname = fname
+        self.fd = None
+        self.data = b''
+
+    def poll(self):
+        if self.fd is None:
+            try:
+                self.fd = os.open(self.fname, os.O_RDONLY)
+            except FileNotFoundError:
+                return False
+        while True:
+            chunk = os.read(self.fd, 1 << 16)
+            if not chunk:
+                return True
+            self.data += chunk
+
+    def consume(self, size):
+        chunk, self.data = self.data[:size], self.data[size:]
+        return chunk
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+
+
+class PowerState:
+    """
+    Incremental version of powerstuck.awk on a binary capture of the serial:
+    counts the rows and keeps the length of the current and of the longest
+    sequence of rows with the same power value.
+    """
+
+    def __init__(self, fname):
+        self.follower = Follower(fname)
+        self.header = None
+        self.line = b''
+        self.rows = 0
+        self.last = None
+        self.count = 0
+        self.longest = 0
+        # Rows and CLOCK_MONOTONIC time (in ns) of the first and last blocks
+        self.first = None
+        self.stamp = None
+
+    def add_line(self, line):
+        self.rows += 1
+        fields = line.rstrip(b'\r').split(b',')
+        if len(fields) != POWER_NUM_FIELDS:
+            return
+        current = fields[POWER_FIELD]
+        if current != self.last:
+            self.last = current
+            self.count = 0
+        self.count += 1
+        self.longest = max(self.longest, self.count)
+
+    def update(self):
+        if not self.follower.poll():
+            return
+        data = self.follower
+        if self.header is None:
+            if len(data.data) < slogbin.SLOG_HEADER.size:
+                return
+            self.header = slogbin.unpack_header(data.consume(slogbin.SLOG_HEADER.size),
+                                                data.fname)
+
+        end = 0
+        for stamp, start, length in slogbin.iter_blocks(data.data, 0):
+            lines = (self.line + data.data[start:start + length]).split(b'\n')
+            self.line = lines.pop()
+            for line in lines:
+                self.add_line(line)
+            if self.first is None:
+                self.first = (self.rows, stamp)
+            self.stamp = stamp
+            end = start + length
+        data.consume(end)
+
+    def rate(self):
+        # Rows per second observed so far, None if not enough data
+        if self.first is None:
+            return None
+        rows, stamp = self.first
+        span = (self.stamp - stamp) / 1e9
+        if span < POWER_MIN_SPAN:
+            return None
+        return (self.rows - rows) / span
+
+    def stuck(self, remaining):
+        """
+        True if the log will be stuck at the end of the run, even if rows are
+        received at a margin above the observed rate in the remaining seconds.
+        """
+        rate = self.rate()
+        if rate is None or self.rows < POWER_MIN_ROWS:
+            return False
+        max_rows = self.rows + math.ceil(remaining * rate * POWER_RATE_MARGIN)
+        return self.longest >= POWER_STUCK_RATIO * max_rows
+
+
+class ThermState:
+    # Keeps the maximum temperature sampled in each zone
+    def __init__(self, fname):
+        self.follower = Follower(fname)
+        self.num_zones = None
+        self.maxima = []
+
+    def update(self):
+        if not self.follower.poll():
+            return
+        data = self.follower
+        if self.num_zones is None:
+            header = thermbin.unpack_header(data.data, data.fname)
+            if header is None:
+                return
+            names, _, size = header
+            data.consume(size)
+            self.num_zones = len(names)
+            self.maxima = [-math.inf] * self.num_zones
+
+        count = 0
+        for _, sample in thermbin.iter_samples(data.data, self.num_zones):
+            self.maxima = [max(m, t / 1000.0) for m, t in zip(self.maxima, sample)]
+            count += 1
+        data.consume(count * thermbin.record_struct(self.num_zones).size)
+
+
+# -------------------------------- GUARD --------------------------------- #
+
+def kill_cgroup(cgroup):
+    # Kills all the processes of the cgroup, with cgroup.kill if available
+    path = os.path.join('/sys/fs/cgroup', cgroup)
+    try:
+        with open(os.path.join(path, 'cgroup.kill'), 'w') as outfile:
+            outfile.write('1')
+        return
+    except OSError:
+        pass
+
+    with open(os.path.join(path, 'cgroup.procs')) as infile:
+        pids = [int(pid) for pid in infile.read().split()]
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+def run_duration(args):
+    # The duration of the run: the one of the rt-app configuration, if given,
+    # capped by the timeout of rt-app
+    duration = args.duration
+    if args.rtapp_config:
+        with open(args.rtapp_config) as infile:
+            config = json.load(infile)
+        duration = min(duration, config['global']['duration'] + RTAPP_DELAY)
+    return duration
+
+
+def verdict(args, power, therm, elapsed):
+    # Returns why the run is invalid, or None
+    for zone, temp in enumerate(therm.maxima):
+        if temp > args.therm_discard:
+            return f"thermal zone {zone} reached {temp:g} C"
+    if power.stuck(max(args.run_duration - elapsed, 0)):
+        return f"power meter stuck ({power.longest} equal rows out of {power.rows})"
+    if args.power and power.rows == 0 and elapsed >= args.empty_after:
+        return f"power meter empty after {elapsed:.0f}s"
+    return None
+
+
+def guard(args):
+    power = PowerState(args.power)
+    therm = ThermState(args.therm)
+    start = time.monotonic()
+    reason = None
+
+    try:
+        while reason is None:
+            time.sleep(args.interval)
+            if args.power:
+                power.update()
+            if args.therm:
+                therm.update()
+            reason = verdict(args, power, therm, time.monotonic() - start)
+    except Stop:
+        pass
+    finally:
+        power.follower.close()
+        therm.follower.close()
+
+    return reason
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    parser.add_argument('-o', '--verdict',
+                        required=True,
+                        help="Where to write why the run is invalid, if it is",
+                        )
+    parser.add_argument('-c', '--cgroup',
+                        required=True,
+                        help="The cgroup whose processes are killed when the run is invalid",
+                        )
+    parser.add_argument('-p', '--power',
+                        default=None,
+                        help="The binary capture of the power meter serial",
+                        )
+    parser.add_argument('-t', '--therm',
+                        default=None,
+                        help="The thermal samples file",
+                        )
+    parser.add_argument('-d', '--duration',
+                        type=float, required=True,
+                        help="The maximum duration of the run in seconds (the timeout of rt-app)",
+                        )
+    parser.add_argument('-r', '--rtapp-config',
+                        default=None,
+                        help="The rt-app configuration of the run, to read its duration",
+                        )
+    parser.add_argument('-T', '--therm-discard',
+                        type=float, default=70,
+                        help="The temperature in Celsius above which the run is invalid",
+                        )
+    parser.add_argument('-e', '--empty-after',
+                        type=float, default=5,
+                        help="The seconds after which a power meter that sent no rows is empty",
+                        )
+    parser.add_argument('-i', '--interval',
+                        type=float, default=0.5,
+                        help="How often in seconds the files are checked",
+                        )
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    signal.signal(signal.SIGINT, stop_handler)
+    signal.signal(signal.SIGTERM, stop_handler)
+
+    try:
+        args.run_duration = run_duration(args)
+        reason = guard(args)
+
+        # Not interrupted before the verdict is written, test.sh waits for us
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        if reason is None:
+            return 0
+        with open(args.verdict, 'w') as outfile:
+            print(reason, file=outfile)
+        kill_cgroup(args.cgroup)
+    except (OSError, KeyError, ValueError, struct.error) as error:
+        eprint(f"ERROR: {error}")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
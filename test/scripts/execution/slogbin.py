@@ -0,0 +1,67 @@
+"""\
+Binary capture format of the serial written by slogger.py --capture and read
+by slogger.py --decode, runguard.py and collect.py. All values are
+little-endian:
+- header: magic, version, bits per byte on the line, baudrate
+- then one record per read: block index, CLOCK_MONOTONIC time in ns taken
+  right after the read (i.e., when the last byte of the block was already
+  received), length of the block, followed by the raw bytes
+"""
+
+import struct
+
+SLOG_MAGIC = b'SLOGBIN\0'
+SLOG_VERSION = 1
+SLOG_HEADER = struct.Struct('<8sHHI')
+SLOG_BLOCK = struct.Struct('<IqI')
+
+
+def pack_header(bits, baudrate):
+    return SLOG_HEADER.pack(SLOG_MAGIC, SLOG_VERSION, bits, baudrate)
+
+
+def unpack_header(data, fname):
+    # Returns the bits per byte and the baudrate of a capture
+    magic, version, bits, baudrate = SLOG_HEADER.unpack_from(data)
+    if magic != SLOG_MAGIC or version != SLOG_VERSION:
+        raise ValueError(f"{fname} is not a serial capture file")
+    return bits, baudrate
+
+
+def iter_blocks(data, offset=SLOG_HEADER.size):
+    """
+    Yields the time in ns, the offset of the bytes and the length of each
+    complete block of data starting at offset, then stops at the first
+    truncated one; data may be a capture that is still being written.
+    """
+    while offset + SLOG_BLOCK.size <= len(data):
+        _, stamp, length = SLOG_BLOCK.unpack_from(data, offset)
+        start = offset + SLOG_BLOCK.size
+        if start + length > len(data):
+            return
+        yield stamp, start, length
+        offset = start + length
+
+
+def read_capture(fname):
+    """
+    Returns the bits per byte and baudrate of a capture, the concatenation of
+    its blocks and, for each block, the offset of its end in the
+    concatenation and its time in ns. A truncated last block is ignored.
+    """
+    with open(fname, 'rb') as infile:
+        data = infile.read()
+
+    bits, baudrate = unpack_header(data, fname)
+
+    chunks = []
+    ends = []
+    stamps = []
+    total = 0
+    for stamp, start, length in iter_blocks(data):
+        chunks.append(data[start:start + length])
+        total += length
+        ends.append(total)
+        stamps.append(stamp)
+
+    return bits, baudrate, b''.join(chunks), ends, stamps
@@ -14,12 +14,17 @@ Install pyserial library:
     sys.exit(1)
 
 # Other Imports
+import bisect
 import os
+import select
+import struct
+import time
 from typing import Literal
 from dataclasses import dataclass, field
 from argparse_dataclass import ArgumentParser
-from signal import signal, SIGINT
+from signal import signal, SIGINT, SIGTERM, SIG_IGN
 from queue import Queue,Empty
+from slogbin import SLOG_BLOCK, pack_header, read_capture
 
 # Port Configuration Parameters: pass these as command-line arguments
 @dataclass
@@ -30,6 +35,20 @@ class SerialData:
     parity:     Literal['N', 'E', 'O', 'M', 'S']    = 'N'
     stopbits:   Literal[1, 2]                       = 1
     rtscts:     Literal[0, 1]                       = 0
+    # Binary capture: when set, raw blocks are written to this file instead of
+    # lines to STDOUT (see capture())
+    capture:    str                                 = ''
+    # Prints the lines of a binary capture to STDOUT, without opening the port
+    decode:     str                                 = ''
+    # When decoding, prefix each line with its CLOCK_MONOTONIC time in seconds
+    timestamps: bool                                = False
+    # Size of the capture buffer, blocks are written when it is full
+    blocksize:  int                                 = 65536
+    # Seconds after which the capture buffer is written even if not full, so
+    # that the capture can be followed while it is written (see runguard.py)
+    flush:      float                               = 1.0
+    # Seconds between reads, letting bytes accumulate in the tty buffer
+    interval:   float                               = 0.05
 
 def read_args():
     parser = ArgumentParser(SerialData)
@@ -51,10 +70,99 @@ def handler(signal_received, frame):
     quit_signal.put(True)
     abort_signal.put(True)
 
-def main(quit_signal):
-    signal(SIGINT, handler)
+# Reads shorter than this are not attempted, the buffer is written first
+SLOG_MIN_READ = 4096
+
+# Set by stop_handler and checked by the capture loop between reads, so that
+# a signal never lands in the middle of the bookkeeping of the buffer
+stop_requested = False
+
+def stop_handler(signal_received, frame):
+    global stop_requested
+    stop_requested = True
+
+def bits_per_byte(serial_data):
+    # Start bit, data bits, parity bit and stop bits
+    return 1 + serial_data.bytesize + (serial_data.parity != 'N') + serial_data.stopbits
+
+def capture(serial_port, serial_data):
+    """
+    Reads large blocks from the port into a preallocated buffer, stamping each
+    one with CLOCK_MONOTONIC (the clock used by rt-app), and writes them to
+    the capture file when the buffer is full or every serial_data.flush
+    seconds. Nothing is decoded: lines are split in post-processing (see
+    decode()).
+    """
+    signal(SIGINT, stop_handler)
+    signal(SIGTERM, stop_handler)
+
+    fd = serial_port.fileno()
+    buffer = bytearray(max(serial_data.blocksize, SLOG_BLOCK.size + SLOG_MIN_READ))
+    view = memoryview(buffer)
+    used = 0
+    index = 0
+    last_write = time.monotonic()
+
+    out = os.open(serial_data.capture, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    os.write(out, pack_header(bits_per_byte(serial_data), serial_data.baudrate))
+    try:
+        while not stop_requested:
+            time.sleep(serial_data.interval)
+            readable, _, _ = select.select([fd], [], [], serial_data.flush)
+            if readable:
+                start = used + SLOG_BLOCK.size
+                length = os.readv(fd, [view[start:]])
+                stamp = time.clock_gettime_ns(time.CLOCK_MONOTONIC)
+                if length == 0:
+                    # End of file, the port went away
+                    break
+                SLOG_BLOCK.pack_into(buffer, used, index, stamp, length)
+                used = start + length
+                index += 1
+
+            now = time.monotonic()
+            if used > 0 and (len(buffer) - used < SLOG_BLOCK.size + SLOG_MIN_READ
+                             or now - last_write >= serial_data.flush):
+                os.write(out, view[:used])
+                used = 0
+                last_write = now
+    finally:
+        signal(SIGINT, SIG_IGN)
+        signal(SIGTERM, SIG_IGN)
+        os.write(out, view[:used])
+        os.close(out)
+
+    return 0
+
+def decode(serial_data):
+    bits, baudrate, stream, ends, stamps = read_capture(serial_data.decode)
+    if not serial_data.timestamps:
+        sys.stdout.buffer.write(stream)
+        return 0
+
+    # Bytes are received at a constant rate within each block, so each line
+    # is stamped with the time its last byte was received
+    byte_ns = bits * 1e9 / baudrate
+    start = 0
+    while start < len(stream):
+        end = stream.find(b'\n', start)
+        end = len(stream) if end < 0 else end + 1
+        block = bisect.bisect_left(ends, end)
+        stamp = stamps[block] - (ends[block] - end) * byte_ns
+        sys.stdout.buffer.write(b'%.6f,' % (stamp / 1e9) + stream[start:end])
+        start = end
+    return 0
 
+def main(quit_signal):
     serial_data = read_args()
+    if serial_data.decode:
+        try:
+            return decode(serial_data)
+        except (OSError, ValueError, struct.error) as error:
+            eprint(f"ERROR: {error}")
+            return 1
+
+    signal(SIGINT, handler)
 
     serial_port = None
     try:
@@ -70,6 +178,9 @@ def main(quit_signal):
         eprint(f"ERROR: {error}")
         return 4
 
+    if serial_data.capture:
+        return capture(serial_port, serial_data)
+
     # Main loop
     quit = False
     while not quit:
@@ -0,0 +1,79 @@
+"""\
+Binary format of the thermal samples written by thermsampler.py record and
+read by thermsampler.py, runguard.py and collect.py. The file starts with a
+header:
+- magic: 8 bytes, THERMBIN
+- version: uint16
+- num_zones: uint16
+- interval: uint32, the sampling interval in us
+- the type of each thermal zone: num_zones strings of 20 bytes, NUL-padded
+followed by one record per sample:
+- time: int64, CLOCK_MONOTONIC timestamp in ns
+- temp: num_zones int32, the temperature of each zone in millidegrees Celsius
+All values are little-endian. A truncated last record must be ignored.
+"""
+
+import struct
+
+THERM_MAGIC = b'THERMBIN'
+THERM_VERSION = 1
+THERM_HEADER = struct.Struct('<8sHHI')
+THERM_ZONE_NAME = struct.Struct('20s')
+
+
+def record_struct(num_zones):
+    return struct.Struct('<q%di' % num_zones)
+
+
+def pack_header(interval_us, names):
+    return (THERM_HEADER.pack(THERM_MAGIC, THERM_VERSION, len(names), interval_us)
+            + b''.join(THERM_ZONE_NAME.pack(name.encode()) for name in names))
+
+
+def unpack_header(data, fname):
+    """
+    Returns the type of each zone, the sampling interval in us and the size
+    of the header, or None if data does not hold the whole header yet.
+    """
+    if len(data) < THERM_HEADER.size:
+        return None
+    magic, version, num_zones, interval_us = THERM_HEADER.unpack_from(data)
+    if magic != THERM_MAGIC or version != THERM_VERSION:
+        raise ValueError(f"{fname} is not a thermal samples file")
+
+    size = THERM_HEADER.size + num_zones * THERM_ZONE_NAME.size
+    if len(data) < size:
+        return None
+    names = [THERM_ZONE_NAME.unpack_from(data, THERM_HEADER.size + i * THERM_ZONE_NAME.size)[0]
+             .rstrip(b'\0').decode(errors='replace') for i in range(num_zones)]
+    return names, interval_us, size
+
+
+def iter_samples(data, num_zones, offset=0):
+    # Yields the time in ns and the temperatures in millidegrees Celsius of
+    # each complete record of data starting at offset
+    rec = record_struct(num_zones)
+    end = offset + (len(data) - offset) // rec.size * rec.size
+    for sample in rec.iter_unpack(memoryview(data)[offset:end]):
+        yield sample[0], sample[1:]
+
+
+def read_samples(fname):
+    """
+    Returns the type of each zone, the time of each sample in seconds and the
+    temperature of each zone in each sample in Celsius.
+    """
+    with open(fname, 'rb') as infile:
+        data = infile.read()
+
+    header = unpack_header(data, fname)
+    if header is None:
+        raise ValueError(f"{fname} is truncated")
+    names, _, offset = header
+
+    times = []
+    temps = []
+    for stamp, sample in iter_samples(data, len(names), offset):
+        times.append(stamp / 1e9)
+        temps.append([temp / 1000.0 for temp in sample])
+    return names, times, temps
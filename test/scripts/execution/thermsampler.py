@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+
+"""\
+Samples the temperature of all thermal zones during an experiment, with as
+little interference as possible with the tasks under test: a single process
+keeps the thermal_zone*/temp files open and reads them with pread at a fixed
+rate, pinned to CPUs outside the cgroup under test.
+
+Samples are written as binary records (buffered and flushed every few
+samples) to a file that is meant to be in the ramfs, see thermbin.py for the
+format.
+
+The cooldown command waits until all zones are at or below a threshold before
+the next run. Instead of polling at a fixed rate, it fits a Newtonian cooling
+model on the temperatures it reads, T(t) = T_a + (T_0 - T_a) exp(-t / tau) for
+each zone, and sleeps until the time at which the model predicts that the
+hottest zone will cross the threshold (or a fraction of that time, to make up
+for errors of the model), checking again afterwards. The model fitted in each
+cooldown (tau and T_a of each zone) is saved in a state file, so that the next
+cooldown can predict the crossing time from its first reading. The duration
+of each cooldown is appended to a log file.
+
+The model is fitted on the readings of the cooldowns only, not on the samples
+recorded during the runs: recording stops when a run ends, so those samples
+cover the board heating up under a changing load, from which the ambient
+temperature the board cools down to cannot be estimated.
+
+Commands:
+  record    sample the temperatures until interrupted by SIGINT or SIGTERM
+  dump      print the samples of a file as text, one line per sample: the
+            time in seconds followed by the temperature of each zone in
+            Celsius
+  cooldown  wait until all zones are cool enough, exits with 2 on timeout
+"""
+
+import argparse
+import glob
+import json
+import math
+import os
+import signal
+import struct
+import sys
+import time
+
+import thermbin
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+THERM_ZONES_GLOB = '/sys/class/thermal/thermal_zone*'
+
+
+# ------------------------------- RECORD --------------------------------- #
+
+def parse_cpus(spec):
+    # A cpu list as in cpuset.cpus, e.g. "0-3,6"
+    cpus = set()
+    for part in spec.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.update(range(int(first), int(last) + 1))
+        elif part:
+            cpus.add(int(part))
+    return cpus
+
+
+def zone_type(zone):
+    try:
+        with open(os.path.join(zone, 'type')) as infile:
+            return infile.read().strip()
+    except OSError:
+        return os.path.basename(zone)
+
+
+def read_temp(fd):
+    return int(os.pread(fd, 32, 0))
+
+
+def open_zones():
+    # Same order as the thermal_zone*/temp glob of older versions of test.sh,
+    # which wrote therm.log
+    zones = sorted(glob.glob(THERM_ZONES_GLOB))
+    return zones, [os.open(os.path.join(zone, 'temp'), os.O_RDONLY) for zone in zones]
+
+
+# Set by stop_handler and checked by record() between samples, so that a
+# signal never lands between writing the buffer and clearing it
+stop_requested = False
+
+
+def stop_handler(signum, frame):
+    global stop_requested
+    stop_requested = True
+
+
+def record(args):
+    zones, fds = open_zones()
+    rec = thermbin.record_struct(len(fds))
+    interval_ns = int(args.interval * 1e9)
+
+    if args.cpus:
+        os.sched_setaffinity(0, parse_cpus(args.cpus))
+
+    out = os.open(args.outfile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    os.write(out, thermbin.pack_header(interval_ns // 1000, [zone_type(zone) for zone in zones]))
+
+    buffer = bytearray()
+    pending = 0
+    signal.signal(signal.SIGINT, stop_handler)
+    signal.signal(signal.SIGTERM, stop_handler)
+    try:
+        deadline = time.clock_gettime_ns(time.CLOCK_MONOTONIC)
+        while not stop_requested:
+            now = time.clock_gettime_ns(time.CLOCK_MONOTONIC)
+            buffer += rec.pack(now, *[read_temp(fd) for fd in fds])
+            pending += 1
+            if pending >= args.flush:
+                os.write(out, buffer)
+                buffer.clear()
+                pending = 0
+
+            # Deadlines are absolute, missed ones are skipped
+            deadline += interval_ns
+            now = time.clock_gettime_ns(time.CLOCK_MONOTONIC)
+            if deadline < now:
+                deadline += (now - deadline) // interval_ns * interval_ns + interval_ns
+            time.sleep((deadline - now) / 1e9)
+    finally:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        if buffer:
+            os.write(out, buffer)
+        os.close(out)
+        for fd in fds:
+            os.close(fd)
+
+
+# ------------------------------- COOLDOWN ------------------------------- #
+
+def fit_cooling(times, temps, resolution=0.1):
+    """
+    Fits T(t) = T_a + (T_0 - T_a) exp(-t / tau) on the samples of a zone,
+    returns (tau, T_a) or None if the zone is not cooling down. The ambient
+    temperature is searched on a grid below the lowest sample, fitting for
+    each candidate a line on log(T - T_a) with least squares.
+    """
+    import numpy as np
+
+    t = np.asarray(times, dtype=np.float64)
+    y = np.asarray(temps, dtype=np.float64)
+    if len(y) < 3 or y[0] - y[-1] < resolution:
+        return None
+
+    ambient = y.min() - np.geomspace(resolution, 50.0, 200)[:, None]
+    z = np.log(y[None, :] - ambient)
+    t_mean = t.mean()
+    slope = ((t - t_mean) * (z - z.mean(axis=1, keepdims=True))).sum(axis=1) \
+        / ((t - t_mean) ** 2).sum()
+    intercept = z.mean(axis=1) - slope * t_mean
+    fitted = ambient + np.exp(intercept[:, None] + slope[:, None] * t[None, :])
+    sse = ((fitted - y[None, :]) ** 2).sum(axis=1)
+    sse[slope >= 0] = np.inf
+
+    best = int(np.argmin(sse))
+    if not np.isfinite(sse[best]):
+        return None
+    return -1.0 / float(slope[best]), float(ambient[best, 0])
+
+
+def time_to_threshold(model, temp, threshold):
+    # Seconds until a zone at temp cools down to threshold, inf if never
+    tau, ambient = model
+    if temp <= threshold:
+        return 0.0
+    if ambient >= threshold or tau <= 0:
+        return math.inf
+    return tau * math.log((temp - ambient) / (threshold - ambient))
+
+
+def load_models(fname, num_zones):
+    try:
+        with open(fname) as infile:
+            models = json.load(infile)
+    except (OSError, ValueError):
+        return [None] * num_zones
+    if not isinstance(models, list) or len(models) != num_zones:
+        return [None] * num_zones
+    return [tuple(m) if m is not None else None for m in models]
+
+
+def cooldown(args):
+    """
+    Waits until all zones are at or below the threshold, returns the duration
+    of the cooldown, the duration first predicted (nan if never) and whether
+    the timeout expired.
+    """
+    _, fds = open_zones()
+    models = load_models(args.state, len(fds)) if args.state else [None] * len(fds)
+    fitted = [False] * len(fds)
+
+    start = time.monotonic()
+    times = []
+    history = [[] for _ in fds]
+    predicted = math.nan
+    timed_out = False
+
+    while True:
+        now = time.monotonic() - start
+        temps = [read_temp(fd) / 1000.0 for fd in fds]
+        if all(temp <= args.threshold for temp in temps):
+            break
+        if now >= args.timeout:
+            timed_out = True
+            break
+
+        times.append(now)
+        eta = 0.0
+        for zone, temp in enumerate(temps):
+            history[zone].append(temp)
+            if len(times) >= 3 and times[-1] - times[0] >= args.min_span:
+                model = fit_cooling(times, history[zone])
+                if model is not None:
+                    models[zone] = model
+                    fitted[zone] = True
+            if temp > args.threshold:
+                eta = max(eta, math.inf if models[zone] is None
+                          else time_to_threshold(models[zone], temp, args.threshold))
+
+        if math.isnan(predicted) and math.isfinite(eta):
+            predicted = now + eta
+
+        # Sleep until shortly before the predicted crossing, checking again at
+        # least every max_sleep seconds to correct the prediction
+        wait = args.poll
+        if math.isfinite(eta):
+            wait = min(max(eta * args.margin, args.poll), args.max_sleep)
+        time.sleep(min(wait, max(args.timeout - now, 0)))
+
+    for fd in fds:
+        os.close(fd)
+
+    if args.state and any(fitted):
+        with open(args.state, 'w') as outfile:
+            json.dump(models, outfile)
+
+    return time.monotonic() - start, predicted, timed_out
+
+
+# -------------------------------- DUMP ---------------------------------- #
+
+def dump(args):
+    _, times, temps = thermbin.read_samples(args.infile)
+    for now, sample in zip(times, temps):
+        print(' '.join(['%.3f' % now] + ['%g' % temp for temp in sample]))
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    recordp = subparsers.add_parser('record', help="Sample the temperatures")
+    recordp.add_argument('-o', '--outfile',
+                         required=True,
+                         help="Where to write the samples",
+                         )
+    recordp.add_argument('-i', '--interval',
+                         type=float, default=0.5,
+                         help="The sampling interval in seconds",
+                         )
+    recordp.add_argument('-c', '--cpus',
+                         default=None,
+                         help="The CPUs the sampler can run on, e.g. 0-3 (default: all)",
+                         )
+    recordp.add_argument('-f', '--flush',
+                         type=int, default=8,
+                         help="Write the samples to the file every FLUSH samples",
+                         )
+
+    dumpp = subparsers.add_parser('dump', help="Print the samples of a file")
+    dumpp.add_argument('infile')
+
+    cooldownp = subparsers.add_parser('cooldown', help="Wait until all zones are cool enough")
+    cooldownp.add_argument('-t', '--threshold',
+                           type=float, required=True,
+                           help="The temperature in Celsius all zones must be at or below",
+                           )
+    cooldownp.add_argument('-T', '--timeout',
+                           type=float, default=600,
+                           help="The maximum duration of the cooldown in seconds",
+                           )
+    cooldownp.add_argument('-p', '--poll',
+                           type=float, default=1.0,
+                           help="The interval between readings when no prediction is available, in seconds",
+                           )
+    cooldownp.add_argument('-M', '--max-sleep',
+                           type=float, default=30.0,
+                           help="The maximum interval between readings, in seconds",
+                           )
+    cooldownp.add_argument('-f', '--margin',
+                           type=float, default=0.8,
+                           help="The fraction of the predicted time to sleep before reading again",
+                           )
+    cooldownp.add_argument('-m', '--min-span',
+                           type=float, default=3.0,
+                           help="The minimum time span of the readings used to fit the model, in seconds",
+                           )
+    cooldownp.add_argument('-s', '--state',
+                           default=None,
+                           help="Where the cooling model is kept between cooldowns",
+                           )
+    cooldownp.add_argument('-l', '--log',
+                           default=None,
+                           help="Where to append the duration of the cooldown (CSV)",
+                           )
+    cooldownp.add_argument('-c', '--cpus',
+                           default=None,
+                           help="The CPUs the process can run on, e.g. 0-3 (default: all)",
+                           )
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    try:
+        if args.command == 'record':
+            if args.interval <= 0 or args.flush < 1:
+                eprint("ERROR: the interval and the flush count must be positive!")
+                return 1
+            record(args)
+            return 0
+
+        if args.command == 'cooldown':
+            if args.poll <= 0 or args.max_sleep < args.poll or not 0 < args.margin <= 1:
+                eprint("ERROR: the poll interval must be positive and at most the maximum sleep, "
+                       "the margin must be in (0, 1]!")
+                return 1
+            if args.cpus:
+                os.sched_setaffinity(0, parse_cpus(args.cpus))
+            duration, predicted, timed_out = cooldown(args)
+            if args.log:
+                new = not os.path.isfile(args.log)
+                with open(args.log, 'a') as outfile:
+                    if new:
+                        print('duration,predicted,timeout', file=outfile)
+                    print('%.3f,%.3f,%d' % (duration, predicted, timed_out), file=outfile)
+            print('%.1fs' % duration)
+            return 2 if timed_out else 0
+
+        return dump(args)
+    except (OSError, ValueError, struct.error) as error:
+        eprint(f"ERROR: {error}")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
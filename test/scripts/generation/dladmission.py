@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+
+"""\
+Checks whether tasksets will be accepted by SCHED_DEADLINE, performing the same
+fixed-point calculations that the kernel performs when tasks are admitted (see
+to_ratio() and __dl_overflow() in kernel/sched/), on whole corpora of tasksets
+at once.
+
+The capacity of the CPUs of the root domain the tasks are admitted into can be
+read from sysfs (or from a copy of it taken from the board) or supplied
+directly. Exits with a non-zero code if any taskset would be rejected.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+class TooBigTaskRuntimeError(Exception):
+    pass
+
+
+class TasksetCannotBeAcceptedError(Exception):
+    pass
+
+
+u64 = np.uint64
+
+DL_BW_SHIFT = 20
+DL_BW_UNIT = 1 << DL_BW_SHIFT
+DL_MAX_BW_BITS = 64 - DL_BW_SHIFT
+DL_MAX_BW = (1 << DL_MAX_BW_BITS) - 1
+DL_SCALE = 10
+DL_NSEC_PER_USEC = 1000
+
+SCHED_CAPACITY_SHIFT = 10
+SCHED_CAPACITY_SCALE = 1 << SCHED_CAPACITY_SHIFT
+
+# Default values of the sched_rt_{runtime,period}_us sysctls
+DL_SYSCTL_SCHED_RT_RUNTIME = 950000
+DL_SYSCTL_SCHED_RT_PERIOD = 1000000
+
+# Root domain used so far in the experiments: four big cores
+DEFAULT_CAPACITIES = [SCHED_CAPACITY_SCALE] * 4
+
+SYSFS_CPU = 'devices/system/cpu/cpu{cpu}/cpu_capacity'
+
+
+# ------------------------- KERNEL ARITHMETICS --------------------------- #
+
+def dl_to_ratio(runtime, period):
+    """
+    Vectorized to_ratio(period, runtime) on uint64 arrays of nanoseconds; a
+    zero period (used to pad tasksets) gives a zero bandwidth.
+    """
+    runtime = np.asarray(runtime, dtype=u64)
+    period = np.asarray(period, dtype=u64)
+    if np.any(runtime > u64(DL_MAX_BW)):
+        raise TooBigTaskRuntimeError(
+            f"{runtime.max()} is too big! Maximum allowed value is {DL_MAX_BW}!")
+
+    ratio = np.zeros(np.broadcast(runtime, period).shape, dtype=u64)
+    np.floor_divide(runtime << u64(DL_BW_SHIFT), period, out=ratio, where=(period != 0))
+    return ratio
+
+
+def dl_global_bw(rt_runtime_us, rt_period_us):
+    # Bandwidth available to deadline tasks on each CPU, None means that
+    # there is no limit (sched_rt_runtime_us = -1, i.e. RUNTIME_INF)
+    if rt_runtime_us < 0:
+        return None
+    return int(dl_to_ratio(rt_runtime_us * DL_NSEC_PER_USEC,
+                           rt_period_us * DL_NSEC_PER_USEC))
+
+
+def dl_bw_capacity(capacities, per_cpu=False):
+    # Like dl_bw_capacity(): the sum of the capacities of the CPUs, which is
+    # the number of CPUs scaled to SCHED_CAPACITY_SCALE when all of them have
+    # full capacity. Kernels older than capacity-aware admission (e.g., the
+    # 5.4 of the Odroid) admit the per-CPU bandwidth times the number of CPUs
+    # instead, which per_cpu selects
+    capacities = [int(c) for c in capacities]
+    if per_cpu or all(c == SCHED_CAPACITY_SCALE for c in capacities):
+        return len(capacities) << SCHED_CAPACITY_SHIFT
+    return sum(capacities)
+
+
+def cap_scale(bw, capacity):
+    return (bw * capacity) >> SCHED_CAPACITY_SHIFT
+
+
+# ------------------------- ADMISSION CONTROL ---------------------------- #
+
+def pad_corpus(tasksets):
+    """
+    Packs a list of tasksets (lists of (runtime, period) pairs in us) into two
+    (num_tasksets, max_tasks) uint64 arrays of nanoseconds, padded with zeros.
+    """
+    width = max((len(t) for t in tasksets), default=0)
+    runtimes = np.zeros((len(tasksets), width), dtype=u64)
+    periods = np.zeros((len(tasksets), width), dtype=u64)
+    for i, taskset in enumerate(tasksets):
+        if taskset:
+            values = np.asarray(taskset, dtype=u64) * u64(DL_NSEC_PER_USEC)
+            runtimes[i, :len(taskset)] = values[:, 0]
+            periods[i, :len(taskset)] = values[:, 1]
+    return runtimes, periods
+
+
+def check_params(runtimes, periods):
+    # Like __checkparam_dl() with deadline = period, padding is always valid
+    valid = (runtimes >= u64(1 << DL_SCALE)) & (runtimes <= periods)
+    valid &= (periods & (u64(1) << u64(63))) == 0
+    return np.all(valid | (periods == 0), axis=1)
+
+
+def admission(runtimes, periods, capacities=DEFAULT_CAPACITIES,
+              rt_runtime_us=DL_SYSCTL_SCHED_RT_RUNTIME,
+              rt_period_us=DL_SYSCTL_SCHED_RT_PERIOD, per_cpu=False):
+    """
+    Checks a whole corpus of tasksets in one pass. Arguments are the (padded)
+    arrays returned by pad_corpus(), in nanoseconds. Returns a dictionary of
+    arrays, one element per taskset (see dl_bw_capacity() for per_cpu):
+    - total_bw: the sum of the tasks bandwidths, as computed by the kernel
+    - max_bw: the maximum total bandwidth admitted in the root domain
+    - params_ok: whether all tasks have valid parameters
+    - accepted: whether all tasks of the taskset would be admitted
+    - fits_cpu: whether each task fits alone on the biggest CPU (AP-EDF can
+      place it on a single CPU without falling back to global EDF)
+    """
+    bw = dl_to_ratio(runtimes, periods)
+    total_bw = bw.sum(axis=1, dtype=u64)
+    params_ok = check_params(runtimes, periods)
+
+    global_bw = dl_global_bw(rt_runtime_us, rt_period_us)
+    num = len(total_bw)
+    if global_bw is None:
+        max_bw = np.full(num, np.iinfo(u64).max, dtype=u64)
+        fits_cpu = np.ones(num, dtype=bool)
+    else:
+        # Tasks are admitted one at a time, the total bandwidth only grows so
+        # checking the final one is enough
+        max_bw = np.full(num, cap_scale(global_bw, dl_bw_capacity(capacities, per_cpu)), dtype=u64)
+        cpu_max_bw = u64(cap_scale(global_bw, max(int(c) for c in capacities)))
+        fits_cpu = np.all(bw < cpu_max_bw, axis=1)
+
+    return {
+        'total_bw': total_bw,
+        'max_bw': max_bw,
+        'params_ok': params_ok,
+        'accepted': params_ok & (total_bw <= max_bw),
+        'fits_cpu': fits_cpu,
+    }
+
+
+def check_dl_params(taskset, capacities=DEFAULT_CAPACITIES,
+                    rt_runtime_us=DL_SYSCTL_SCHED_RT_RUNTIME,
+                    rt_period_us=DL_SYSCTL_SCHED_RT_PERIOD, per_cpu=False):
+    # Single taskset version, taskset is a list of dicts like in taskset2json
+    runtimes, periods = pad_corpus(
+        [[(t['runtime'], t['period']) for t in taskset]])
+    result = admission(runtimes, periods, capacities, rt_runtime_us, rt_period_us,
+                       per_cpu)
+    if not result['accepted'][0]:
+        raise TasksetCannotBeAcceptedError(
+            f"The bandwidth {result['total_bw'][0]} is greater than {result['max_bw'][0]}"
+            if result['params_ok'][0] else "Invalid task parameters")
+
+
+# ------------------------------ CORPUS ---------------------------------- #
+
+def read_rtapp_taskset(fname):
+    with open(fname, 'r') as infile:
+        tasks = json.load(infile)['tasks']
+    return [(t['dl-runtime'], t['dl-period']) for t in tasks.values()]
+
+
+def find_tasksets(paths):
+    fnames = []
+    for path in paths:
+        if os.path.isfile(path):
+            fnames.append(path)
+            continue
+        for dirpath, _, files in os.walk(path):
+            fnames += [os.path.join(dirpath, f) for f in files
+                       if f.startswith('ts_') and f.endswith('.json')]
+    return sorted(fnames)
+
+
+def parse_cpulist(cpulist):
+    # Parses lists like "0-3,6"
+    cpus = []
+    for part in cpulist.split(','):
+        first, _, last = part.partition('-')
+        cpus += range(int(first), int(last or first) + 1)
+    return cpus
+
+
+def read_capacities(sysfs, cpus):
+    capacities = []
+    for cpu in cpus:
+        with open(os.path.join(sysfs, SYSFS_CPU.format(cpu=cpu)), 'r') as infile:
+            capacities.append(int(infile.read()))
+    return capacities
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    parser.add_argument('paths',
+                        nargs='+',
+                        help="rt-app taskset files, or directories to search for ts_*.json files",
+                        )
+
+    parser.add_argument('-c', '--cpus',
+                        default=None,
+                        help="The list of CPUs of the root domain (e.g., 4-7), whose capacity is read from SYSFS",
+                        )
+
+    parser.add_argument('-s', '--sysfs',
+                        default='/sys',
+                        help="Where sysfs (or a copy of the relevant files) is located",
+                        )
+
+    parser.add_argument('-C', '--capacities',
+                        nargs='+', type=int, default=None,
+                        help="The capacity of each CPU of the root domain, instead of reading them from sysfs (default: four CPUs of capacity 1024)",
+                        )
+
+    parser.add_argument('-r', '--rt-runtime-us',
+                        type=int, default=DL_SYSCTL_SCHED_RT_RUNTIME,
+                        help="The value of kernel.sched_rt_runtime_us (-1 disables admission control)",
+                        )
+
+    parser.add_argument('-p', '--rt-period-us',
+                        type=int, default=DL_SYSCTL_SCHED_RT_PERIOD,
+                        help="The value of kernel.sched_rt_period_us",
+                        )
+
+    parser.add_argument('-L', '--per-cpu-bw',
+                        default=False,
+                        action='store_true',
+                        help="Admit the per-CPU bandwidth times the number of CPUs regardless of their capacity, like kernels without capacity-aware admission (e.g., 5.4 on the Odroid)",
+                        )
+
+    parser.add_argument('-v', '--verbose',
+                        default=False,
+                        action='store_true',
+                        help="Print the outcome of every taskset, not only rejected ones",
+                        )
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    capacities = args.capacities
+    try:
+        if capacities is None and args.cpus is not None:
+            capacities = read_capacities(args.sysfs, parse_cpulist(args.cpus))
+    except (OSError, ValueError) as error:
+        eprint(f"ERROR: could not read CPU capacities: {error}")
+        return 2
+    if capacities is None:
+        capacities = DEFAULT_CAPACITIES
+
+    fnames = find_tasksets(args.paths)
+    if not fnames:
+        eprint("ERROR: no tasksets found!")
+        return 2
+
+    runtimes, periods = pad_corpus([read_rtapp_taskset(f) for f in fnames])
+    try:
+        result = admission(runtimes, periods, capacities,
+                           args.rt_runtime_us, args.rt_period_us, args.per_cpu_bw)
+    except TooBigTaskRuntimeError as error:
+        eprint(f"ERROR: {error}")
+        return 1
+
+    for i, fname in enumerate(fnames):
+        if result['accepted'][i] and not args.verbose:
+            continue
+        outcome = 'ACCEPTED' if result['accepted'][i] else 'REJECTED'
+        if not result['params_ok'][i]:
+            outcome += ' (invalid parameters)'
+        print(f"{outcome}\t{result['total_bw'][i]}\t{result['max_bw'][i]}\t{fname}")
+
+    too_big = np.flatnonzero(~result['fits_cpu'])
+    if args.verbose:
+        for i in too_big:
+            eprint(f"WARN: {fnames[i]} has a task that does not fit on any CPU alone")
+    elif len(too_big):
+        eprint(f"WARN: {len(too_big)} tasksets have a task that does not fit on any CPU alone")
+
+    rejected = np.count_nonzero(~result['accepted'])
+    print(f"{len(fnames) - rejected}/{len(fnames)} tasksets accepted "
+          f"(capacities: {' '.join(str(c) for c in capacities)}, "
+          f"sched_rt_runtime_us: {args.rt_runtime_us}, sched_rt_period_us: {args.rt_period_us})")
+
+    return 1 if rejected else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
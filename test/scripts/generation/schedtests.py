@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+
+"""\
+Offline schedulability analysis of a taskset corpus (see tscorpus.py), using
+the SCHED_DEADLINE parameters of each task (implicit deadlines, D = T).
+
+The corpus is evaluated with numpy in batches of tasksets (the global tests
+build arrays with up to max_num_tasks^3 elements per taskset), one test at a
+time:
+- gfb: global EDF utilization bound by Goossens, Funk and Baruah
+- bcl: global EDF interference test by Bertogna, Cirinei and Lipari
+- bak: global EDF busy-interval test by Baker
+- ff/wf: partitioning with first-fit/worst-fit, placing tasks in the order in
+  which rt-app creates them (like AP-EDF does when they are admitted) on CPUs
+  whose available bandwidth is the per-CPU SCHED_DEADLINE limit
+
+Global tests are sufficient tests for m identical CPUs, so they are not
+performed (and reported as false) when CPUs have different capacities.
+
+The output is a tab-separated table with one row per taskset, sorted like the
+tables produced by collect.py.
+"""
+
+import argparse
+import sys
+
+import numpy as np
+
+import dladmission
+import tscorpus
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+GLOBAL_TESTS = ['gfb', 'bcl', 'bak']
+PARTITIONED_TESTS = ['ff', 'wf']
+
+# Scheduler variants tested by test.sh and the verdict predicting each one,
+# also used by collect.py
+SCHEDULER_VERDICTS = {
+    'global': 'global',
+    'apedf-ff': 'ff',
+    'apedf-wf': 'wf',
+}
+
+# Number of tasksets evaluated at once, which bounds the memory used by the
+# tests regardless of the size of the corpus
+BATCH_SIZE = 256
+
+
+# ------------------------------- INPUT ---------------------------------- #
+
+def corpus_arrays(corpus):
+    """
+    Returns the (num_tasksets, max_num_tasks) arrays of runtimes and periods
+    (as floats) and the mask of the valid (non-padding) elements.
+    """
+    C = corpus.padded('runtime').astype(np.float64)
+    T = corpus.padded('period').astype(np.float64)
+    valid = T > 0
+    T[~valid] = 1.0
+    return C, T, valid
+
+
+# ---------------------------- GLOBAL TESTS ------------------------------ #
+
+def gfb_test(C, T, valid, m):
+    # U <= m (1 - u_max) + u_max
+    u = np.where(valid, C / T, 0.0)
+    u_max = u.max(axis=1)
+    return u.sum(axis=1) <= m * (1 - u_max) + u_max
+
+
+def bcl_test(C, T, valid, m):
+    """
+    For each task k, the interference of the other tasks in a window of length
+    D_k, each one bounded by 1 - lambda_k, must be lower than m (1 - lambda_k)
+    (or equal, if at least one of them is positive and not bounded).
+    Arrays are indexed as [taskset, k, i].
+    """
+    Ck, Tk = C[:, :, None], T[:, :, None]
+    Ci, Ti = C[:, None, :], T[:, None, :]
+    lam = Ck / Tk
+
+    # Number of jobs of task i with deadline in the window
+    N = np.floor((Tk - Ti) / Ti) + 1
+    N = np.maximum(N, 0)
+    beta = (N * Ci + np.minimum(Ci, np.maximum(0, Tk - N * Ti))) / Tk
+
+    other = valid[:, :, None] & valid[:, None, :] & ~np.eye(C.shape[1], dtype=bool)
+    bounded = np.where(other, np.minimum(beta, 1 - lam), 0.0)
+    total = bounded.sum(axis=2)
+    limit = m * (1 - lam[:, :, 0])
+
+    some_unbounded = np.any(other & (beta > 0) & (beta <= 1 - lam), axis=2)
+    ok = (total < limit) | (np.isclose(total, limit) & some_unbounded)
+    return np.all(ok | ~valid, axis=1)
+
+
+def bak_test(C, T, valid, m):
+    """
+    For each task k there must be a lambda >= lambda_k, among lambda_k and
+    the utilizations of the other tasks, such that the sum of min(1, beta_i)
+    is at most m (1 - lambda) + lambda. Arrays are indexed as [taskset, k,
+    lambda, i].
+    """
+    u = np.where(valid, C / T, 0.0)
+    Tk = T[:, :, None, None]
+    lam_k = u[:, :, None, None]
+    lam = u[:, None, :, None]
+    ui, Ti = u[:, None, None, :], T[:, None, None, :]
+
+    # Candidate values of lambda for each k (the utilization of each task not
+    # lower than lambda_k, always including lambda_k itself)
+    candidates = valid[:, None, :, None] & (lam >= lam_k)
+
+    beta = np.where(ui <= lam, ui, ui + Ti * (ui - lam) / Tk)
+    total = np.where(valid[:, None, None, :], np.minimum(1, beta), 0.0).sum(axis=3)
+    ok = candidates[..., 0] & (total <= m * (1 - lam[..., 0]) + lam[..., 0])
+    return np.all(np.any(ok, axis=2) | ~valid, axis=1)
+
+
+# ------------------------- PARTITIONED TESTS ---------------------------- #
+
+def partition_test(C, T, valid, bins, fit):
+    """
+    Places tasks one at a time, in the order of the taskset, on CPUs with the
+    given available bandwidth; fit is either 'ff' or 'wf'. Returns whether all
+    tasks could be placed, for each taskset.
+    """
+    u = np.where(valid, C / T, 0.0)
+    free = np.tile(np.asarray(bins, dtype=np.float64), (len(u), 1))
+    placed = np.ones(len(u), dtype=bool)
+    rows = np.arange(len(u))
+
+    for j in range(u.shape[1]):
+        uj = u[:, j]
+        fits = free >= uj[:, None]
+        if fit == 'ff':
+            cpu = np.argmax(fits, axis=1)
+        else:
+            cpu = np.argmax(free, axis=1)
+        ok = fits[rows, cpu] | ~valid[:, j]
+        free[rows, cpu] -= np.where(ok & valid[:, j], uj, 0.0)
+        placed &= ok
+
+    return placed
+
+
+def cpu_bins(capacities, rt_runtime_us, rt_period_us):
+    # Available bandwidth on each CPU, like the per-CPU limit of AP-EDF
+    global_bw = dladmission.dl_global_bw(rt_runtime_us, rt_period_us)
+    if global_bw is None:
+        global_bw = dladmission.DL_BW_UNIT
+    return [dladmission.cap_scale(global_bw, int(c)) / dladmission.DL_BW_UNIT
+            for c in capacities]
+
+
+# ------------------------------ ANALYSIS -------------------------------- #
+
+def batches(valid, batch_size):
+    """
+    Yields the slices of batch_size tasksets and the number of task columns
+    they use: tasks are at the beginning of each row and the corpus is sorted
+    by number of tasks, so most batches can drop the padding columns.
+    """
+    for start in range(0, len(valid), batch_size):
+        rows = slice(start, start + batch_size)
+        yield rows, int(valid[rows].sum(axis=1).max(initial=0))
+
+
+def analyze(corpus, capacities=dladmission.DEFAULT_CAPACITIES,
+            rt_runtime_us=dladmission.DL_SYSCTL_SCHED_RT_RUNTIME,
+            rt_period_us=dladmission.DL_SYSCTL_SCHED_RT_PERIOD,
+            batch_size=BATCH_SIZE):
+    """
+    Returns a dictionary of columns, one element per taskset of the corpus
+    (in the same order), with the parameters of each taskset and the verdict
+    of each test.
+    """
+    C, T, valid = corpus_arrays(corpus)
+    u = np.where(valid, C / T, 0.0)
+
+    table = {
+        'num_tasks': np.asarray(corpus['num_tasks']),
+        'util': np.asarray(corpus['util']),
+        'tset_idx': np.asarray(corpus['tset_idx']),
+        'dl_util': u.sum(axis=1),
+        'dl_umax': u.max(axis=1, initial=0),
+    }
+
+    m = len(capacities)
+    identical = len(set(capacities)) == 1
+    bins = cpu_bins(capacities, rt_runtime_us, rt_period_us)
+    verdicts = {name: [np.zeros(0, dtype=bool)] for name in GLOBAL_TESTS + PARTITIONED_TESTS}
+
+    for rows, width in batches(valid, batch_size):
+        Cb, Tb, vb = C[rows, :width], T[rows, :width], valid[rows, :width]
+        for name, test in zip(GLOBAL_TESTS, [gfb_test, bcl_test, bak_test]):
+            verdicts[name].append(test(Cb, Tb, vb, m) if identical
+                                  else np.zeros(len(vb), dtype=bool))
+        for fit in PARTITIONED_TESTS:
+            verdicts[fit].append(partition_test(Cb, Tb, vb, bins, fit))
+
+    for name in GLOBAL_TESTS:
+        table[name] = np.concatenate(verdicts[name])
+    table['global'] = table['gfb'] | table['bcl'] | table['bak']
+    for fit in PARTITIONED_TESTS:
+        table[fit] = np.concatenate(verdicts[fit])
+
+    return table
+
+
+def write_table(table, fname):
+    # Tab-separated, sorted by (num_tasks, util, tset_idx) like collect.py
+    order = np.lexsort((table['tset_idx'], table['util'], table['num_tasks']))
+    names = list(table)
+    with open(fname, 'w') as outfile:
+        print('\t'.join(names), file=outfile)
+        for row in order:
+            values = []
+            for name in names:
+                value = table[name][row]
+                if isinstance(value, np.bool_):
+                    values.append(str(bool(value)))
+                elif isinstance(value, np.floating):
+                    values.append('%.6f' % value)
+                else:
+                    values.append(str(value))
+            print('\t'.join(values), file=outfile)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    parser.add_argument('corpus',
+                        help="The taskset corpus to analyze (see tscorpus.py)",
+                        )
+
+    parser.add_argument('-o', '--outfile',
+                        default='/dev/stdout',
+                        help="Where to save the verdict table",
+                        )
+
+    parser.add_argument('-C', '--capacities',
+                        nargs='+', type=int, default=dladmission.DEFAULT_CAPACITIES,
+                        help="The capacity of each CPU the tasksets run on",
+                        )
+
+    parser.add_argument('-r', '--rt-runtime-us',
+                        type=int, default=dladmission.DL_SYSCTL_SCHED_RT_RUNTIME,
+                        help="The value of kernel.sched_rt_runtime_us (-1 to use the whole CPUs)",
+                        )
+
+    parser.add_argument('-p', '--rt-period-us',
+                        type=int, default=dladmission.DL_SYSCTL_SCHED_RT_PERIOD,
+                        help="The value of kernel.sched_rt_period_us",
+                        )
+
+    parser.add_argument('-b', '--batch-size',
+                        type=int, default=BATCH_SIZE,
+                        help="The number of tasksets evaluated at once",
+                        )
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    try:
+        corpus = tscorpus.Corpus(args.corpus)
+    except (OSError, tscorpus.CorpusFormatError) as error:
+        eprint(f"ERROR: {error}")
+        return 2
+
+    if len(set(args.capacities)) > 1:
+        eprint("WARN: CPUs have different capacities, global tests are not performed!")
+
+    table = analyze(corpus, args.capacities, args.rt_runtime_us, args.rt_period_us,
+                    args.batch_size)
+    write_table(table, args.outfile)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -43,18 +43,32 @@ any questions regarding this software.
 
 
 import argparse
+import contextlib
+import collections
+import functools
+import math
 import sys
 import os
 import textwrap
-import random
 import numpy as np
 
 
-def StaffordRandFixedSum(n, u, nsets):
-    # deal with n=1 case
-    if n == 1:
-        return np.tile(np.array([u]), [nsets, 1])
+# Maximum number of (n, u) transition tables kept in memory, least recently
+# used ones are evicted first
+STAFFORD_CACHE_SIZE = 256
+
+# Transition table of Stafford's randfixedsum for n tasks with total utilisation
+# u. It does not depend on the random draws, so it can be shared by all the
+# tasksets generated with the same (n, u) pair.
+StaffordTable = collections.namedtuple('StaffordTable', ['n', 'u', 'k', 't'])
 
+# Maximum number of (hyperperiod, min, max, gran) divisor sets kept in memory,
+# designs use different period ranges for each point
+HYPERPERIOD_CACHE_SIZE = 1024
+
+
+@functools.lru_cache(maxsize=STAFFORD_CACHE_SIZE)
+def StaffordTransitionTable(n, u):
     k = np.floor(u)
     s = u
     step = 1 if k < (k - n + 1) else -1
@@ -77,11 +91,26 @@ def StaffordRandFixedSum(n, u, nsets):
         tmp4 = np.array((s2[np.arange((n - i), n)] > s1[np.arange(0, i)]))
         t[i - 2, np.arange(0, i)] = (tmp2 / tmp3) * tmp4 + (1 - tmp1 / tmp3) * (np.logical_not(tmp4))
 
+    # Shared between callers, must never be modified
+    t.setflags(write=False)
+    return StaffordTable(n, u, k, t)
+
+
+# All the functions drawing random values accept an optional rng, which must
+# provide the numpy.random.RandomState interface; by default they use the global
+# numpy generator (the one seeded by --seed)
+
+def StaffordDraw(table, nsets, rng=None):
+    # Draws nsets tasksets from a transition table, returns an (nsets, n) array
+    if rng is None:
+        rng = np.random
+    n, u, k, t = table
+
     m = nsets
     x = np.zeros((n, m))
-    rt = np.random.uniform(size=(n - 1, m))  # rand simplex type
-    rs = np.random.uniform(size=(n - 1, m))  # rand position in simplex
-    s = np.repeat(s, m)
+    rt = rng.uniform(size=(n - 1, m))  # rand simplex type
+    rs = rng.uniform(size=(n - 1, m))  # rand position in simplex
+    s = np.repeat(u, m)
     j = np.repeat(int(k + 1), m)
     sm = np.repeat(0, m)
     pr = np.repeat(1, m)
@@ -100,16 +129,128 @@ def StaffordRandFixedSum(n, u, nsets):
     # iterated in fixed dimension order but needs to be randomised
     # permute x row order within each column
     for i in range(0, m):
-        x[..., i] = x[np.random.permutation(n), i]
+        x[..., i] = x[rng.permutation(n), i]
 
     return np.transpose(x)
 
 
-def gen_periods(n, nsets, min, max, gran, dist):
+def StaffordRandFixedSum(n, u, nsets, rng=None):
+    # deal with n=1 case
+    if n == 1:
+        return np.tile(np.array([u]), [nsets, 1])
+
+    return StaffordDraw(StaffordTransitionTable(n, float(u)), nsets, rng)
+
+
+# Utilisation generators:
+# - stafford: Stafford's randfixedsum, uniform over the tasksets whose task
+#   utilisations are all in [0, 1]
+# - uunifast: UUniFast-Discard, uniform over the simplex, discarding tasksets
+#   with a task utilisation above the cap (uniform over the same tasksets of
+#   stafford when the cap is 1)
+# - dirichlet: symmetric Dirichlet with the given alpha (uniform over the
+#   simplex when alpha is 1), discarding tasksets like uunifast
+UTIL_GENERATORS = ["stafford", "uunifast", "dirichlet"]
+
+# Maximum number of tasksets drawn at once by the discarding generators
+UTIL_MAX_DRAW = 1000000
+
+
+def UUniFast(n, u, nsets, rng=None):
+    # Vectorized UUniFast, returns an (nsets, n) array
+    if rng is None:
+        rng = np.random
+    r = rng.uniform(size=(nsets, n - 1))
+    # Sum of the utilisations of the tasks following each one
+    sums = u * np.cumprod(r ** (1.0 / np.arange(n - 1, 0, -1)), axis=1)
+    bounds = np.c_[np.full(nsets, float(u)), sums, np.zeros(nsets)]
+    return bounds[:, :-1] - bounds[:, 1:]
+
+
+def DirichletFixedSum(n, u, nsets, rng=None, alpha=1.0):
+    if rng is None:
+        rng = np.random
+    return u * rng.dirichlet(np.full(n, float(alpha)), size=nsets)
+
+
+def DiscardRandFixedSum(draw, n, u, nsets, cap, rng=None):
+    """
+    Draws tasksets with draw(n, u, size, rng) and keeps the first nsets ones
+    in which no task utilisation exceeds cap. Each draw is sized according to
+    the acceptance rate observed so far.
+    """
+    kept = []
+    count = 0
+    size = nsets
+    for _ in range(SAMPLER_MAX_BATCHES):
+        x = draw(n, u, size, rng)
+        valid = np.all(x <= cap, axis=1)
+        kept.append(x[valid])
+        count += np.count_nonzero(valid)
+        if count >= nsets:
+            break
+        rate = max(np.count_nonzero(valid), 1) / size
+        size = min(math.ceil((nsets - count) / rate * 1.1), UTIL_MAX_DRAW)
+    else:
+        raise SamplerError(
+            f"Could not generate {nsets} tasksets with task utilisations of at most {cap}")
+
+    return np.concatenate(kept)[:nsets]
+
+
+def gen_utils(options, nsets, rng=None):
+    # Returns an (nsets, n) array of task utilisations using the selected generator
+    n, u = options.n, options.util
+    if options.util_generator == "stafford":
+        return StaffordRandFixedSum(n, u, nsets, rng)
+    if n == 1:
+        return np.tile(np.array([u]), [nsets, 1])
+
+    if options.util_generator == "uunifast":
+        draw = UUniFast
+    else:
+        def draw(n, u, size, rng):
+            return DirichletFixedSum(n, u, size, rng, options.alpha)
+    return DiscardRandFixedSum(draw, n, u, nsets, options.util_cap, rng)
+
+
+@functools.lru_cache(maxsize=HYPERPERIOD_CACHE_SIZE)
+def hyperperiod_divisors(hyperperiod, min, max, gran):
+    # Sorted array of the divisors of hyperperiod that are multiples of gran
+    # and lie in [min, max]
+    if hyperperiod % gran != 0:
+        return np.zeros(0)
+    m = hyperperiod // gran
+    e = np.arange(1, math.isqrt(m) + 1)
+    e = e[m % e == 0]
+    divs = np.union1d(e, m // e) * gran
+    divs = divs[(divs >= min) & (divs <= max)].astype(float)
+    divs.setflags(write=False)
+    return divs
+
+
+def snap_to_divisors(periods, divs):
+    # Replaces each period with the largest divisor not greater than it (or
+    # the smallest divisor if there is none)
+    idx = np.searchsorted(divs, periods, side='right') - 1
+    return divs[np.clip(idx, 0, len(divs) - 1)]
+
+
+def gen_periods(n, nsets, min, max, gran, dist, rng=None, hyperperiod=None):
+    if rng is None:
+        rng = np.random
     if dist == "logunif":
-        periods = np.exp(np.random.uniform(low=np.log(min), high=np.log(max + gran), size=(nsets, n)))
+        periods = np.exp(rng.uniform(low=np.log(min), high=np.log(max + gran), size=(nsets, n)))
     elif dist == "unif":
-        periods = np.random.uniform(low=min, high=(max + gran), size=(nsets, n))
+        periods = rng.uniform(low=min, high=(max + gran), size=(nsets, n))
+    elif dist == "hyperdiv":
+        # Log-uniform over the divisors of the hyperperiod: the hyperperiod of
+        # any generated taskset divides the given one
+        divs = hyperperiod_divisors(hyperperiod, min, max, gran)
+        if len(divs) == 0:
+            raise ValueError(f"hyperperiod {hyperperiod} has no divisors in [{min}, {max}]")
+        periods = np.exp(rng.uniform(low=np.log(divs[0]), high=np.log(max + gran), size=(nsets, n)))
+        return snap_to_divisors(periods, divs)
     else:
         return None
     periods = np.floor(periods / gran) * gran
@@ -117,33 +258,151 @@ def gen_periods(n, nsets, min, max, gran, dist):
     return periods
 
 
-def print_taskset(taskset, format):
+def taskset_hyperperiod(periods):
+    # Python integers, the lcm of periods of 16 tasks can overflow int64
+    return functools.reduce(math.lcm, map(int, periods), 1)
+
+
+def print_taskset(taskset, format, file=None):
+    # The hyperperiod is expensive, computed only if printed
+    H = taskset_hyperperiod(taskset[:, 2]) if '%(H)' in format else None
     for t in range(np.size(taskset, 0)):
-        data = {'Ugen': taskset[t][0], 'U': taskset[t][1], 'T': taskset[t][2], 'C': taskset[t][3]}
-        print(format % data)
-
-
-def gen_tasksets(options):
-    x = StaffordRandFixedSum(options.n, options.util, options.nsets)
-    periods = gen_periods(options.n, options.nsets, options.permin, options.permax, options.pergran, options.perdist)
-    # iterate through each row (which represents utils for a taskset)
-    for i in range(np.size(x, axis=0)):
-        C = x[i] * periods[i]
-        for j in range(np.size(C, axis=0)):
-            if C[j] < 1200:
-                C[j] = C[j] + random.randint(1000, 1500)
-                periods[i][j] = C[j] / x[i][j]
-                periods[i][j] = np.round(periods[i][j]/options.pergran, decimals=0)*options.pergran
-                C[j] = x[i][j] * periods[i][j]
+        data = {'Ugen': taskset[t][0], 'U': taskset[t][1], 'T': taskset[t][2], 'C': taskset[t][3], 'H': H}
+        print(format % data, file=file)
 
+
+# Execution times below this value are increased by a random amount
+C_SMALL = 1200
+C_SMALL_BUMP = (1000, 1500)
+
+# Default number of tasksets drawn at once by the rejection sampler, and
+# maximum number of batches drawn before giving up
+SAMPLER_BATCH_SIZE = 1024
+SAMPLER_MAX_BATCHES = 1000
+
+
+class SamplerError(Exception):
+    pass
+
+
+def fix_small_C(x, periods, gran, rng=None, divs=None):
+    # Increase too small execution times and adapt the period to keep the
+    # utilisation unchanged (as much as the period granularity allows, or the
+    # divisors of the hyperperiod if given)
+    if rng is None:
+        rng = np.random
+    C = x * periods
+    small = C < C_SMALL
+    if np.any(small):
+        C[small] += rng.randint(C_SMALL_BUMP[0], C_SMALL_BUMP[1] + 1, size=np.count_nonzero(small))
+        periods[small] = np.round(C[small] / x[small] / gran, decimals=0) * gran
+        if divs is not None:
+            periods[small] = snap_to_divisors(periods[small], divs)
+        C[small] = x[small] * periods[small]
+    return C
+
+
+def pack_tasksets(x, periods, C, round_C):
+    if round_C:
+        C = np.round(C, decimals=0)
+    U = C / periods
+    return np.stack([x, U, periods, C], axis=-1)
+
+
+def make_tasksets(options, rng=None):
+    # Returns an array of nsets tasksets with shape (nsets, n, 4): each
+    # taskset has one row per task and columns (Ugen, U, T, C)
+    if options.min_C is not None:
+        return make_constrained_tasksets(options, rng)
+
+    x = gen_utils(options, options.nsets, rng)
+    periods = gen_periods(options.n, options.nsets, options.permin, options.permax, options.pergran, options.perdist, rng,
+                          options.hyperperiod)
+    divs = None
+    if options.perdist == "hyperdiv":
+        divs = hyperperiod_divisors(options.hyperperiod, options.permin, options.permax, options.pergran)
+    C = fix_small_C(x, periods, options.pergran, rng, divs)
+    return pack_tasksets(x, periods, C, options.round_C)
+
+
+def make_constrained_tasksets(options, rng=None):
+    # Rejection sampler: tasksets are drawn in batches and only the ones in
+    # which every execution time is at least min_C are kept, in the order in
+    # which they were drawn. Each batch only uses the seeded numpy generator.
+    kept_x, kept_periods, kept_C = [], [], []
+    count = 0
+
+    for _ in range(SAMPLER_MAX_BATCHES):
+        x = gen_utils(options, options.batch_size, rng)
+        periods = gen_periods(options.n, options.batch_size, options.permin, options.permax, options.pergran, options.perdist, rng,
+                              options.hyperperiod)
+        C = x * periods
         if options.round_C:
             C = np.round(C, decimals=0)
 
-        taskset = np.c_[x[i], C / periods[i], periods[i], C]
+        valid = np.all(C >= options.min_C, axis=1)
+        valid &= np.all((periods >= options.permin) & (periods <= options.permax), axis=1)
 
-        print_taskset(taskset, options.format)
-        if i < np.size(x, axis=0) - 1:
-            print("")
+        kept_x.append(x[valid])
+        kept_periods.append(periods[valid])
+        kept_C.append(C[valid])
+        count += np.count_nonzero(valid)
+        if count >= options.nsets:
+            break
+    else:
+        raise SamplerError(
+            f"Could not generate {options.nsets} tasksets with execution times of at least {options.min_C} "
+            f"after {SAMPLER_MAX_BATCHES * options.batch_size} attempts")
+
+    x = np.concatenate(kept_x)[:options.nsets]
+    periods = np.concatenate(kept_periods)[:options.nsets]
+    C = np.concatenate(kept_C)[:options.nsets]
+    return pack_tasksets(x, periods, C, False)
+
+
+def gen_tasksets(options, outfile=None):
+    tasksets = make_tasksets(options)
+    for i, taskset in enumerate(tasksets):
+        print_taskset(taskset, options.format, outfile)
+        if i < len(tasksets) - 1:
+            print("", file=outfile)
+
+
+# Default number of tasksets written in each chunk of the binary output
+OUTPUT_CHUNK_SIZE = 10000
+
+
+def write_tasksets_npy(options, outfile):
+    """
+    Streams the tasksets as a sequence of .npy arrays, each one holding up to
+    options.chunk_size tasksets with shape (tasksets, n, 4) and columns (Ugen,
+    U, T, C), so that memory usage does not depend on the number of tasksets.
+    Tasksets are drawn one chunk at a time, so for the same seed they are the
+    same of the text output only when they fit in a single chunk.
+    """
+    chunk_options = argparse.Namespace(**vars(options))
+    remaining = options.nsets
+    while remaining > 0:
+        chunk_options.nsets = min(options.chunk_size, remaining)
+        np.lib.format.write_array(outfile, make_tasksets(chunk_options), allow_pickle=False)
+        remaining -= chunk_options.nsets
+    outfile.flush()
+
+
+def read_tasksets_npy(infile):
+    """
+    Yields the chunks written by write_tasksets_npy() to a binary file object,
+    one at a time. Arrays are read without seeking, so pipes are supported.
+    """
+    while infile.peek(1):
+        version = np.lib.format.read_magic(infile)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(infile)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(infile)
+        count = math.prod(shape)
+        data = np.frombuffer(infile.read(count * dtype.itemsize), dtype=dtype, count=count)
+        yield data.reshape(shape, order='F' if fortran_order else 'C')
 
 
 def escape_format_string(string: str):
@@ -192,6 +451,23 @@ def main():
 
                 {program_name} -s 5 -n 10 -p 1000 -q 100000 -d logunif --round-C -f \"%(C)d %(T)d\\n\"
 
+            Generate 5 tasksets of 10 tasks with periods between 100000
+            and 1200000 that are divisors of 7200000, so that the
+            hyperperiod of each taskset is at most 7200000, and print it.
+
+                {program_name} -s 5 -n 10 -p 100000 -q 1200000 -g 10000 -d hyperdiv -H 7200000 --round-C -f \"%(C)d %(T)d %(H)d\"
+
+            Write 1000000 tasksets of 8 tasks to a binary file, in
+            chunks of 50000 tasksets (see read_tasksets_npy()).
+
+                {program_name} -s 1000000 -n 8 -u 3 -p 100000 -q 1200000 -g 10000 --round-C -t npy --chunk-size 50000 -o tasksets.npy
+
+            Generate 1000 tasksets of 4 tasks with total utilisation 3
+            using UUniFast-Discard, with each task utilisation at most
+            0.9, and print their utilisation values.
+
+                {program_name} -s 1000 -n 4 -u 3 -G uunifast --util-cap 0.9 -f \"%(Ugen).3f\"
+
             Print utilisation values from Stafford's randfixedsum
             for 20 tasksets of 8 tasks, with one line per taskset,
             rounded to 3 decimal places:
@@ -220,10 +496,22 @@ def main():
                         metavar="SEED", type=int, dest="seed",
                         default="0",
                         help="Set the random number generator seed")
+    parser.add_argument("-G", "--util-generator",
+                        metavar="UGEN", type=str, dest="util_generator",
+                        default="stafford",
+                        help="Choose utilisation generator to be 'stafford', 'uunifast' (UUniFast-Discard) or 'dirichlet'")
+    parser.add_argument("--util-cap",
+                        metavar="UCAP", type=float, dest="util_cap",
+                        default="1.0",
+                        help="Maximum utilisation of each task for the 'uunifast' and 'dirichlet' generators ('stafford' always uses 1)")
+    parser.add_argument("--dirichlet-alpha",
+                        metavar="ALPHA", type=float, dest="alpha",
+                        default="1.0",
+                        help="Concentration parameter of the 'dirichlet' generator (1 is uniform, larger values give more balanced tasksets)")
     parser.add_argument("-d", "--period-distribution",
                         metavar="PDIST", type=str, dest="perdist",
                         default="logunif",
-                        help="Choose period distribution to be 'unif' or 'logunif'")
+                        help="Choose period distribution to be 'unif', 'logunif' or 'hyperdiv' (log-uniform over the divisors of HYPER)")
     parser.add_argument("-p", "--period-min",
                         metavar="PMIN", type=int, dest="permin",
                         default="1000",
@@ -237,17 +525,32 @@ def main():
                         default=None,
                         help="Set period granularity to PGRAN [PMIN]")
 
+    parser.add_argument("-H", "--hyperperiod",
+                        metavar="HYPER", type=int, dest="hyperperiod",
+                        default=None,
+                        help="Base hyperperiod for the 'hyperdiv' period distribution, must be a multiple of PGRAN")
+
     parser.add_argument("--round-C", action="store_true", dest="round_C",
                         default=False,
                         help="Round execution times to nearest integer")
 
+    parser.add_argument("--min-C",
+                        metavar="MINC", type=float, dest="min_C",
+                        default=None,
+                        help="Discard tasksets with an execution time lower than MINC, drawing them in batches until SETS are found")
+    parser.add_argument("--batch-size",
+                        metavar="BATCH", type=int, dest="batch_size",
+                        default=SAMPLER_BATCH_SIZE,
+                        help="Number of tasksets drawn at once when using --min-C")
+
     format_help = textwrap.dedent("""\
         Specify output format as a Python templace string.
         The following variables are available:
             Ugen - the task utilisation value generated by Stafford's randfixedsum algorithm,
             T    - the generated task period value,
             C    - the generated task execution time,
-            U    - the actual utilisation equal to C/T which will differ from Ugen if the --round-C option is used.
+            U    - the actual utilisation equal to C/T which will differ from Ugen if the --round-C option is used,
+            H    - the hyperperiod of the taskset the task belongs to.
         See below for further examples.
         A new line is always inserted between tasksets.
     """)
@@ -257,6 +560,19 @@ def main():
                         default='%(Ugen)f %(U)f %(C).2f %(T)d\\n',
                         help=format_help)
 
+    parser.add_argument("-o", "--output-file",
+                        metavar="FILE", type=str, dest="outfile",
+                        default="-",
+                        help="Write the tasksets to FILE instead of stdout")
+    parser.add_argument("-t", "--output-type",
+                        metavar="TYPE", type=str, dest="outtype",
+                        default="text",
+                        help="Choose output type to be 'text' (using FORMAT) or 'npy' (a stream of .npy arrays of shape (tasksets, N, 4) with\ncolumns Ugen, U, T, C, written in chunks of CHUNK tasksets)")
+    parser.add_argument("--chunk-size",
+                        metavar="CHUNK", type=int, dest="chunk_size",
+                        default=OUTPUT_CHUNK_SIZE,
+                        help="Number of tasksets written at once with the 'npy' output type")
+
     args = parser.parse_args()
 
     if args.about:
@@ -275,11 +591,27 @@ def main():
         print("Minimum number of tasksets is 1", file=sys.stderr)
         return 1
 
+    if args.util_generator not in UTIL_GENERATORS:
+        print("Utilisation generator must be one of " + str(UTIL_GENERATORS), file=sys.stderr)
+        return 1
+
+    if args.util_generator == "stafford" and args.util_cap != 1.0:
+        print("The 'stafford' generator only supports a utilisation cap of 1", file=sys.stderr)
+        return 1
+
+    if args.util_cap <= 0 or args.util > args.n * args.util_cap:
+        print("Taskset utilisation must be less than or equal to number of tasks times the utilisation cap", file=sys.stderr)
+        return 1
+
+    if args.alpha <= 0:
+        print("Dirichlet alpha must be greater than 0", file=sys.stderr)
+        return 1
+
     if args.seed > 0:
         # print("Setting the seed to " + str(args.seed), file=sys.stderr)
         np.random.seed(args.seed)
 
-    known_perdists = ["unif", "logunif"]
+    known_perdists = ["unif", "logunif", "hyperdiv"]
     if args.perdist not in known_perdists:
         print("Period distribution must be one of " + str(known_perdists), file=sys.stderr)
         return 1
@@ -312,14 +644,55 @@ def main():
         print("Period minimum must be a integer multiple of period granularity", file=sys.stderr)
         return 1
 
-    args.format = args.format.replace("\\n", "\n")
+    if args.perdist == "hyperdiv":
+        if args.hyperperiod is None or args.hyperperiod < 1:
+            print("The 'hyperdiv' period distribution requires a positive hyperperiod", file=sys.stderr)
+            return 1
+
+        if (args.hyperperiod % args.pergran) != 0:
+            print("Hyperperiod must be a integer multiple of period granularity", file=sys.stderr)
+            return 1
+
+        if len(hyperperiod_divisors(args.hyperperiod, args.permin, args.permax, args.pergran)) == 0:
+            print("Hyperperiod has no divisors between period minimum and maximum", file=sys.stderr)
+            return 1
+
+    if args.batch_size < 1:
+        print("Batch size must be an integer greater than equal to 1", file=sys.stderr)
+        return 1
 
+    known_outtypes = ["text", "npy"]
+    if args.outtype not in known_outtypes:
+        print("Output type must be one of " + str(known_outtypes), file=sys.stderr)
+        return 1
+
+    if args.chunk_size < 1:
+        print("Chunk size must be an integer greater than equal to 1", file=sys.stderr)
+        return 1
+
+    args.format = args.format.replace("\\n", "\n")
 
-    gen_tasksets(args)
+    try:
+        if args.outtype == "npy":
+            with open_output(args.outfile, "wb") as outfile:
+                write_tasksets_npy(args, outfile)
+        else:
+            with open_output(args.outfile, "w") as outfile:
+                gen_tasksets(args, outfile)
+    except SamplerError as error:
+        print(error, file=sys.stderr)
+        return 1
 
     return 0
 
 
+def open_output(fname, mode):
+    if fname == "-":
+        stream = sys.stdout.buffer if "b" in mode else sys.stdout
+        return contextlib.nullcontext(stream)
+    return open(fname, mode)
+
+
 def print_help(parser):
     parser.print_help()
 
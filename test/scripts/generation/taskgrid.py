@@ -0,0 +1,948 @@
+#!/usr/bin/env python3
+
+"""\
+Generates a whole grid of tasksets (number of tasks x utilization x index) in a
+single process, producing the same files that generate.sh used to produce by
+invoking taskgen3.py and taskset2json.py once per taskset.
+
+Parameters can be supplied either on the command line or by reading a
+parameters script in the same format of the tasksets/params.sh file generated
+by generate.sh (command-line arguments take precedence).
+
+Generation is incremental: a manifest in the output directory records a hash
+of the inputs of each taskset and of the files generated for it, so tasksets
+whose inputs did not change (and whose files were not modified) are skipped,
+and tasksets for which only the taskset2json.py options changed are converted
+again from their existing .txt files without generating them again.
+Files in the output directory that are not part of the grid are reported as
+stale (and removed with --prune).
+
+Instead of the full grid, the lhs and sobol designs generate a fixed budget of
+tasksets spread over the parameters space, each one with its own number of
+tasks, utilization and extended dimensions (see DESIGNS). Their parameters are
+listed in design.tsv in the output directory, which test.sh uses to iterate
+over them.
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import shlex
+import sys
+
+import numpy as np
+
+import dladmission
+import taskgen3
+import taskset2json
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+# Parameters used by generate.sh when invoking taskgen3.py for each taskset
+PERIOD_MIN = 100000
+PERIOD_MAX = 1200000
+PERIOD_GRAN = 10000
+
+# Tasksets containing a task with a runtime lower than this (in us) are
+# discarded and generated again
+MIN_RUNTIME = 4000
+
+# How tasksets with too small runtimes are replaced:
+# - reseed: try again with the next unused seed, like generate.sh used to do
+#   (reproduces tasksets generated with older versions of this tool)
+# - batch: draw candidates in batches from the generator seeded with the
+#   taskset seed, keeping the first valid one (see taskgen3 --min-C)
+SAMPLERS = ['reseed', 'batch']
+
+# Period distributions supported by taskgen3.py; with hyperdiv all periods are
+# divisors of the given hyperperiod, so each taskset hyperperiod (and thus the
+# duration of its rt-app run) is bounded by it
+PERIOD_DISTS = ['logunif', 'unif', 'hyperdiv']
+
+# Utilisation generators supported by taskgen3.py, each task utilisation is
+# at most 1 with all of them
+UTIL_GENERATORS = taskgen3.UTIL_GENERATORS
+
+# Only one taskset is needed per seed, smaller batches than taskgen3's default
+# waste fewer draws while still covering the low acceptance rate of cells with
+# many tasks and a low utilization
+SAMPLER_BATCH_SIZE = 64
+
+# Where the seed of each taskset comes from:
+# - list: GT_SEEDS_LIST, one seed per taskset index, used to re-seed the global
+#   numpy generator like taskgen3.py does (tasksets must be generated in order)
+# - sequence: an independent numpy SeedSequence stream for each (num_tasks,
+#   util, index) cell derived from GT_SEED, cells can be generated in parallel
+SEED_MODES = ['list', 'sequence']
+
+# How tasksets are spread over the parameters space:
+# - grid: GT_NUM_TASKSETS tasksets for each number of tasks and utilization
+# - lhs, sobol: GT_DESIGN_BUDGET tasksets, each one with its own parameters
+#   sampled from a Latin hypercube or a Sobol sequence (with a random digital
+#   shift) over the number of tasks (from GT_NUM_TASKS_LIST), the utilization
+#   (between the extremes of GT_UTILS_LIST) and the extended dimensions
+DESIGNS = ['grid', 'lhs', 'sobol']
+
+# Extended dimensions of design points, appended to their taskset names: the
+# minimum and maximum period in us (sampled log-uniformly) and the maximum
+# utilization of each task
+DESIGN_DIMS = ['pmin', 'pmax', 'umax']
+
+# The maximum task utilization of a design point is at least this times the
+# average one (points below are moved up), otherwise the sampler would accept
+# too few tasksets
+DESIGN_UMAX_MARGIN = 1.25
+
+DESIGN_NAME = 'design.tsv'
+
+# Direction numbers (s, a, m_1 ... m_s) of the Sobol sequence for the
+# dimensions after the first one, from the tables by Joe and Kuo
+SOBOL_DIRECTIONS = [
+    (1, 0, [1]),
+    (2, 1, [1, 3]),
+    (3, 1, [1, 3, 1]),
+    (3, 2, [1, 1, 1]),
+    (4, 1, [1, 1, 3, 3]),
+    (4, 4, [1, 3, 5, 13]),
+]
+SOBOL_BITS = 32
+
+
+# Bump this whenever a change to the generation steps changes the files
+# generated for the same parameters, so that all tasksets are generated again
+GENERATOR_VERSION = 1
+
+MANIFEST_NAME = 'manifest.json'
+
+
+class InvalidParametersError(Exception):
+    pass
+
+
+# ------------------------- PARAMETERS MANAGEMENT -------------------------- #
+
+PARAMS_LINE = re.compile(r'^\s*(?:export\s+)?(GT_\w+)=(.*)$')
+
+
+def read_params_file(fname):
+    """
+    Reads a bash script containing GT_* assignments (like tasksets/params.sh)
+    and returns a dictionary of the assigned values. Arrays are returned as
+    lists of strings, other values as plain strings.
+    """
+    params = {}
+    with open(fname, 'r') as infile:
+        for line in infile:
+            match = PARAMS_LINE.match(line.split('#', 1)[0].rstrip())
+            if match is None:
+                continue
+
+            name, value = match.groups()
+            if value.startswith('(') and value.endswith(')'):
+                params[name] = shlex.split(value[1:-1])
+            else:
+                value = shlex.split(value)
+                params[name] = value[0] if value else ''
+    return params
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    parser.add_argument('-P', '--params',
+                        default=None,
+                        help="A parameters script (like tasksets/params.sh) from which to read the GT_* options",
+                        )
+
+    parser.add_argument('-o', '--out-dir',
+                        default=None,
+                        help="The root directory where to create the tasksets [GT_OUT_DIR]",
+                        )
+
+    parser.add_argument('-n', '--num-tasks',
+                        nargs='+', type=int, default=None,
+                        help="The list of number of tasks per taskset [GT_NUM_TASKS_LIST]",
+                        )
+
+    parser.add_argument('-u', '--utils',
+                        nargs='+', type=str, default=None,
+                        help="The list of taskset utilizations [GT_UTILS_LIST]",
+                        )
+
+    parser.add_argument('-s', '--seeds',
+                        nargs='+', type=int, default=None,
+                        help="The list of seeds, one per taskset index [GT_SEEDS_LIST]",
+                        )
+
+    parser.add_argument('-N', '--num-tasksets',
+                        type=int, default=None,
+                        help="The number of tasksets per number of tasks and utilization [GT_NUM_TASKSETS]",
+                        )
+
+    parser.add_argument('-r', '--runtime-fraction',
+                        type=float, default=None,
+                        help="The fraction of the runtime it should actually run for [GT_RT_FRACTION]",
+                        )
+
+    parser.add_argument('-R', '--runtime-remove',
+                        type=int, default=None,
+                        help="The amount to statically remove from each runtime [us] [GT_RT_REMOVE]",
+                        )
+
+    parser.add_argument('-m', '--min-duration',
+                        type=int, default=None,
+                        help="The minimum duration in seconds of the taskset execution [GT_RT_MIN_DURATION]",
+                        )
+
+    parser.add_argument('-M', '--max-duration',
+                        type=int, default=None,
+                        help="The maximum duration in seconds of the taskset execution [GT_RT_MAX_DURATION]",
+                        )
+
+    parser.add_argument('-c', '--calibration',
+                        type=int, default=None,
+                        help="The calibration for RT-APP [GT_RT_CALIBRATION]",
+                        )
+
+    parser.add_argument('-d', '--period-dist',
+                        choices=PERIOD_DISTS, default=None,
+                        help="The distribution of the periods, see taskgen3.py [GT_PERIOD_DIST]",
+                        )
+
+    parser.add_argument('-H', '--hyperperiod',
+                        type=int, default=None,
+                        help="The base hyperperiod [us] for the hyperdiv distribution [GT_HYPERPERIOD]",
+                        )
+
+    parser.add_argument('-g', '--util-generator',
+                        choices=UTIL_GENERATORS, default=None,
+                        help="The generator of the task utilizations, see taskgen3.py [GT_UTIL_GENERATOR]",
+                        )
+
+    parser.add_argument('-a', '--dirichlet-alpha',
+                        type=float, default=None,
+                        help="The concentration parameter of the dirichlet generator [GT_DIRICHLET_ALPHA]",
+                        )
+
+    parser.add_argument('-p', '--quota-policy',
+                        choices=taskset2json.QUOTA_POLICIES, default=None,
+                        help="How runtimes are reduced when a taskset exceeds the maximum utilization, see taskset2json.py [GT_QUOTA_POLICY]",
+                        )
+
+    parser.add_argument('-S', '--sampler',
+                        choices=SAMPLERS, default=None,
+                        help="How to replace tasksets with too small runtimes [GT_SAMPLER]",
+                        )
+
+    parser.add_argument('--seed',
+                        type=int, default=None,
+                        help="The base seed used to derive each cell stream in sequence mode [GT_SEED]",
+                        )
+
+    parser.add_argument('--seed-mode',
+                        choices=SEED_MODES, default=None,
+                        help="Where the seed of each taskset comes from [GT_SEED_MODE]",
+                        )
+
+    parser.add_argument('--design',
+                        choices=DESIGNS, default=None,
+                        help="How tasksets are spread over the parameters space [GT_DESIGN]",
+                        )
+
+    parser.add_argument('-B', '--budget',
+                        type=int, default=None,
+                        help="The number of tasksets of the lhs and sobol designs [GT_DESIGN_BUDGET]",
+                        )
+
+    parser.add_argument('--pmin-range',
+                        nargs=2, type=int, default=None, metavar=('MIN', 'MAX'),
+                        help="The range of the minimum period [us] of design points [GT_DESIGN_PMIN_RANGE]",
+                        )
+
+    parser.add_argument('--pmax-range',
+                        nargs=2, type=int, default=None, metavar=('MIN', 'MAX'),
+                        help="The range of the maximum period [us] of design points [GT_DESIGN_PMAX_RANGE]",
+                        )
+
+    parser.add_argument('--umax-range',
+                        nargs=2, type=float, default=None, metavar=('MIN', 'MAX'),
+                        help="The range of the maximum task utilization of design points [GT_DESIGN_UMAX_RANGE]",
+                        )
+
+    parser.add_argument('-j', '--jobs',
+                        type=int, default=None,
+                        help="Number of worker processes, 0 to use all CPUs [GT_JOBS]",
+                        )
+
+    parser.add_argument('-f', '--force',
+                        default=False,
+                        action='store_true',
+                        help="Generate all tasksets again, even the ones whose inputs did not change",
+                        )
+
+    parser.add_argument('--prune',
+                        default=False,
+                        action='store_true',
+                        help="Remove stale taskset files, which are not part of the grid, from the output directory",
+                        )
+
+    parser.add_argument('-q', '--quiet',
+                        default=False,
+                        action='store_true',
+                        help="Do not print a line for each generated taskset",
+                        )
+
+    return parser.parse_args()
+#-- parse_args
+
+
+# Maps each option to the GT_* parameter it overrides and its conversion
+PARAMS_MAP = {
+    'out_dir':          ('GT_OUT_DIR',          str,    './tasksets'),
+    'num_tasks':        ('GT_NUM_TASKS_LIST',   int,    None),
+    'utils':            ('GT_UTILS_LIST',       str,    None),
+    'seeds':            ('GT_SEEDS_LIST',       int,    None),
+    'num_tasksets':     ('GT_NUM_TASKSETS',     int,    None),
+    'runtime_fraction': ('GT_RT_FRACTION',      float,  .95),
+    'runtime_remove':   ('GT_RT_REMOVE',        int,    0),
+    'min_duration':     ('GT_RT_MIN_DURATION',  int,    20),
+    'max_duration':     ('GT_RT_MAX_DURATION',  int,    600),
+    'calibration':      ('GT_RT_CALIBRATION',   int,    92),
+    'period_dist':      ('GT_PERIOD_DIST',      str,    'logunif'),
+    'hyperperiod':      ('GT_HYPERPERIOD',      int,    None),
+    'util_generator':   ('GT_UTIL_GENERATOR',   str,    'stafford'),
+    'dirichlet_alpha':  ('GT_DIRICHLET_ALPHA',  float,  1.0),
+    'quota_policy':     ('GT_QUOTA_POLICY',     str,    'legacy'),
+    'sampler':          ('GT_SAMPLER',          str,    'reseed'),
+    'seed':             ('GT_SEED',             int,    None),
+    'seed_mode':        ('GT_SEED_MODE',        str,    'list'),
+    'design':           ('GT_DESIGN',           str,    'grid'),
+    'budget':           ('GT_DESIGN_BUDGET',    int,    None),
+    'pmin_range':       ('GT_DESIGN_PMIN_RANGE', int,   [PERIOD_MIN, PERIOD_MIN]),
+    'pmax_range':       ('GT_DESIGN_PMAX_RANGE', int,   [PERIOD_MAX, PERIOD_MAX]),
+    'umax_range':       ('GT_DESIGN_UMAX_RANGE', float, [1.0, 1.0]),
+    'jobs':             ('GT_JOBS',             int,    1),
+}
+
+
+def resolve_params(args):
+    params = read_params_file(args.params) if args.params else {}
+
+    for option, (name, conv, default) in PARAMS_MAP.items():
+        if getattr(args, option) is not None:
+            continue
+
+        value = params.get(name, '')
+        if isinstance(value, list):
+            value = [conv(v) for v in value] if value else None
+        else:
+            value = conv(value) if value != '' else None
+
+        setattr(args, option, value if value is not None else default)
+
+    if not args.num_tasks:
+        raise InvalidParametersError("empty list of number of tasks!")
+
+    # Deriving these lists requires the CPUs capacity and awk, which are
+    # handled by generate.sh
+    if not args.utils:
+        raise InvalidParametersError(
+            "empty list of utilizations, use generate.sh to derive one!")
+
+    if args.period_dist not in PERIOD_DISTS:
+        raise InvalidParametersError(f"unknown period distribution '{args.period_dist}'!")
+    if args.period_dist == 'hyperdiv':
+        if args.hyperperiod is None:
+            raise InvalidParametersError("the hyperdiv distribution requires a hyperperiod!")
+        divs = taskgen3.hyperperiod_divisors(args.hyperperiod, PERIOD_MIN, PERIOD_MAX, PERIOD_GRAN)
+        if len(divs) == 0:
+            raise InvalidParametersError(
+                f"hyperperiod {args.hyperperiod} has no divisors that are valid periods!")
+
+    if args.util_generator not in UTIL_GENERATORS:
+        raise InvalidParametersError(f"unknown utilization generator '{args.util_generator}'!")
+    if args.dirichlet_alpha <= 0:
+        raise InvalidParametersError("the dirichlet alpha must be positive!")
+
+    if args.quota_policy not in taskset2json.QUOTA_POLICIES:
+        raise InvalidParametersError(f"unknown quota policy '{args.quota_policy}'!")
+
+    if args.sampler not in SAMPLERS:
+        raise InvalidParametersError(f"unknown sampler '{args.sampler}'!")
+    if args.seed_mode not in SEED_MODES:
+        raise InvalidParametersError(f"unknown seed mode '{args.seed_mode}'!")
+
+    if args.design not in DESIGNS:
+        raise InvalidParametersError(f"unknown design '{args.design}'!")
+
+    if args.design != 'grid':
+        check_design(args)
+    elif args.seed_mode == 'sequence':
+        if args.seed is None:
+            raise InvalidParametersError("a base seed is required in sequence mode!")
+        if args.num_tasksets is None:
+            raise InvalidParametersError("the number of tasksets is required in sequence mode!")
+    else:
+        if not args.seeds:
+            raise InvalidParametersError(
+                "empty list of seeds, use generate.sh to derive one!")
+        if args.num_tasksets is None:
+            args.num_tasksets = len(args.seeds)
+        if len(args.seeds) < args.num_tasksets:
+            raise InvalidParametersError("wrong length of the seeds list!")
+
+    if args.jobs < 0:
+        raise InvalidParametersError("the number of jobs must be non negative!")
+    if args.jobs == 0:
+        args.jobs = os.cpu_count()
+
+    return args
+
+
+def check_design(args):
+    if args.seed is None:
+        raise InvalidParametersError(f"a base seed is required by the {args.design} design!")
+    if args.budget is None or args.budget < 1:
+        raise InvalidParametersError(f"the {args.design} design requires a positive budget!")
+
+    for name in ['pmin_range', 'pmax_range', 'umax_range']:
+        lo, hi = getattr(args, name)
+        if lo > hi:
+            raise InvalidParametersError(f"invalid {name.replace('_', ' ')} {lo} {hi}!")
+    if args.pmin_range[0] < PERIOD_GRAN or args.pmin_range[1] >= args.pmax_range[0]:
+        raise InvalidParametersError("minimum periods must be at least "
+                                     f"{PERIOD_GRAN} and lower than maximum periods!")
+    if args.umax_range[0] <= 0 or args.umax_range[1] > 1:
+        raise InvalidParametersError("maximum task utilizations must be in (0, 1]!")
+    if args.umax_range[0] < 1 and args.util_generator == 'stafford':
+        raise InvalidParametersError("maximum task utilizations below 1 require the "
+                                     "uunifast or dirichlet generator!")
+
+    # Each point has its own period range, which must contain some divisors
+    if args.period_dist == 'hyperdiv':
+        for num_tasks, util, index, pmin, pmax, _ in design_points(args):
+            if len(taskgen3.hyperperiod_divisors(args.hyperperiod, pmin, pmax, PERIOD_GRAN)) == 0:
+                raise InvalidParametersError(
+                    f"hyperperiod {args.hyperperiod} has no divisors in the period range "
+                    f"[{pmin}, {pmax}] of design point {index}!")
+
+
+# -------------------------- TASKSETS GENERATION --------------------------- #
+
+def taskgen_options(num_tasks, util, args, sampler, dims=None):
+    # Same options passed by generate.sh to taskgen3.py, dims are the extended
+    # dimensions of a design point
+    options = argparse.Namespace(
+        n=num_tasks,
+        util=float(util),
+        nsets=1,
+        perdist=args.period_dist,
+        hyperperiod=args.hyperperiod,
+        permin=PERIOD_MIN,
+        permax=PERIOD_MAX,
+        pergran=PERIOD_GRAN,
+        util_generator=args.util_generator,
+        util_cap=1.0,
+        alpha=args.dirichlet_alpha,
+        round_C=True,
+        min_C=MIN_RUNTIME if sampler == 'batch' else None,
+        batch_size=SAMPLER_BATCH_SIZE,
+    )
+    if dims is not None:
+        options.permin, options.permax, options.util_cap = dims
+    return options
+
+
+def rtapp_options(args, max_quota):
+    # Same options passed by generate.sh to taskset2json.py
+    return argparse.Namespace(
+        runtime_fraction=args.runtime_fraction,
+        runtime_remove=args.runtime_remove,
+        min_duration=args.min_duration,
+        max_duration=args.max_duration,
+        calibration=args.calibration,
+        quota=max_quota,
+        quota_policy=args.quota_policy,
+        capacities=dladmission.DEFAULT_CAPACITIES,
+        trace=False,
+    )
+
+
+def legacy_taskset(seed, options):
+    # Re-seeding the global generator, exactly like a new taskgen3.py process
+    # would do, keeps the output identical to the one of generate.sh
+    if seed > 0:
+        np.random.seed(seed)
+
+    return to_taskset(taskgen3.make_tasksets(options)[0])
+
+
+def to_taskset(tset):
+    # Same conversion performed by the "%(C)d %(T)d" output format
+    return [{'runtime': int(C), 'period': int(T)} for T, C in tset[:, 2:4]]
+
+
+def runtimes_ok(taskset):
+    return all(task['runtime'] >= MIN_RUNTIME for task in taskset)
+
+
+def write_taskset(taskset, fname):
+    with open(fname, 'w') as outfile:
+        for task in taskset:
+            outfile.write(f"{task['runtime']} {task['period']}\n")
+
+
+def taskset_name(num_tasks, index, util):
+    return 'ts_n%02d_i%02d_u%.4f' % (num_tasks, index, float(util))
+
+
+def design_name(num_tasks, util, index, pmin, pmax, umax):
+    # The taskset name followed by the extended dimensions of the design point
+    return taskset_name(num_tasks, index, util) + '_pmin%d_pmax%d_umax%.4f' % (pmin, pmax, umax)
+
+
+def util_key(util):
+    # Utilizations are identified by their value with the same precision used
+    # in taskset names
+    return int(round(float(util) * 10000))
+
+
+def cell_rng(base_seed, num_tasks, util, index):
+    """
+    Returns an independent generator for the given cell of the grid. The
+    stream depends only on the base seed and on the cell coordinates (not on
+    their position in the lists), so adding values to the grid or generating
+    cells in a different order does not change the other cells.
+    """
+    seq = np.random.SeedSequence(
+        base_seed, spawn_key=(num_tasks, util_key(util), index))
+    return np.random.RandomState(np.random.PCG64(seq))
+
+
+def save_taskset(taskset, num_tasks, name, args, rtapp_args):
+    # Returns the distortion of the taskset (see taskset2json.fix_taskset)
+    tset_file = os.path.join(args.out_dir, '%02d' % num_tasks, name)
+    write_taskset(taskset, tset_file + '.txt')
+
+    output_struct, distortion = taskset2json.make_rtapp_config(taskset, rtapp_args)
+    taskset2json.write_rtapp_config(output_struct, tset_file + '.json')
+    return distortion
+
+
+def progress_line(num_tasks, util, index, seed, outcome):
+    return 'Generating taskset with %02d tasks, util %.4f, index %02d, (seed %d) Runtimes check: %s' \
+        % (num_tasks, float(util), index, seed, outcome)
+
+
+def generate_group(num_tasks, util, args, rtapp_args):
+    """
+    Generates all the tasksets with the given number of tasks and utilization
+    using the list of seeds, returns the list of progress lines and the
+    distortion of each taskset.
+
+    With the reseed sampler, seeds that produce tasks with a too small runtime
+    are replaced by the next seed that is neither in the list of seeds nor
+    already tested for this utilization, like generate.sh used to do. The batch
+    sampler always returns valid tasksets for the given seed.
+    """
+    options = taskgen_options(num_tasks, util, args, args.sampler)
+    tested_seeds = set()
+    lines = []
+    distortions = []
+
+    for index in range(args.num_tasksets):
+        seed = args.seeds[index]
+
+        while True:
+            tested_seeds.add(seed)
+            taskset = legacy_taskset(seed, options)
+            if runtimes_ok(taskset):
+                break
+
+            lines.append(progress_line(num_tasks, util, index, seed, 'had to fix!'))
+            seed += 1
+            while seed in args.seeds or seed in tested_seeds:
+                seed += 1
+
+        lines.append(progress_line(num_tasks, util, index, seed, 'OK!'))
+        distortions.append(save_taskset(taskset, num_tasks, taskset_name(num_tasks, index, util),
+                                        args, rtapp_args))
+
+    return lines, distortions
+
+
+def generate_cell(num_tasks, util, index, args, rtapp_args):
+    # Each cell has its own stream, so the batch sampler is always used
+    options = taskgen_options(num_tasks, util, args, 'batch')
+    rng = cell_rng(args.seed, num_tasks, util, index)
+    taskset = to_taskset(taskgen3.make_tasksets(options, rng)[0])
+    distortion = save_taskset(taskset, num_tasks, taskset_name(num_tasks, index, util),
+                              args, rtapp_args)
+    return [progress_line(num_tasks, util, index, args.seed, 'OK!')], [distortion]
+
+
+def generate_point(num_tasks, util, index, *dims, args, rtapp_args):
+    # Like a cell, with the extended dimensions of the design point
+    options = taskgen_options(num_tasks, util, args, 'batch', dims)
+    rng = cell_rng(args.seed, num_tasks, util, index)
+    taskset = to_taskset(taskgen3.make_tasksets(options, rng)[0])
+    distortion = save_taskset(taskset, num_tasks, design_name(num_tasks, util, index, *dims),
+                              args, rtapp_args)
+    return [progress_line(num_tasks, util, index, args.seed, 'OK!')], [distortion]
+
+
+def render_unit(unit):
+    # Converts again the existing .txt files of a unit into rt-app configs
+    _, coords, args, rtapp_args = unit
+    distortions = []
+    for name, fname in zip(unit_names(unit), unit_paths(unit)[::2]):
+        taskset = taskset2json.parse_taskset(fname)
+        output_struct, distortion = taskset2json.make_rtapp_config(taskset, rtapp_args)
+        taskset2json.write_rtapp_config(
+            output_struct, os.path.join(os.path.dirname(fname), name + '.json'))
+        distortions.append(distortion)
+    return [], distortions
+
+
+def run_unit(job):
+    # Entry point of worker processes
+    render, unit = job
+    if render:
+        return render_unit(unit)
+
+    kind, coords, args, rtapp_args = unit
+    if kind == 'group':
+        return generate_group(*coords, args, rtapp_args)
+    if kind == 'point':
+        return generate_point(*coords, args=args, rtapp_args=rtapp_args)
+    return generate_cell(*coords, args, rtapp_args)
+
+
+def grid_units(args, rtapp_args):
+    """
+    Splits the grid in independent units of work: with a list of seeds each
+    (num_tasks, util) pair is a unit (seeds replaced by the reseed sampler
+    depend on the previous indexes), with seed sequences each cell is a unit.
+    Each point of lhs and sobol designs is a unit.
+    """
+    if args.design != 'grid':
+        for coords in design_points(args):
+            yield ('point', coords, args, rtapp_args)
+        return
+
+    for num_tasks in args.num_tasks:
+        for util in args.utils:
+            if float(util) <= 0:
+                continue
+            if args.seed_mode == 'list':
+                yield ('group', (num_tasks, util), args, rtapp_args)
+                continue
+            for index in range(args.num_tasksets):
+                yield ('cell', (num_tasks, util, index), args, rtapp_args)
+
+
+# --------------------------------- DESIGN --------------------------------- #
+
+def latin_hypercube(num, dims, rng):
+    # One point in each of the num equally sized strata of every dimension
+    strata = np.argsort(rng.uniform(size=(dims, num)), axis=1).T
+    return (strata + rng.uniform(size=(num, dims))) / num
+
+
+def sobol_directions(dims):
+    # The (dims, SOBOL_BITS) direction numbers, the first dimension is the
+    # van der Corput sequence
+    V = [[1 << (SOBOL_BITS - 1 - k) for k in range(SOBOL_BITS)]]
+    for s, a, m in SOBOL_DIRECTIONS[:dims - 1]:
+        v = [m[k] << (SOBOL_BITS - 1 - k) for k in range(s)]
+        for k in range(s, SOBOL_BITS):
+            value = v[k - s] ^ (v[k - s] >> s)
+            for j in range(1, s):
+                if (a >> (s - 1 - j)) & 1:
+                    value ^= v[k - j]
+            v.append(value)
+        V.append(v)
+    return np.array(V, dtype=np.uint64)
+
+
+def sobol(num, dims, rng):
+    if dims > len(SOBOL_DIRECTIONS) + 1:
+        raise ValueError(f"at most {len(SOBOL_DIRECTIONS) + 1} Sobol dimensions are supported")
+
+    # Points in Gray code order: point i is the xor of the direction numbers
+    # of the bits set in i ^ (i >> 1)
+    V = sobol_directions(dims)
+    index = np.arange(num, dtype=np.uint64)
+    gray = index ^ (index >> np.uint64(1))
+    X = np.zeros((num, dims), dtype=np.uint64)
+    for k in range(SOBOL_BITS):
+        bit = ((gray >> np.uint64(k)) & np.uint64(1)).astype(bool)
+        X[bit] ^= V[:, k]
+
+    # The random digital shift moves the first point away from the origin
+    X ^= rng.randint(0, 1 << SOBOL_BITS, size=dims, dtype=np.uint64)
+    return X / float(1 << SOBOL_BITS)
+
+
+def scale_log(x, lo, hi):
+    return np.exp(np.log(lo) + x * (np.log(hi) - np.log(lo)))
+
+
+def design_points(args):
+    """
+    Returns the coordinates (num_tasks, util, index, pmin, pmax, umax) of the
+    points of an lhs or sobol design, the index being the position of each
+    point in the design.
+    """
+    rng = np.random.RandomState(np.random.PCG64(np.random.SeedSequence(args.seed)))
+    sample = latin_hypercube if args.design == 'lhs' else sobol
+    x = sample(args.budget, 2 + len(DESIGN_DIMS), rng)
+
+    choices = sorted(args.num_tasks)
+    num_tasks = np.take(choices, np.minimum((x[:, 0] * len(choices)).astype(int), len(choices) - 1))
+    utils = [float(u) for u in args.utils]
+    util = np.round(min(utils) + x[:, 1] * (max(utils) - min(utils)), 4)
+
+    # Periods are log-uniform like the ones of the tasks
+    pmin = np.rint(scale_log(x[:, 2], *args.pmin_range) / PERIOD_GRAN) * PERIOD_GRAN
+    pmax = np.rint(scale_log(x[:, 3], *args.pmax_range) / PERIOD_GRAN) * PERIOD_GRAN
+
+    lo, hi = args.umax_range
+    umax = np.maximum(lo + x[:, 4] * (hi - lo), DESIGN_UMAX_MARGIN * util / num_tasks)
+    umax = np.round(np.minimum(umax, 1.0), 4)
+
+    return [(int(num_tasks[i]), float(util[i]), i, int(pmin[i]), int(pmax[i]), float(umax[i]))
+            for i in range(args.budget)]
+
+
+def write_design(units, out_dir):
+    # The parameters of each design point, in the order of the design
+    with open(os.path.join(out_dir, DESIGN_NAME), 'w') as outfile:
+        print('\t'.join(['name', 'num_tasks', 'util', 'tset_idx'] + DESIGN_DIMS), file=outfile)
+        for _, coords, _, _ in units:
+            num_tasks, util, index, pmin, pmax, umax = coords
+            print('%s\t%d\t%.4f\t%d\t%d\t%d\t%.4f'
+                  % (design_name(*coords), num_tasks, util, index, pmin, pmax, umax), file=outfile)
+
+
+# ------------------------- INCREMENTAL GENERATION ------------------------- #
+
+def unit_names(unit):
+    kind, coords, args, _ = unit
+    if kind == 'group':
+        num_tasks, util = coords
+        return [taskset_name(num_tasks, index, util) for index in range(args.num_tasksets)]
+    if kind == 'point':
+        return [design_name(*coords)]
+    num_tasks, util, index = coords
+    return [taskset_name(num_tasks, index, util)]
+
+
+def unit_paths(unit):
+    num_tasks = unit[1][0]
+    out_dir = os.path.join(unit[2].out_dir, '%02d' % num_tasks)
+    return [os.path.join(out_dir, name + ext)
+            for name in unit_names(unit) for ext in ['.txt', '.json']]
+
+
+def unit_digests(unit):
+    """
+    Hashes everything the tasksets of a unit depend on, separately for the
+    generation of the .txt files and for their conversion to rt-app configs.
+    A group depends on the whole list of seeds (the reseed sampler skips all
+    the seeds in the list), a cell only on the base seed and its coordinates.
+    """
+    kind, coords, args, rtapp_args = unit
+    sampler = args.sampler if kind == 'group' else 'batch'
+    dims = coords[3:] if kind == 'point' else None
+    taskgen_args = vars(taskgen_options(coords[0], coords[1], args, sampler, dims))
+    if args.period_dist != 'hyperdiv':
+        del taskgen_args['hyperperiod']
+    # Stafford's tasksets do not depend on the new options, keeping the
+    # digests of the existing tasksets unchanged
+    if args.util_generator != 'dirichlet':
+        del taskgen_args['alpha']
+    if args.util_generator == 'stafford':
+        del taskgen_args['util_generator']
+        del taskgen_args['util_cap']
+
+    inputs = {
+        'version': GENERATOR_VERSION,
+        'kind': kind,
+        'coords': [coords[0], util_key(coords[1])] + list(coords[2:]),
+        'taskgen': taskgen_args,
+    }
+    if kind == 'group':
+        inputs['seeds'] = args.seeds
+        inputs['num_tasksets'] = args.num_tasksets
+    else:
+        inputs['seed'] = args.seed
+
+    return {
+        'taskgen': inputs_digest(inputs),
+        'rtapp': inputs_digest({'version': GENERATOR_VERSION, 'rtapp': vars(rtapp_args)}),
+    }
+
+
+def inputs_digest(inputs):
+    encoded = json.dumps(inputs, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def file_digest(fname):
+    try:
+        with open(fname, 'rb') as infile:
+            return hashlib.sha256(infile.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def unit_entry(unit, digests):
+    # The manifest entry of a unit: its inputs hashes and the hash of each file
+    return dict(digests, files={
+        os.path.basename(f): file_digest(f) for f in unit_paths(unit)
+    })
+
+
+def unit_key(unit):
+    # Units are identified in the manifest by the path of their first file
+    return os.path.relpath(unit_paths(unit)[0], unit[2].out_dir)
+
+
+def unit_status(unit, digests, manifest):
+    """
+    Returns 'unchanged' if the files of the unit are up to date, 'render' if
+    only their conversion to rt-app configs must be performed again, and
+    'generate' otherwise.
+    """
+    entry = manifest.get(unit_key(unit))
+    if entry is None or entry.get('taskgen') != digests['taskgen']:
+        return 'generate'
+
+    current = unit_entry(unit, digests)
+    txt_files = [f for f in current['files'] if f.endswith('.txt')]
+    if any(current['files'][f] != entry['files'].get(f) for f in txt_files):
+        return 'generate'
+    if current == entry:
+        return 'unchanged'
+    return 'render'
+
+
+def read_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST_NAME), 'r') as infile:
+            return json.load(infile)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def write_manifest(manifest, out_dir):
+    fname = os.path.join(out_dir, MANIFEST_NAME)
+    with open(fname + '.tmp', 'w') as outfile:
+        json.dump(manifest, outfile, indent=1, sort_keys=True)
+    os.replace(fname + '.tmp', fname)
+
+
+def find_stale(out_dir, expected):
+    # Taskset files in the output directory that are not part of the grid
+    stale = []
+    for dirpath, _, files in os.walk(out_dir):
+        for f in files:
+            path = os.path.normpath(os.path.join(dirpath, f))
+            if f.startswith('ts_') and f.endswith(('.txt', '.json')) and path not in expected:
+                stale.append(path)
+    return sorted(stale)
+
+
+# -------------------------------- GRID ------------------------------------ #
+
+def run_units(jobs, args):
+    if args.jobs == 1:
+        yield from map(run_unit, jobs)
+        return
+
+    # Units write disjoint files, results are returned in submission order
+    # so that the output does not depend on the number of workers
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        yield from executor.map(run_unit, jobs, chunksize=8)
+
+
+def generate_grid(args):
+    max_quota = float(args.utils[-1])
+    rtapp_args = rtapp_options(args, max_quota)
+
+    for num_tasks in args.num_tasks:
+        os.makedirs(os.path.join(args.out_dir, '%02d' % num_tasks), exist_ok=True)
+
+    old_manifest = {} if args.force else read_manifest(args.out_dir)
+    manifest = {}
+    all_units = list(grid_units(args, rtapp_args))
+    counts = {'generate': 0, 'render': 0, 'unchanged': 0}
+    distortions = []
+    jobs = []
+    digests = []
+    for unit in all_units:
+        unit_digest = unit_digests(unit)
+        status = unit_status(unit, unit_digest, old_manifest)
+        counts[status] += len(unit_names(unit))
+        if status == 'unchanged':
+            manifest[unit_key(unit)] = old_manifest[unit_key(unit)]
+        else:
+            jobs.append((status == 'render', unit))
+            digests.append(unit_digest)
+
+    try:
+        results = run_units(jobs, args)
+        for (_, unit), unit_digest, (lines, unit_distortions) in zip(jobs, digests, results):
+            print_lines(lines, args)
+            distortions += unit_distortions
+            manifest[unit_key(unit)] = unit_entry(unit, unit_digest)
+    finally:
+        # Units completed before an error are not generated again next time
+        write_manifest(manifest, args.out_dir)
+
+    print("%d tasksets generated, %d converted again, %d unchanged"
+          % (counts['generate'], counts['render'], counts['unchanged']))
+    taskset2json.warn_on_distortion(distortions)
+
+    if args.design != 'grid':
+        write_design(all_units, args.out_dir)
+
+    expected = {os.path.normpath(f) for unit in all_units for f in unit_paths(unit)}
+    for fname in find_stale(args.out_dir, expected):
+        if args.prune:
+            os.remove(fname)
+        eprint(f"WARN: {'removed' if args.prune else 'found'} stale file {fname}")
+
+
+def print_lines(lines, args):
+    if args.quiet:
+        return
+    for line in lines:
+        print(line)
+
+
+def main():
+    args = parse_args()
+
+    try:
+        args = resolve_params(args)
+    except (InvalidParametersError, OSError) as error:
+        eprint(f"ERROR: {error}")
+        return 1
+
+    generate_grid(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,6 +8,8 @@ import parse
 import sys
 import numpy as np
 
+from dladmission import check_dl_params, DEFAULT_CAPACITIES
+
 
 def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
@@ -125,6 +127,17 @@ def parse_args():
                         help="The maximum utilization quota that can be allocated to this taskset. For some reason, tasksets generated by taskgen, even when checked using bash, create utilizations that exceed the quota. This option is to enforce that quota."
                         )
 
+    parser.add_argument('-p', '--quota-policy',
+                        default='legacy',
+                        choices=QUOTA_POLICIES,
+                        help="How runtimes are reduced when the taskset exceeds the quota: legacy (iterative), proportional, largest (largest utilizations first, down to the minimum DL runtime) or waterfill (cap largest utilizations to a common level)",
+                        )
+
+    parser.add_argument('-C', '--capacities',
+                        nargs='+', type=int, default=DEFAULT_CAPACITIES,
+                        help="The capacity of each CPU in the root domain the taskset will run in, used to check that SCHED_DEADLINE will accept it",
+                        )
+
     parser.add_argument('-T', '--trace',
                         default=False,
                         action='store_true',
@@ -181,7 +194,22 @@ def get_duration(taskset, args):
     return hyperperiod
 
 
-def fix_taskset(taskset, args):
+# Policies to bring the taskset utilization below the quota:
+# - legacy: iteratively trim one task or shrink the biggest one by 1% (the
+#   tasksets in the repository have been generated with this one)
+# - proportional: scale all runtimes by the same factor
+# - largest: remove the excess utilization from the tasks with the largest
+#   utilization first, one after the other, leaving each one at least
+#   MIN_DL_RUNTIME
+# - waterfill: lower the largest utilizations to a common level
+QUOTA_POLICIES = ['legacy', 'proportional', 'largest', 'waterfill']
+
+# DL runtimes below this (in us) are reported as too small, and the largest
+# policy does not reduce a runtime below it
+MIN_DL_RUNTIME = 2000
+
+
+def fix_taskset_legacy(taskset, args):
     util = tot_util(taskset)
     while util >= args.quota:
         exceed = util - args.quota
@@ -190,8 +218,6 @@ def fix_taskset(taskset, args):
         argmax = -1
         found = False
 
-        # TODO: this fixing mechanism is not so great!
-
         # Fix so that the utilization does not exceed the maximum quota!
         for i, task in enumerate(taskset):
             taskutil = task_util(task)
@@ -216,9 +242,99 @@ def fix_taskset(taskset, args):
     return taskset
 
 
+def quota_utils(utils, quota, policy, floors=None):
+    # Returns the task utilizations after removing the excess over the quota;
+    # the largest policy does not lower a task below its floor utilization
+    total = utils.sum()
+    if policy == 'proportional':
+        return utils * (quota / total)
+
+    # Both remaining policies work on utilizations sorted in decreasing order
+    order = np.argsort(-utils, kind='stable')
+    s = utils[order]
+
+    if policy == 'largest':
+        # Each task gives all its utilization above its floor until the
+        # excess is covered, what it cannot give is taken from the next one
+        floors = np.zeros_like(s) if floors is None else np.asarray(floors)[order]
+        spare = np.maximum(s - floors, 0.0)
+        if spare.sum() < total - quota:
+            raise ValueError("the quota cannot be enforced without reducing "
+                             "runtimes below the minimum one")
+        before = np.cumsum(spare) - spare
+        s = s - np.clip((total - quota) - before, 0, spare)
+    elif policy == 'waterfill':
+        # Capping the first k tasks to the level L_k leaves exactly the quota;
+        # the right k is the first one for which L_k is above the next task
+        k = np.arange(1, len(s) + 1)
+        tail = np.append(np.cumsum(s[::-1])[::-1][1:], 0.0)
+        levels = (quota - tail) / k
+        following = np.append(s[1:], 0.0)
+        level = max(levels[np.argmax(levels >= following)], 0.0)
+        s = np.minimum(s, level)
+    else:
+        raise ValueError(f"unknown quota policy '{policy}'")
+
+    fixed = np.empty_like(s)
+    fixed[order] = s
+    return fixed
+
+
+def enforce_quota(runtimes, periods, quota, policy):
+    """
+    Vectorized quota enforcement: returns the new runtimes (so that the total
+    utilization is strictly below the quota) and the relative reduction of
+    each runtime. Works in a single pass over numpy arrays.
+    """
+    runtimes = np.asarray(runtimes, dtype=np.int64)
+    periods = np.asarray(periods, dtype=np.int64)
+    utils = runtimes / periods
+
+    if utils.sum() < quota:
+        return runtimes, np.zeros(len(runtimes))
+
+    # One more us, so that rounding below leaves at least MIN_DL_RUNTIME
+    floors = (MIN_DL_RUNTIME + 1) / periods
+    fixed = quota_utils(utils, quota, policy, floors)
+
+    # ceil(x) - 1 < x, so the modified tasks end up strictly below the quota
+    changed = fixed < utils
+    fixed_runtimes = np.where(changed, np.ceil(fixed * periods) - 1, runtimes)
+    fixed_runtimes = np.maximum(fixed_runtimes, 0).astype(np.int64)
+
+    distortion = (runtimes - fixed_runtimes) / np.maximum(runtimes, 1)
+    return fixed_runtimes, distortion
+
+
+def fix_taskset(taskset, args):
+    # Returns the fixed taskset and the relative reduction of each runtime
+    original = [task['runtime'] for task in taskset]
+
+    if args.quota_policy == 'legacy':
+        taskset = fix_taskset_legacy(taskset, args)
+    else:
+        runtimes, _ = enforce_quota(
+            original, [task['period'] for task in taskset], args.quota, args.quota_policy)
+        for task, runtime in zip(taskset, runtimes):
+            task['runtime'] = int(runtime)
+
+    distortion = [(old - task['runtime']) / max(old, 1) for old, task in zip(original, taskset)]
+    return taskset, distortion
+
+
+def warn_on_distortion(distortions):
+    # A single warning for a list of tasksets, given the distortion of each
+    # one (see fix_taskset)
+    changed = [d for distortion in distortions for d in distortion if d > 0]
+    if changed:
+        tasksets = sum(1 for distortion in distortions if max(distortion, default=0) > 0)
+        eprint(f"WARN: quota enforcement reduced {len(changed)} runtimes of "
+               f"{tasksets}/{len(distortions)} tasksets, up to {max(changed) * 100:.3g}%!")
+
+
 def warn_on_too_small(taskset):
     for task in taskset:
-        if task['runtime'] < 2000:
+        if task['runtime'] < MIN_DL_RUNTIME:
             eprint(f"WARN: there is a DL runtime equal to {task['runtime']}!")
 
 
@@ -259,72 +375,35 @@ def get_hyperperiod(taskset):
     return hyperperiod
 
 
-class u64(np.uint64):
-    pass
-
-
-class TooBigTaskRuntimeError(Exception):
-    pass
-
-
-class TasksetCannotBeAcceptedError(Exception):
-    pass
-
-
-DL_BW_SHIFT = u64(20)
-DL_BW_UNIT = u64(1) << DL_BW_SHIFT
-DL_RATIO_SHIFT = u64(8)
-DL_MAX_BW_BITS = u64(64) - DL_BW_SHIFT
-DL_MAX_BW = (u64(1) << DL_MAX_BW_BITS) - u64(1)
-
-
-def dl_to_ratio(runtime: u64, period: u64):
-    if runtime > DL_MAX_BW:
-        raise TooBigTaskRuntimeError(
-            f"{runtime} is too big! Maximum allowed value is {DL_MAX_BW}!")
-    return (runtime << DL_BW_SHIFT) // period
-
-
-DL_NSEC_PER_USEC = u64(1000)
-DL_SYSCTL_SCHED_RT_RUNTIME = u64(950000)
-DL_SYSCTL_SCHED_RT_PERIOD = u64(1000000)
-DL_GLOBAL_RUNTIME = DL_SYSCTL_SCHED_RT_RUNTIME * DL_NSEC_PER_USEC
-DL_GLOBAL_PERIOD = DL_SYSCTL_SCHED_RT_PERIOD * DL_NSEC_PER_USEC
-DL_GLOBAL_BW = dl_to_ratio(DL_GLOBAL_RUNTIME, DL_GLOBAL_PERIOD)
-
+def make_rtapp_config(taskset, args):
+    # Returns the rt-app configuration and the distortion of the taskset, so
+    # that callers converting many tasksets can warn about all of them at once
+    taskset, distortion = fix_taskset(taskset, args)
+    warn_on_too_small(taskset)
+    duration = get_duration(taskset, args)
 
-def check_dl_params(taskset, num_cpus):
     # This check is just to be EXTRA SURE that the taskset will be accepted by
-    # SCHED_DEADLINE.
-    #
-    # It performs the same exact calculation that SCHED_DEADLINE does when
-    # testing for tasks acceptance.
-    total_bw = u64(0)
-    for task in taskset:
-        total_bw += dl_to_ratio(u64(task['runtime']), u64(task['period']))
-
-    if DL_GLOBAL_BW * num_cpus < total_bw:
-        raise TasksetCannotBeAcceptedError(
-            f"The bandwidth {total_bw} is greater than {DL_GLOBAL_BW * num_cpus}")
-
-
-def main():
-    args = parse_args()
+    # SCHED_DEADLINE: it performs the same exact calculation that
+    # SCHED_DEADLINE does when testing for tasks acceptance.
+    check_dl_params(taskset, args.capacities)
 
-    taskset = parse_taskset(args.infile)
-    taskset = fix_taskset(taskset, args)
-    warn_on_too_small(taskset)
-    duration = get_duration(taskset, args)
+    tasks = [dict(task, run=fix_runtime(task['runtime'], args)) for task in taskset]
+    return rtapp_struct(tasks, duration, args.calibration, args.trace), distortion
+#-- make_rtapp_config
 
-    # FIXME: change with argument for number of CPUs
-    check_dl_params(taskset, 4)
 
+def rtapp_struct(tasks, duration, calibration, trace=False):
+    """
+    Renders the rt-app configuration of a taskset whose parameters have
+    already been fixed: each task is a dict with the run, runtime (the DL
+    runtime) and period values, in us.
+    """
     output_struct = {
         'tasks': {},
         'global': {
             'duration': duration,
             'default_policy': 'SCHED_DEADLINE',
-            'calibration': args.calibration,
+            'calibration': calibration,
             'pi_enabled': False,
             'lock_pages': True,
             'logdir': '/mnt/ramfs/rt-app-logs',
@@ -334,12 +413,12 @@ def main():
         }
     }
 
-    if args.trace:
+    if trace:
         output_struct['global']['ftrace'] = "main,task,loop,event"
 
-    for i, task in enumerate(taskset):
+    for i, task in enumerate(tasks):
         output_struct['tasks'][task_name(i)] = {
-            'run': fix_runtime(task['runtime'], args),
+            'run': task['run'],
             'timer': {
                 'period': task['period'],
                 'mode': 'absolute',
@@ -350,9 +429,22 @@ def main():
             'delay': 500000,
         }
 
-    with open(args.outfile, 'w') as outfile:
+    return output_struct
+
+
+def write_rtapp_config(output_struct, fname):
+    with open(fname, 'w') as outfile:
         json.dump(output_struct, outfile, indent=2)
 
+
+def main():
+    args = parse_args()
+
+    taskset = parse_taskset(args.infile)
+    output_struct, distortion = make_rtapp_config(taskset, args)
+    warn_on_distortion([distortion])
+    write_rtapp_config(output_struct, args.outfile)
+
     return 0
 # main
 
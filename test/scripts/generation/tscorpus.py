@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+
+"""\
+Packs a whole directory of tasksets (the ts_*.json files produced by
+taskset2json.py and the ts_*.txt files produced by taskgen3.py) into a single
+columnar file that can be memory-mapped, so that analyses can load the full
+corpus without opening every single file.
+
+Tasksets in the corpus are sorted (and indexed) by (num_tasks, tset_idx, util);
+the rt-app configuration of any of them can be rendered on demand, identical
+to the one that taskset2json.py produced for it.
+
+Commands:
+  build    pack the tasksets found in some directories into a corpus file
+  list     print the distinct values of the number of tasks, index or
+           utilization in the corpus, formatted as in taskset names
+  export   write the rt-app configuration of a single taskset
+  info     print a summary of the corpus
+"""
+
+import argparse
+import json
+import os
+import re
+import struct
+import sys
+
+import numpy as np
+
+import taskset2json
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+class CorpusFormatError(Exception):
+    pass
+
+
+CORPUS_MAGIC = b'APEDFTSC'
+CORPUS_VERSION = 1
+
+# Each column starts at a multiple of this, relative to the beginning of the
+# data section
+CORPUS_ALIGN = 64
+
+# Per-taskset columns, sorted by key (see taskset_key())
+TASKSET_COLUMNS = {
+    'key': np.uint64,
+    'num_tasks': np.uint16,
+    'tset_idx': np.uint16,
+    'util': np.float64,
+    'duration': np.uint32,
+    'calibration': np.uint32,
+    'trace': np.bool_,
+    # Position of the first task of each taskset in the task columns (there
+    # is one more element than tasksets)
+    'offset': np.uint64,
+}
+
+# Per-task columns, in us; gen_runtime is the runtime generated by taskgen3.py
+# (before quota enforcement), runtime is the one given to SCHED_DEADLINE and
+# run is the one rt-app actually executes
+TASK_COLUMNS = {
+    'gen_runtime': np.uint32,
+    'runtime': np.uint32,
+    'run': np.uint32,
+    'period': np.uint32,
+}
+
+TASKSET_NAME_RE = re.compile(r'ts_n(\d+)_i(\d+)_u(\d+\.\d+)$')
+
+PARAMS = ['ntask', 'index', 'utilization']
+
+
+# ------------------------------- KEYS ----------------------------------- #
+
+def util_key(util):
+    # Same precision used in taskset names
+    return np.rint(np.asarray(util, dtype=np.float64) * 10000).astype(np.uint64)
+
+
+def taskset_key(num_tasks, tset_idx, util):
+    """
+    Packs (num_tasks, tset_idx, util) into a single integer that sorts like
+    the tuple, so that lookups are a binary search on one column.
+    """
+    return ((np.asarray(num_tasks, dtype=np.uint64) << np.uint64(40))
+            | (np.asarray(tset_idx, dtype=np.uint64) << np.uint64(24))
+            | util_key(util))
+
+
+def taskset_name(num_tasks, tset_idx, util):
+    return 'ts_n%02d_i%02d_u%.4f' % (num_tasks, tset_idx, float(util))
+
+
+def parse_taskset_name(name):
+    match = TASKSET_NAME_RE.match(name)
+    if match is None:
+        return None
+    return int(match[1]), int(match[2]), float(match[3])
+
+
+# ------------------------------ FILE FORMAT ----------------------------- #
+
+def align(offset):
+    return -(-offset // CORPUS_ALIGN) * CORPUS_ALIGN
+
+
+def write_columns(fname, columns, meta=None):
+    """
+    Writes a dictionary of 1-D arrays to fname. The layout is the magic
+    string, the length of a JSON header (little-endian uint64), the header
+    itself and then each column, aligned to CORPUS_ALIGN bytes.
+    """
+    header = {'version': CORPUS_VERSION, 'meta': meta or {}, 'columns': {}}
+    offset = 0
+    for name, array in columns.items():
+        header['columns'][name] = {
+            'dtype': array.dtype.str,
+            'length': len(array),
+            'offset': offset,
+        }
+        offset = align(offset + array.nbytes)
+    encoded = json.dumps(header).encode()
+
+    # Write to a temporary file first, a corpus is either complete or absent
+    tmpname = fname + '.tmp'
+    with open(tmpname, 'wb') as outfile:
+        outfile.write(CORPUS_MAGIC + struct.pack('<Q', len(encoded)) + encoded)
+        data_start = align(outfile.tell())
+        for name, array in columns.items():
+            outfile.seek(data_start + header['columns'][name]['offset'])
+            outfile.write(np.ascontiguousarray(array).tobytes())
+        outfile.truncate(data_start + offset)
+    os.replace(tmpname, fname)
+
+
+def read_header(fname):
+    with open(fname, 'rb') as infile:
+        magic = infile.read(len(CORPUS_MAGIC))
+        if magic != CORPUS_MAGIC:
+            raise CorpusFormatError(f"{fname} is not a taskset corpus")
+        (length,) = struct.unpack('<Q', infile.read(8))
+        header = json.loads(infile.read(length))
+        data_start = align(infile.tell())
+    if header['version'] != CORPUS_VERSION:
+        raise CorpusFormatError(
+            f"{fname} has version {header['version']}, expected {CORPUS_VERSION}")
+    return header, data_start
+
+
+class Corpus:
+    """
+    A read-only view of a corpus file; columns are memory-mapped the first
+    time they are accessed, e.g. corpus['period'].
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.header, self.data_start = read_header(fname)
+        self.meta = self.header['meta']
+        self._columns = {}
+
+    def __getitem__(self, name):
+        if name not in self._columns:
+            info = self.header['columns'][name]
+            if info['length'] == 0:
+                self._columns[name] = np.empty(0, dtype=info['dtype'])
+            else:
+                self._columns[name] = np.memmap(
+                    self.fname, dtype=info['dtype'], mode='r',
+                    offset=self.data_start + info['offset'], shape=(info['length'],))
+        return self._columns[name]
+
+    def __len__(self):
+        return self.header['columns']['key']['length']
+
+    def find(self, num_tasks, tset_idx, util):
+        # Returns the position of the taskset, or None if it is not in the corpus
+        keys = self['key']
+        key = taskset_key(num_tasks, tset_idx, util)
+        pos = int(np.searchsorted(keys, key))
+        if pos < len(keys) and keys[pos] == key:
+            return pos
+        return None
+
+    def name(self, pos):
+        return taskset_name(self['num_tasks'][pos], self['tset_idx'][pos], self['util'][pos])
+
+    def tasks(self, pos, column):
+        offset = self['offset']
+        return self[column][offset[pos]:offset[pos + 1]]
+
+    def padded(self, column, fill=0):
+        """
+        Returns a (num_tasksets, max_num_tasks) array with the values of a task
+        column, padded with fill, for vectorized analyses of the whole corpus.
+        """
+        offset = self['offset'].astype(np.int64)
+        counts = np.diff(offset)
+        values = np.asarray(self[column])
+        out = np.full((len(counts), counts.max(initial=0)), fill, dtype=values.dtype)
+        rows = np.repeat(np.arange(len(counts)), counts)
+        cols = np.arange(len(values)) - np.repeat(offset[:-1], counts)
+        out[rows, cols] = values
+        return out
+
+    def rtapp_config(self, pos):
+        tasks = [
+            {'run': int(run), 'runtime': int(runtime), 'period': int(period)}
+            for run, runtime, period in zip(self.tasks(pos, 'run'),
+                                            self.tasks(pos, 'runtime'),
+                                            self.tasks(pos, 'period'))
+        ]
+        return taskset2json.rtapp_struct(
+            tasks, int(self['duration'][pos]), int(self['calibration'][pos]),
+            bool(self['trace'][pos]))
+
+
+# ------------------------------- BUILD ---------------------------------- #
+
+def read_gen_runtimes(fname):
+    # The taskgen3.py output is optional, if missing the DL runtimes are used
+    if not os.path.isfile(fname):
+        return None
+    return [task['runtime'] for task in taskset2json.parse_taskset(fname)]
+
+
+def read_taskset(fname):
+    with open(fname, 'r') as infile:
+        config = json.load(infile)
+    tasks = list(config['tasks'].values())
+    gen_runtimes = read_gen_runtimes(os.path.splitext(fname)[0] + '.txt')
+    if gen_runtimes is None or len(gen_runtimes) != len(tasks):
+        gen_runtimes = [task['dl-runtime'] for task in tasks]
+    return {
+        'duration': config['global']['duration'],
+        'calibration': config['global']['calibration'],
+        'trace': 'ftrace' in config['global'],
+        'gen_runtime': gen_runtimes,
+        'runtime': [task['dl-runtime'] for task in tasks],
+        'run': [task['run'] for task in tasks],
+        'period': [task['dl-period'] for task in tasks],
+    }
+
+
+def find_tasksets(paths):
+    fnames = {}
+    for path in paths:
+        for dirpath, _, files in os.walk(path):
+            for f in files:
+                name, ext = os.path.splitext(f)
+                params = parse_taskset_name(name)
+                if ext == '.json' and params is not None:
+                    # Duplicate tasksets in different directories: the last
+                    # one wins, like when test.sh picks the first one found
+                    fnames[params] = os.path.join(dirpath, f)
+    return fnames
+
+
+def build_corpus(paths, fname):
+    fnames = find_tasksets(paths)
+    params = sorted(fnames, key=lambda p: (p[0], p[1], int(util_key(p[2]))))
+
+    tasksets = [read_taskset(fnames[p]) for p in params]
+    counts = [len(t['period']) for t in tasksets]
+
+    columns = {
+        'key': taskset_key([p[0] for p in params], [p[1] for p in params],
+                           [p[2] for p in params]),
+        'num_tasks': np.array([p[0] for p in params], dtype=TASKSET_COLUMNS['num_tasks']),
+        'tset_idx': np.array([p[1] for p in params], dtype=TASKSET_COLUMNS['tset_idx']),
+        'util': np.array([p[2] for p in params], dtype=TASKSET_COLUMNS['util']),
+        'offset': np.concatenate(([0], np.cumsum(counts, dtype=np.uint64))).astype(TASKSET_COLUMNS['offset']),
+    }
+    for column in ['duration', 'calibration', 'trace']:
+        columns[column] = np.array([t[column] for t in tasksets],
+                                   dtype=TASKSET_COLUMNS[column])
+    for column, dtype in TASK_COLUMNS.items():
+        columns[column] = np.array([v for t in tasksets for v in t[column]], dtype=dtype)
+
+    write_columns(fname, columns, {'sources': [os.path.relpath(p) for p in paths]})
+    return len(params)
+
+
+# -------------------------------- CLI ----------------------------------- #
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help="Pack tasksets into a corpus file")
+    build.add_argument('paths',
+                       nargs='+',
+                       help="Directories to search for ts_*.json files",
+                       )
+    build.add_argument('-o', '--outfile',
+                       required=True,
+                       help="The corpus file to write",
+                       )
+
+    listp = subparsers.add_parser('list', help="List the values of a parameter")
+    listp.add_argument('corpus')
+    listp.add_argument('param', choices=PARAMS)
+
+    export = subparsers.add_parser('export', help="Write the rt-app configuration of a taskset")
+    export.add_argument('corpus')
+    export.add_argument('taskset',
+                        help="The name of the taskset, e.g. ts_n06_i00_u1.0000",
+                        )
+    export.add_argument('-o', '--outfile',
+                        default='/dev/stdout',
+                        help="The file to output (if not provided, saves to stdout)",
+                        )
+
+    info = subparsers.add_parser('info', help="Print a summary of the corpus")
+    info.add_argument('corpus')
+
+    return parser.parse_args()
+
+
+def param_values(corpus, param):
+    # Formatted like in taskset names (and like test.sh expects them)
+    if param == 'ntask':
+        return ['%02d' % v for v in np.unique(corpus['num_tasks'])]
+    if param == 'index':
+        return ['%02d' % v for v in np.unique(corpus['tset_idx'])]
+    return ['%.4f' % (v / 10000) for v in np.unique(util_key(corpus['util']))]
+
+
+def print_info(corpus):
+    counts = np.diff(corpus['offset'].astype(np.int64))
+    print(f"{len(corpus)} tasksets, {counts.sum()} tasks")
+    for param in PARAMS:
+        print(f"{param}: {' '.join(param_values(corpus, param))}")
+
+
+def main():
+    args = parse_args()
+
+    if args.command == 'build':
+        count = build_corpus(args.paths, args.outfile)
+        print(f"{count} tasksets written to {args.outfile}")
+        return 0
+
+    try:
+        corpus = Corpus(args.corpus)
+    except (OSError, CorpusFormatError) as error:
+        eprint(f"ERROR: {error}")
+        return 2
+
+    if args.command == 'list':
+        print('\n'.join(param_values(corpus, args.param)))
+    elif args.command == 'info':
+        print_info(corpus)
+    elif args.command == 'export':
+        params = parse_taskset_name(args.taskset)
+        pos = None if params is None else corpus.find(*params)
+        if pos is None:
+            eprint(f"ERROR: taskset {args.taskset} not found!")
+            return 1
+        taskset2json.write_rtapp_config(corpus.rtapp_config(pos), args.outfile)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+
+"""\
+Generates parametric families of adversarial tasksets, the kind of tasksets on
+which AP-EDF and global EDF are expected to behave differently:
+- dhall: the Dhall effect, one light task per CPU released together with a
+  heavy task with a slightly longer period, which misses its deadline under
+  global EDF while a partitioned scheduler can place it on its own CPU
+- heavy-light: a few heavy tasks mixed with many light ones with shorter
+  periods
+- harmonic: tasks with the same utilization and periods forming harmonic
+  chains (each period is the previous one times an integer ratio)
+- near-capacity: a single task whose utilization is close to the bandwidth
+  available on one CPU, together with some light background tasks
+
+Each parameter of a family can be given a single value, a comma-separated list
+of values or a range in the form MIN:MAX:NUM (NUM equally spaced values); one
+taskset is generated for each combination of the values, all of them at once.
+Integer parameters that change the number of tasks cannot be swept.
+
+Tasksets are converted to rt-app configurations like taskset2json.py does and
+they are saved with the same names and layout used by taskgrid.py, so that
+they can be packed in a corpus and executed by test.sh. The index of each
+taskset is its position in the sweep (plus --first-index); the parameters of
+each one are listed in FAMILY.tsv in the output directory.
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+import dladmission
+import taskgrid
+import taskset2json
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+class InvalidSweepError(Exception):
+    pass
+
+
+# ------------------------------ SWEEPS ---------------------------------- #
+
+def parse_sweep(spec):
+    # A single value, a list "a,b,c" or a range "min:max:num"
+    try:
+        if ':' in spec:
+            mini, maxi, num = spec.split(':')
+            return np.linspace(float(mini), float(maxi), int(num))
+        return np.array([float(v) for v in spec.split(',')])
+    except ValueError:
+        raise InvalidSweepError(f"invalid parameter values '{spec}'!")
+
+
+def sweep_grid(sweeps):
+    """
+    Returns a dictionary of 1-D arrays, one element per combination of the
+    values of the given parameters (the first parameter varies the slowest).
+    """
+    names = list(sweeps)
+    grids = np.meshgrid(*[sweeps[name] for name in names], indexing='ij')
+    return {name: grid.ravel() for name, grid in zip(names, grids)}
+
+
+def column(values, num):
+    # Repeats each value of a sweep for num tasks
+    return np.repeat(values[:, None], num, axis=1)
+
+
+# ------------------------------ FAMILIES -------------------------------- #
+
+# Each family returns the (nsets, num_tasks) arrays of utilizations and periods
+# (in us) of the tasks, in the order in which rt-app will create them
+
+def dhall_family(p, args):
+    light = args.num_light
+    utils = np.hstack([column(p['light_util'], light), p['heavy_util'][:, None]])
+    periods = np.hstack([column(p['period'], light), (p['period'] + p['delta'])[:, None]])
+    return utils, periods
+
+
+def heavy_light_family(p, args):
+    heavy, light = args.num_heavy, args.num_light
+    utils = np.hstack([column(p['heavy_util'], heavy), column(p['light_util'], light)])
+    periods = np.hstack([column(p['heavy_period'], heavy), column(p['light_period'], light)])
+    return utils, periods
+
+
+def harmonic_family(p, args):
+    n = args.num_tasks
+    if args.levels < 1:
+        raise InvalidSweepError("the chain must have at least one level!")
+    utils = column(p['util'] / n, n)
+    # Periods cycle over the chain base, base * ratio, base * ratio^2, ...
+    exponents = np.arange(n) % args.levels
+    periods = p['base_period'][:, None] * np.rint(p['ratio'])[:, None] ** exponents
+    return utils, periods
+
+
+def near_capacity_family(p, args):
+    light = args.num_light
+    utils = np.hstack([p['util'][:, None], column(p['background'] / light, light)])
+    periods = np.hstack([p['period'][:, None], column(p['light_period'], light)])
+    return utils, periods
+
+
+# Family name: (function, default values of the swept parameters)
+FAMILIES = {
+    'dhall': (dhall_family, {
+        'period': '500000:900000:5',
+        'delta': '10000',
+        'light_util': '0.1',
+        'heavy_util': '0.945',
+    }),
+    'heavy-light': (heavy_light_family, {
+        'heavy_util': '0.5:0.9:9',
+        'heavy_period': '1000000',
+        'light_util': '0.1',
+        'light_period': '100000',
+    }),
+    'harmonic': (harmonic_family, {
+        'util': '1.0:3.6:14',
+        'base_period': '100000',
+        'ratio': '2',
+    }),
+    'near-capacity': (near_capacity_family, {
+        'util': '0.9:0.95:11',
+        'period': '1000000',
+        'background': '1.0',
+        'light_period': '100000',
+    }),
+}
+
+
+def make_family(args):
+    """
+    Returns the swept parameters (a dictionary of 1-D arrays) and the
+    (nsets, num_tasks) arrays of DL runtimes and periods of the whole family.
+    """
+    function, defaults = FAMILIES[args.family]
+    sweeps = {name: parse_sweep(getattr(args, name) or default)
+              for name, default in defaults.items()}
+    params = sweep_grid(sweeps)
+
+    utils, periods = function(params, args)
+    periods = np.rint(periods).astype(np.int64)
+    if np.any(periods <= 0):
+        raise InvalidSweepError("all periods must be positive!")
+    if np.any(utils <= 0) or np.any(utils > 1):
+        raise InvalidSweepError("all task utilizations must be in (0, 1]!")
+
+    # Rounding first avoids losing 1us to the floating point error
+    runtimes = np.floor(np.round(utils * periods, 6)).astype(np.int64)
+    return params, runtimes, periods
+
+
+# ------------------------------- OUTPUT --------------------------------- #
+
+def write_family(params, runtimes, periods, args, rtapp_args):
+    """
+    Writes the .txt and .json files of each taskset of the family and the
+    table of parameters, returns the number of tasksets rejected by the
+    admission test.
+    """
+    num_tasks = runtimes.shape[1]
+    utils = runtimes / periods
+    tset_dir = os.path.join(args.out_dir, '%02d' % num_tasks)
+    os.makedirs(tset_dir, exist_ok=True)
+
+    rejected = 0
+    distortions = []
+    table_fname = os.path.join(args.out_dir, args.family + '.tsv')
+    with open(table_fname, 'w') as table:
+        print('\t'.join(['name', 'accepted'] + list(params)), file=table)
+        for i in range(len(runtimes)):
+            name = taskgrid.taskset_name(num_tasks, args.first_index + i, utils[i].sum())
+            taskset = [{'runtime': int(C), 'period': int(T)}
+                       for C, T in zip(runtimes[i], periods[i])]
+
+            fname = os.path.join(tset_dir, name)
+            try:
+                # The conversion modifies the taskset, write the original one
+                taskgrid.write_taskset(taskset, fname + '.txt')
+                output_struct, distortion = taskset2json.make_rtapp_config(taskset, rtapp_args)
+                taskset2json.write_rtapp_config(output_struct, fname + '.json')
+                distortions.append(distortion)
+                accepted = True
+            except dladmission.TasksetCannotBeAcceptedError as error:
+                eprint(f"WARN: {name} rejected: {error}")
+                os.remove(fname + '.txt')
+                rejected += 1
+                accepted = False
+
+            values = ['%g' % params[p][i] for p in params]
+            print('\t'.join([name, str(accepted)] + values), file=table)
+
+    taskset2json.warn_on_distortion(distortions)
+    return rejected
+
+
+def default_quota(capacities):
+    # The whole bandwidth SCHED_DEADLINE admits in the root domain
+    return (dladmission.dl_bw_capacity(capacities) / dladmission.SCHED_CAPACITY_SCALE
+            * dladmission.DL_SYSCTL_SCHED_RT_RUNTIME / dladmission.DL_SYSCTL_SCHED_RT_PERIOD)
+
+
+def rtapp_options(args):
+    # Same options of taskset2json.py
+    return argparse.Namespace(
+        runtime_fraction=args.runtime_fraction,
+        runtime_remove=args.runtime_remove,
+        min_duration=args.min_duration,
+        max_duration=args.max_duration,
+        calibration=args.calibration,
+        quota=args.quota if args.quota is not None else default_quota(args.capacities),
+        quota_policy=args.quota_policy,
+        capacities=args.capacities,
+        trace=args.trace,
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    parser.add_argument('-o', '--out-dir',
+                        default='./tasksets-adversarial',
+                        help="Where to save the tasksets",
+                        )
+
+    parser.add_argument('-i', '--first-index',
+                        type=int, default=0,
+                        help="The index of the first taskset, to put more families in the same directory",
+                        )
+
+    parser.add_argument('-r', '--runtime-fraction',
+                        type=taskset2json.float_range(0, 1), default=.95,
+                        help="The fraction of the runtime it should actually run for",
+                        )
+
+    parser.add_argument('-R', '--runtime-remove',
+                        type=taskset2json.int_range(0, 100000), default=0,
+                        help="The amount to statically remove from each runtime [us]",
+                        )
+
+    parser.add_argument('-m', '--min-duration',
+                        type=int, default=20,
+                        help="The minimum duration in seconds of the taskset execution",
+                        )
+
+    parser.add_argument('-M', '--max-duration',
+                        type=int, default=600,
+                        help="The maximum duration in seconds of the taskset execution",
+                        )
+
+    parser.add_argument('-c', '--calibration',
+                        type=int, default=92,
+                        help="The calibration for RT-APP",
+                        )
+
+    parser.add_argument('-q', '--quota',
+                        type=float, default=None,
+                        help="The maximum utilization of each taskset (default: the bandwidth admitted in the root domain)",
+                        )
+
+    parser.add_argument('-p', '--quota-policy',
+                        choices=taskset2json.QUOTA_POLICIES, default='legacy',
+                        help="How runtimes are reduced when a taskset exceeds the quota, see taskset2json.py",
+                        )
+
+    parser.add_argument('-C', '--capacities',
+                        nargs='+', type=int, default=dladmission.DEFAULT_CAPACITIES,
+                        help="The capacity of each CPU in the root domain the tasksets will run in",
+                        )
+
+    parser.add_argument('-T', '--trace',
+                        default=False,
+                        action='store_true',
+                        help="Enable RTAPP ftrace functionality",
+                        )
+
+    families = parser.add_subparsers(dest='family', required=True, metavar='FAMILY')
+    for family, (function, defaults) in FAMILIES.items():
+        sub = families.add_parser(family, help=function.__name__.replace('_', ' '))
+        for name, default in defaults.items():
+            sub.add_argument('--' + name.replace('_', '-'),
+                             dest=name, default=None,
+                             help=f"Values of the {name} parameter (default: {default})",
+                             )
+
+    families.choices['dhall'].add_argument(
+        '--num-light', type=int, default=None,
+        help="The number of light tasks (default: one per CPU)")
+    families.choices['heavy-light'].add_argument(
+        '--num-heavy', type=int, default=2,
+        help="The number of heavy tasks")
+    families.choices['heavy-light'].add_argument(
+        '--num-light', type=int, default=8,
+        help="The number of light tasks")
+    families.choices['harmonic'].add_argument(
+        '-n', '--num-tasks', type=int, default=8,
+        help="The number of tasks")
+    families.choices['harmonic'].add_argument(
+        '--levels', type=int, default=4,
+        help="The number of different periods in the chain")
+    families.choices['near-capacity'].add_argument(
+        '--num-light', type=int, default=3,
+        help="The number of light background tasks")
+
+    args = parser.parse_args()
+    if args.family == 'dhall' and args.num_light is None:
+        args.num_light = len(args.capacities)
+    return args
+
+
+def main():
+    args = parse_args()
+
+    try:
+        params, runtimes, periods = make_family(args)
+    except InvalidSweepError as error:
+        eprint(f"ERROR: {error}")
+        return 1
+
+    rejected = write_family(params, runtimes, periods, args, rtapp_options(args))
+    print("%d tasksets of the %s family generated, %d rejected"
+          % (len(runtimes), args.family, rejected))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
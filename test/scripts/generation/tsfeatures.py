@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+"""\
+Computes a feature index of a taskset corpus (see tscorpus.py) and uses it to
+find similar tasksets, so that fewer tasksets can be executed while still
+covering the same portion of the design space.
+
+The features of each taskset, computed with the SCHED_DEADLINE parameters of
+its tasks, are:
+- sorted_util: the task utilizations, in decreasing order
+- umax: the maximum task utilization
+- period_spread: the natural logarithm of the ratio between the longest and
+  the shortest period
+- log_hyperperiod: the base 10 logarithm of the hyperperiod (in us)
+- dl_bw: the sum of the task bandwidths as computed by the kernel, as a
+  fraction of one CPU
+
+Distances are Euclidean, on features divided by their standard deviation in
+the corpus; the sorted utilization vector weighs as much as a single feature.
+
+The index is saved next to the corpus (CORPUS.features) in the same columnar
+format and it is computed again whenever the corpus is newer.
+
+Commands:
+  index       compute the feature index of a corpus
+  nearest     print the tasksets most similar to a given one
+  select      choose k tasksets per (num_tasks, util) cell, as different from
+              each other as possible, and print their names (test.sh runs only
+              the tasksets listed in TASKSETS_SELECTION when it exists)
+  duplicates  print the pairs of tasksets in the same cell closer than a
+              threshold
+"""
+
+import argparse
+import functools
+import math
+import os
+import sys
+
+import numpy as np
+
+import dladmission
+import taskset2json
+import tscorpus
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+SCALAR_FEATURES = ['umax', 'period_spread', 'log_hyperperiod', 'dl_bw']
+
+INDEX_SUFFIX = '.features'
+
+
+# ------------------------------ FEATURES -------------------------------- #
+
+def hyperperiods(periods, valid):
+    # Python integers, the lcm of periods of 16 tasks can overflow int64
+    return np.array([functools.reduce(taskset2json.lcm, row[mask].tolist(), 1)
+                     for row, mask in zip(periods, valid)], dtype=np.float64)
+
+
+def compute_features(corpus):
+    """
+    Returns the (num_tasksets, max_num_tasks) array of sorted utilizations and
+    a dictionary with one array per scalar feature.
+    """
+    C = corpus.padded('runtime').astype(np.int64)
+    T = corpus.padded('period').astype(np.int64)
+    valid = T > 0
+
+    u = np.where(valid, C / np.where(valid, T, 1), 0.0)
+    sorted_util = -np.sort(-u, axis=1)
+
+    T_max = np.where(valid, T, 0).max(axis=1, initial=1)
+    T_min = np.where(valid, T, np.iinfo(np.int64).max).min(axis=1, initial=np.iinfo(np.int64).max)
+    bw = dladmission.dl_to_ratio(C * dladmission.DL_NSEC_PER_USEC,
+                                 T * dladmission.DL_NSEC_PER_USEC)
+
+    scalars = {
+        'umax': sorted_util[:, 0] if u.shape[1] else np.zeros(len(u)),
+        'period_spread': np.log(T_max / np.maximum(T_min, 1)),
+        'log_hyperperiod': np.log10(hyperperiods(T, valid)),
+        'dl_bw': bw.sum(axis=1, dtype=np.uint64) / dladmission.DL_BW_UNIT,
+    }
+    return sorted_util, scalars
+
+
+def write_index(corpus, fname):
+    sorted_util, scalars = compute_features(corpus)
+    columns = {
+        'key': np.asarray(corpus['key']),
+        'num_tasks': np.asarray(corpus['num_tasks']),
+        'tset_idx': np.asarray(corpus['tset_idx']),
+        'util': np.asarray(corpus['util']),
+        'sorted_util': sorted_util.ravel(),
+    }
+    columns.update(scalars)
+    meta = {'features': SCALAR_FEATURES, 'width': sorted_util.shape[1]}
+    tscorpus.write_columns(fname, columns, meta)
+
+
+def load_index(corpus_fname):
+    # Returns the index of the corpus, computing it first if needed
+    fname = corpus_fname + INDEX_SUFFIX
+    if not os.path.exists(fname) or os.path.getmtime(fname) < os.path.getmtime(corpus_fname):
+        write_index(tscorpus.Corpus(corpus_fname), fname)
+    return tscorpus.Corpus(fname)
+
+
+def feature_matrix(index):
+    """
+    Returns the standardized feature vectors of all the tasksets in the index,
+    one per row.
+    """
+    width = index.meta['width']
+    blocks = [np.asarray(index['sorted_util']).reshape(-1, width)]
+    blocks += [np.asarray(index[name])[:, None] for name in index.meta['features']]
+
+    # Each block counts as a single feature
+    scaled = []
+    for block in blocks:
+        std = block.std(axis=0)
+        block = block / np.where(std > 0, std, 1)
+        scaled.append(block / math.sqrt(block.shape[1]))
+    return np.hstack(scaled)
+
+
+def distances(X, Y):
+    # Pairwise Euclidean distances between the rows of X and Y
+    return np.sqrt(np.maximum(
+        (X ** 2).sum(axis=1)[:, None] + (Y ** 2).sum(axis=1)[None, :] - 2 * X @ Y.T, 0))
+
+
+def cells(index):
+    # Yields the positions of the tasksets of each (num_tasks, util) cell
+    keys = np.stack([np.asarray(index['num_tasks'], dtype=np.uint64),
+                     tscorpus.util_key(index['util'])], axis=1)
+    _, inverse = np.unique(keys, axis=0, return_inverse=True)
+    for cell in range(inverse.max(initial=-1) + 1):
+        yield np.flatnonzero(inverse.ravel() == cell)
+
+
+# ------------------------------ QUERIES --------------------------------- #
+
+def nearest(index, X, pos, k, same_cell=False):
+    # Returns the positions of the k nearest tasksets and their distances
+    candidates = np.arange(len(X))
+    if same_cell:
+        candidates = next(c for c in cells(index) if pos in c)
+    candidates = candidates[candidates != pos]
+
+    dist = distances(X[[pos]], X[candidates])[0]
+    order = np.argsort(dist, kind='stable')[:k]
+    return candidates[order], dist[order]
+
+
+def max_diverse(D, k):
+    """
+    Greedy farthest-point selection on a distance matrix: starts from the
+    medoid and adds the point farthest from the selected ones each time.
+    Returns the selected positions and the covering radius (the distance of
+    the farthest point from the selected ones).
+    """
+    selected = [int(np.argmin(D.sum(axis=1)))]
+    closest = D[selected[0]].copy()
+    while len(selected) < min(k, len(D)):
+        far = int(np.argmax(closest))
+        selected.append(far)
+        closest = np.minimum(closest, D[far])
+    return selected, closest.max(initial=0)
+
+
+def select(index, X, k):
+    """
+    Returns the positions of the k most diverse tasksets of each cell (sorted)
+    and the covering radius of each cell.
+    """
+    chosen = []
+    radii = []
+    for cell in cells(index):
+        picked, radius = max_diverse(distances(X[cell], X[cell]), k)
+        chosen += list(cell[picked])
+        radii.append(radius)
+    return sorted(chosen), radii
+
+
+def duplicates(index, X, threshold):
+    # Yields the pairs of tasksets of the same cell closer than threshold
+    for cell in cells(index):
+        D = distances(X[cell], X[cell])
+        for i, j in zip(*np.nonzero(np.triu(D < threshold, k=1))):
+            yield cell[i], cell[j], D[i, j]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    indexp = subparsers.add_parser('index', help="Compute the feature index of a corpus")
+    indexp.add_argument('corpus')
+
+    nearestp = subparsers.add_parser('nearest', help="Print the most similar tasksets")
+    nearestp.add_argument('corpus')
+    nearestp.add_argument('taskset',
+                          help="The name of the taskset, e.g. ts_n06_i00_u1.0000",
+                          )
+    nearestp.add_argument('-k', '--count',
+                          type=int, default=5,
+                          help="The number of tasksets to print",
+                          )
+    nearestp.add_argument('-c', '--same-cell',
+                          default=False,
+                          action='store_true',
+                          help="Only consider tasksets with the same number of tasks and utilization",
+                          )
+
+    selectp = subparsers.add_parser('select', help="Choose the most diverse tasksets of each cell")
+    selectp.add_argument('corpus')
+    selectp.add_argument('-k', '--count',
+                         type=int, required=True,
+                         help="The number of tasksets to choose in each cell",
+                         )
+    selectp.add_argument('-o', '--outfile',
+                         default='/dev/stdout',
+                         help="Where to save the names of the chosen tasksets",
+                         )
+
+    dupp = subparsers.add_parser('duplicates', help="Print the pairs of near-duplicate tasksets")
+    dupp.add_argument('corpus')
+    dupp.add_argument('-t', '--threshold',
+                      type=float, default=0.1,
+                      help="The maximum distance between near-duplicates",
+                      )
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    try:
+        if args.command == 'index':
+            write_index(tscorpus.Corpus(args.corpus), args.corpus + INDEX_SUFFIX)
+            print(f"Feature index written to {args.corpus + INDEX_SUFFIX}")
+            return 0
+        index = load_index(args.corpus)
+    except (OSError, tscorpus.CorpusFormatError) as error:
+        eprint(f"ERROR: {error}")
+        return 2
+
+    X = feature_matrix(index)
+
+    if args.command == 'nearest':
+        params = tscorpus.parse_taskset_name(args.taskset)
+        pos = None if params is None else index.find(*params)
+        if pos is None:
+            eprint(f"ERROR: taskset {args.taskset} not found!")
+            return 1
+        for other, dist in zip(*nearest(index, X, pos, args.count, args.same_cell)):
+            print(f"{index.name(other)}\t{dist:.4f}")
+
+    elif args.command == 'select':
+        chosen, radii = select(index, X, args.count)
+        with open(args.outfile, 'w') as outfile:
+            for pos in chosen:
+                print(index.name(pos), file=outfile)
+        eprint(f"{len(chosen)}/{len(index)} tasksets chosen in {len(radii)} cells, "
+               f"covering radius: mean {np.mean(radii):.4f}, max {np.max(radii):.4f}")
+
+    elif args.command == 'duplicates':
+        count = 0
+        for a, b, dist in duplicates(index, X, args.threshold):
+            print(f"{index.name(a)}\t{index.name(b)}\t{dist:.4f}")
+            count += 1
+        eprint(f"{count} pairs of near-duplicates found")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+"""\
+Benchmarks the utilisation generators of taskgen3.py against Stafford's
+randfixedsum, for speed and distribution.
+
+For each number of tasks and taskset utilisation, each generator draws the
+same number of tasksets (as one (nsets, n) matrix) and the table reports:
+- time: the time it took to draw them, in seconds
+- rate: the number of tasksets drawn per second
+- umax, umin: the average maximum and minimum task utilisation in a taskset
+- std: the average standard deviation of the task utilisations in a taskset
+- ks: the Kolmogorov-Smirnov distance between the distribution of the task
+  utilisations and the one of Stafford's tasksets (0 for Stafford itself)
+- ks_max: the same distance, for the maximum task utilisation in a taskset
+
+With a cap of 1 and alpha equal to 1, all generators sample uniformly the
+same space, so the distances should be close to 0 (about 1/sqrt(nsets)).
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import taskgen3
+
+
+def ks_distance(a, b):
+    # Two-sample Kolmogorov-Smirnov statistic
+    a, b = np.sort(a.ravel()), np.sort(b.ravel())
+    values = np.concatenate([a, b])
+    cdf_a = np.searchsorted(a, values, side='right') / len(a)
+    cdf_b = np.searchsorted(b, values, side='right') / len(b)
+    return np.max(np.abs(cdf_a - cdf_b))
+
+
+def run_generator(generator, n, util, nsets, seed, alpha):
+    options = argparse.Namespace(
+        n=n,
+        util=util,
+        util_generator=generator,
+        util_cap=1.0,
+        alpha=alpha,
+    )
+    rng = np.random.RandomState(seed)
+    start = time.perf_counter()
+    x = taskgen3.gen_utils(options, nsets, rng)
+    return x, time.perf_counter() - start
+
+
+def benchmark(num_tasks, utils, nsets, seed, alpha):
+    rows = []
+    for n in num_tasks:
+        for util in utils:
+            if util > n:
+                continue
+            # Stafford's transition table is cached, build it beforehand so
+            # that only the sampling is timed
+            taskgen3.StaffordTransitionTable(n, util)
+            reference = None
+            for generator in taskgen3.UTIL_GENERATORS:
+                x, elapsed = run_generator(generator, n, util, nsets, seed, alpha)
+                if reference is None:
+                    reference = x
+                rows.append({
+                    'n': n,
+                    'util': util,
+                    'generator': generator,
+                    'time': elapsed,
+                    'rate': nsets / elapsed,
+                    'umax': x.max(axis=1).mean(),
+                    'umin': x.min(axis=1).mean(),
+                    'std': x.std(axis=1).mean(),
+                    'ks': ks_distance(x, reference),
+                    'ks_max': ks_distance(x.max(axis=1), reference.max(axis=1)),
+                })
+    return rows
+
+
+def print_table(rows):
+    print('n\tutil\tgenerator\ttime\trate\tumax\tumin\tstd\tks\tks_max')
+    for row in rows:
+        print('%(n)d\t%(util).2f\t%(generator)-10s\t%(time).4f\t%(rate).0f\t'
+              '%(umax).4f\t%(umin).4f\t%(std).4f\t%(ks).4f\t%(ks_max).4f' % row)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    parser.add_argument('-n', '--num-tasks',
+                        nargs='+', type=int, default=[4, 8, 16],
+                        help="The numbers of tasks to test",
+                        )
+
+    parser.add_argument('-u', '--utils',
+                        nargs='+', type=float, default=[1.0, 2.0, 3.6],
+                        help="The taskset utilisations to test",
+                        )
+
+    parser.add_argument('-s', '--num-sets',
+                        type=int, default=10000,
+                        help="The number of tasksets drawn by each generator",
+                        )
+
+    parser.add_argument('-S', '--seed',
+                        type=int, default=1,
+                        help="The seed of the generators",
+                        )
+
+    parser.add_argument('-a', '--dirichlet-alpha',
+                        type=float, default=1.0,
+                        help="The concentration parameter of the dirichlet generator",
+                        )
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    print_table(benchmark(args.num_tasks, args.utils, args.num_sets,
+                          args.seed, args.dirichlet_alpha))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+
+"""\
+Shards a campaign across multiple boards and supervises them from a single
+machine, like test-on-remote.py does for a single board.
+
+The boards are listed in an inventory file, one per line (# starts a comment):
+  NAME HOST TESTDIR [COMMAND]
+where HOST is the destination for ssh (e.g., root@10.30.3.51, automatic login
+via SSH keys is required) or - for a board on this machine, TESTDIR is the
+test directory of the APEDF project on the board and COMMAND is the command
+implementing the test.sh protocol (default: ./test.sh), executed in TESTDIR.
+For example:
+  odroid1  root@10.30.3.51  /root/APEDF/test
+  fake1    -                /tmp/boards/fake1  /root/APEDF/test/scripts/execution/fakeboard.py
+
+Runs are ordered by kernel, then by governor and taskset, like test.sh executes
+them, and partitioned in contiguous shards of the same size, so that each
+board boots as few kernels as possible. The shard of each board is written to
+TESTDIR/out/shard.tsv on the board and test.sh only plans the runs listed in
+it (see campaign.py).
+
+While supervising, the output of the completed runs is pulled from each board
+into WORKDIR/boards/NAME/out. A board that cannot be reached (or started) for
+a while is considered dead: its runs that were not pulled are split among the
+other boards, which are started again to execute them. When all boards are
+done, the outputs of all boards are merged in a single output directory.
+
+Commands:
+  plan    partition the runs of the campaign among the boards of an inventory
+  run     supervise the boards until all runs are completed, then merge
+  merge   merge the output pulled from all boards in a single directory
+  status  print the state of each board
+"""
+
+import argparse
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tarfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), 'scripts', 'execution'))
+
+import campaign
+import inventory
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+class SupervisorError(Exception):
+    pass
+
+
+STATE_FILE = 'state.json'
+BOARDS_DIR = 'boards'
+
+# ssh exit code when the host cannot be reached, used also for timeouts
+UNREACHABLE = 255
+
+# How many run directories are pulled with a single command
+PULL_BATCH = 256
+
+
+# -------------------------------- BOARDS -------------------------------- #
+
+class Board(inventory.Board):
+    def ssh_options(self):
+        # Keepalives detect a board that dies while its output is pulled
+        return super().ssh_options() + ['-o', 'ConnectTimeout=5', '-o', 'ServerAliveInterval=15',
+                                        '-o', 'ServerAliveCountMax=4']
+
+    def run(self, cmd, stdin=None, timeout=30):
+        # Returns the exit code, stdout (bytes) and stderr of a shell command
+        try:
+            process = subprocess.run(self.argv(cmd), input=stdin, timeout=timeout,
+                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except subprocess.TimeoutExpired:
+            return UNREACHABLE, b'', 'timed out'
+        return process.returncode, process.stdout, process.stderr.decode(errors='replace').strip()
+
+    def check_progress(self):
+        retcode, outs, errs = self.run(f"{self.command} check_progress")
+        return retcode, outs.decode(errors='replace').strip() or errs
+
+    def start(self):
+        retcode, _, errs = self.run(f"{self.command} start")
+        return retcode, errs
+
+    def push_shard(self, shard):
+        data = ''.join('\t'.join(run) + '\n' for run in shard).encode()
+        retcode, _, errs = self.run('mkdir -p out && cat >out/shard.tsv.tmp && '
+                                    'mv out/shard.tsv.tmp out/shard.tsv', stdin=data)
+        return retcode, errs
+
+    def list_done(self):
+        # Returns the output directories of the completed runs, relative to
+        # the test directory, or None if the board cannot be reached
+        retcode, outs, _ = self.run("find out -mindepth 3 -maxdepth 3 -name '*.out.d' "
+                                    "-not -path 'out/.*' 2>/dev/null || true")
+        if retcode != 0:
+            return None
+        return outs.decode().split()
+
+    def pull(self, paths, dest):
+        # Copies the given paths from the test directory to dest; the archive
+        # is extracted while it is received, members that would be written
+        # outside of dest are refused
+        for i in range(0, len(paths), PULL_BATCH):
+            batch = ' '.join(shlex.quote(p) for p in paths[i:i + PULL_BATCH])
+            with subprocess.Popen(self.argv(f"tar -cf - -- {batch}"),
+                                  stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE) as process:
+                try:
+                    with tarfile.open(fileobj=process.stdout, mode='r|') as tar:
+                        tar.extractall(dest, filter='data')
+                    error = None
+                except tarfile.ReadError as e:
+                    error = e
+                errs = process.stderr.read().decode(errors='replace').strip()
+            if process.returncode != 0:
+                # The archive is truncated or empty, the exit code tells why
+                return process.returncode, errs
+            if error is not None:
+                raise error
+        return 0, ''
+
+
+def read_inventory(fname):
+    return inventory.read_inventory(fname, Board)
+
+
+# ------------------------------- SHARDING ------------------------------- #
+
+def all_runs(args):
+    # All the runs of the campaign, in the order in which test.sh executes them
+    manifest = campaign.make_manifest(args)
+    return [(scheduler, governor, name)
+            for scheduler in args.schedulers
+            for governor in args.governors
+            for name, _ in manifest]
+
+
+def partition(runs, count):
+    # Splits the runs in count contiguous chunks of (almost) the same size
+    size, extra = divmod(len(runs), count)
+    chunks = []
+    start = 0
+    for i in range(count):
+        end = start + size + (i < extra)
+        chunks.append(runs[start:end])
+        start = end
+    return chunks
+
+
+def board_dir(workdir, name):
+    return os.path.join(workdir, BOARDS_DIR, name)
+
+
+def pulled_runs(workdir, name):
+    # The runs whose output was pulled from a board
+    out = os.path.join(board_dir(workdir, name), 'out')
+    runs = set()
+    for scheduler in os.listdir(out) if os.path.isdir(out) else []:
+        if scheduler.startswith('.') or not os.path.isdir(os.path.join(out, scheduler)):
+            continue
+        for governor in os.listdir(os.path.join(out, scheduler)):
+            for dname in os.listdir(os.path.join(out, scheduler, governor)):
+                if dname.endswith('.out.d'):
+                    runs.add((scheduler, governor, dname[:-len('.out.d')]))
+    return runs
+
+
+def rebalance(state, workdir, dead):
+    """
+    Splits the runs of a dead board whose output was not pulled among the
+    other boards; each chunk goes to the board whose shard ends with the
+    closest kernel, so that boards keep running the same kernels.
+    """
+    order = {scheduler: i for i, scheduler in enumerate(state['schedulers'])}
+    boards = state['boards']
+    done = pulled_runs(workdir, dead)
+    remaining = [run for run in boards[dead]['shard'] if tuple(run) not in done]
+    boards[dead]['shard'] = [run for run in boards[dead]['shard'] if tuple(run) in done]
+
+    alive = [name for name, board in boards.items() if board['state'] != 'dead']
+    if not alive:
+        raise SupervisorError("all boards are dead!")
+    alive.sort(key=lambda name: order[boards[name]['shard'][-1][0]] if boards[name]['shard'] else 0)
+
+    remaining.sort(key=lambda run: order[run[0]])
+    for name, chunk in zip(alive, partition(remaining, len(alive))):
+        if chunk:
+            boards[name]['shard'] += chunk
+            boards[name]['pushed'] = False
+            boards[name]['restart'] = True
+            if boards[name]['state'] == 'end':
+                boards[name]['state'] = 'running'
+            eprint(f"{name}: {len(chunk)} runs of {dead} reassigned")
+
+
+# -------------------------------- STATE --------------------------------- #
+
+def load_state(workdir):
+    try:
+        with open(os.path.join(workdir, STATE_FILE)) as infile:
+            return json.load(infile)
+    except FileNotFoundError:
+        raise SupervisorError(f"no campaign planned in {workdir}!")
+
+
+def save_state(workdir, state):
+    fname = os.path.join(workdir, STATE_FILE)
+    with open(fname + '.tmp', 'w') as outfile:
+        json.dump(state, outfile)
+    os.replace(fname + '.tmp', fname)
+
+
+def plan(args):
+    boards = read_inventory(args.inventory)
+    if os.path.exists(os.path.join(args.workdir, STATE_FILE)) and not args.force:
+        raise SupervisorError(f"campaign already planned in {args.workdir}, use --force!")
+
+    runs = all_runs(args)
+    state = {
+        'inventory': os.path.abspath(args.inventory),
+        'schedulers': args.schedulers,
+        'governors': args.governors,
+        'boards': {},
+    }
+    for board, shard in zip(boards, partition(runs, len(boards))):
+        state['boards'][board.name] = {
+            'state': 'running',
+            'shard': shard,
+            'pushed': False,
+            'restart': False,
+        }
+        kernels = sorted({run[0] for run in shard}, key=args.schedulers.index)
+        print(f"{board.name}: {len(shard)} runs, kernels: {' '.join(kernels)}")
+
+    os.makedirs(args.workdir, exist_ok=True)
+    save_state(args.workdir, state)
+
+
+# ------------------------------ SUPERVISOR ------------------------------ #
+
+def pull_new(board, workdir):
+    # Pulls the output of the runs completed since the last time
+    paths = board.list_done()
+    if paths is None:
+        return
+    have = pulled_runs(workdir, board.name)
+    new = [p for p in paths
+           if tuple(p.split('/')[1:3] + [os.path.basename(p)[:-len('.out.d')]]) not in have]
+    if not new:
+        return
+    retcode, errs = board.pull(new, board_dir(workdir, board.name))
+    if retcode != 0:
+        eprint(f"{board.name}: could not pull the output: {errs}")
+
+
+def poll(board, info, workdir):
+    """
+    Checks a board and (re)starts it when needed. Returns False if the board
+    could not be reached or started.
+    """
+    if not info['pushed']:
+        retcode, errs = board.push_shard(info['shard'])
+        if retcode != 0:
+            eprint(f"{board.name}: could not push the shard: {errs}")
+            return False
+        info['pushed'] = True
+
+    retcode, progress = board.check_progress()
+    if retcode == UNREACHABLE:
+        eprint(f"{board.name}: FAILURE! {progress}")
+        return False
+
+    pull_new(board, workdir)
+
+    if retcode == 0 and progress != 'END':
+        eprint(f"{board.name}: {progress}")
+        return True
+
+    if progress == 'END' and not info['restart']:
+        eprint(f"{board.name}: finished")
+        info['state'] = 'end'
+        return True
+
+    # Rebooted, crashed or given more runs: start the experiments again
+    retcode, errs = board.start()
+    if retcode != 0:
+        eprint(f"{board.name}: could not start: {errs}")
+        return False
+    eprint(f"{board.name}: started")
+    info['restart'] = False
+    return True
+
+
+def supervise(args):
+    state = load_state(args.workdir)
+    boards = {board.name: board for board in read_inventory(state['inventory'])}
+    last_seen = {name: time.time() for name in boards}
+
+    while True:
+        for name, info in state['boards'].items():
+            if info['state'] != 'running':
+                continue
+            if poll(boards[name], info, args.workdir):
+                last_seen[name] = time.time()
+            elif time.time() - last_seen[name] > args.dead_after:
+                eprint(f"{name}: no response for {args.dead_after:.0f}s, considered dead!")
+                info['state'] = 'dead'
+                rebalance(state, args.workdir, name)
+            save_state(args.workdir, state)
+
+        if all(info['state'] != 'running' for info in state['boards'].values()):
+            break
+        time.sleep(args.interval)
+
+    merge(args.workdir, args.outdir)
+
+
+def merge(workdir, outdir):
+    """
+    Copies the output of the runs pulled from all boards in outdir; runs
+    executed by more than one board (e.g., by a board considered dead that
+    came back) are copied only once.
+    """
+    state = load_state(workdir)
+    merged = 0
+    duplicates = 0
+    for name in state['boards']:
+        for scheduler, governor, taskset in sorted(pulled_runs(workdir, name)):
+            rel = os.path.join(scheduler, governor, taskset + '.out.d')
+            dst = os.path.join(outdir, rel)
+            if campaign.is_nonempty_dir(dst):
+                duplicates += 1
+                continue
+            shutil.rmtree(dst, ignore_errors=True)
+            shutil.copytree(os.path.join(board_dir(workdir, name), 'out', rel), dst)
+            merged += 1
+    print(f"{merged} runs merged in {outdir}, {duplicates} already there")
+
+
+def print_status(workdir):
+    state = load_state(workdir)
+    print('board\tstate\truns\tpulled\tkernels')
+    for name, info in state['boards'].items():
+        kernels = sorted({run[0] for run in info['shard']}, key=state['schedulers'].index)
+        print(f"{name}\t{info['state']}\t{len(info['shard'])}\t"
+              f"{len(pulled_runs(workdir, name))}\t{' '.join(kernels)}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    planp = subparsers.add_parser('plan', help="Partition the runs among the boards")
+    planp.add_argument('inventory')
+    planp.add_argument('-w', '--workdir',
+                       default='./boards.d',
+                       help="Where the state of the supervisor and the pulled outputs are saved",
+                       )
+    planp.add_argument('-t', '--tasksets',
+                       default='./tasksets',
+                       help="The directory of the tasksets",
+                       )
+    planp.add_argument('-s', '--schedulers',
+                       nargs='+', default=['global', 'apedf-ff', 'apedf-wf'],
+                       help="The scheduler variants, like SCHEDULERS in test.sh",
+                       )
+    planp.add_argument('-g', '--governors',
+                       nargs='+', default=['performance', 'schedutil'],
+                       help="The governors, like GOVERNORS in test.sh",
+                       )
+    planp.add_argument('-f', '--force',
+                       default=False,
+                       action='store_true',
+                       help="Plan again even if the campaign was already planned",
+                       )
+
+    runp = subparsers.add_parser('run', help="Supervise the boards")
+    runp.add_argument('-w', '--workdir',
+                      default='./boards.d',
+                      help="Where the state of the supervisor and the pulled outputs are saved",
+                      )
+    runp.add_argument('-o', '--outdir',
+                      default='./out',
+                      help="Where the outputs of all boards are merged",
+                      )
+    runp.add_argument('-i', '--interval',
+                      type=float, default=60,
+                      help="How often in seconds the boards are checked",
+                      )
+    runp.add_argument('-d', '--dead-after',
+                      type=float, default=20 * 60,
+                      help="The seconds after which a board that does not respond is dead",
+                      )
+
+    mergep = subparsers.add_parser('merge', help="Merge the output of all boards")
+    mergep.add_argument('-w', '--workdir',
+                        default='./boards.d',
+                        help="Where the state of the supervisor and the pulled outputs are saved",
+                        )
+    mergep.add_argument('-o', '--outdir',
+                        default='./out',
+                        help="Where the outputs of all boards are merged",
+                        )
+
+    statusp = subparsers.add_parser('status', help="Print the state of each board")
+    statusp.add_argument('-w', '--workdir',
+                         default='./boards.d',
+                         help="Where the state of the supervisor and the pulled outputs are saved",
+                         )
+
+    args = parser.parse_args()
+    if args.command == 'plan':
+        # Same defaults of test.sh
+        args.corpus = os.path.join(args.tasksets, 'corpus.tsc')
+        args.design = os.path.join(args.tasksets, 'design.tsv')
+        args.selection = os.path.join(args.tasksets, 'selection.txt')
+    return args
+
+
+def main():
+    args = parse_args()
+
+    try:
+        if args.command == 'plan':
+            plan(args)
+        elif args.command == 'run':
+            supervise(args)
+        elif args.command == 'merge':
+            merge(args.workdir, args.outdir)
+        elif args.command == 'status':
+            print_status(args.workdir)
+    except (OSError, tarfile.TarError, campaign.CampaignError, inventory.InventoryError,
+            SupervisorError) as error:
+        eprint(f"ERROR: {error}")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,20 @@
 #!/usr/bin/env python3
 
-import chardet
+import argparse
+import asyncio
 import colored
+import contextlib
 import enum
 import os
 import requests
-import subprocess
 import sys
+import tempfile
 import time
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), 'scripts', 'execution'))
+
+import inventory
+
 APEDF_PATH="/root/APEDF"
 BOARD_USER="root"
 BOARD_IP="10.30.3.51"
@@ -137,100 +143,132 @@ def relay_reboot():
 
 # ------------------------ EXPERIMENT MANAGEMENT CODE ------------------------ #
 
-# TODO: how to check for the end of the experiment
+# Each board is watched through a single SSH connection (an OpenSSH control
+# master), whose keepalives detect a board that crashed or rebooted within
+# SSH_ALIVE_INTERVAL * SSH_ALIVE_COUNT seconds; all commands are multiplexed
+# on it. Instead of polling check_progress, the watchdog subscribes to the
+# progress of the experiments with test.sh watch_progress, which prints a new
+# line each time the progress changes.
 
-def decode_detect(bstr):
-    detected = chardet.detect(bstr)
-    if detected['encoding'] is None:
-        return bstr
-    return bstr.decode(detected['encoding'], 'ignore')
+SSH_CONNECT_TIMEOUT = 5
+SSH_ALIVE_INTERVAL = 1
+SSH_ALIVE_COUNT = 3
 
-def sub_cmd(*args):
-    cmd = ' '.join([*args])
+# ssh exit code when the host cannot be reached, used also for timeouts
+UNREACHABLE = 255
 
-    child_process = subprocess.Popen(
-        cmd,
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
 
-    # Wait for termination
-    try:
-        outs, errs = child_process.communicate(timeout=15)
-    except subprocess.TimeoutExpired:
-        child_process.kill()
-        outs, errs = child_process.communicate()
-
-    # Decode output from detected encoding (ascii or utf-8, or whatever)
-    outs = decode_detect(outs)
-    errs = decode_detect(errs)
-
-    return child_process.returncode, outs, errs
-
-def ssh_cmd(*args):
-    user = BOARD_USER
-    host = BOARD_IP
-    retcode, outs, errs = sub_cmd("ssh", f"{user}@{host}", "-o", "ConnectTimeout=1", *args)
-    return retcode, outs, errs
-
-def parse_progress(outs):
-    return outs.strip()
-
-def ping_check():
-    retcode, outs, errs = sub_cmd(f"ping -c1 {BOARD_IP}")
-    if retcode != 0:
-        msg = f'Could not ping! {errs}'.strip()
-        eprint.error("FAILURE!")
-        eprint.error(msg)
-        notify_send(msg)
-        return False
-    else:
-        eprint.ok("Ping successful...", end=' ')
-    return True
-
-
-def experiment_check_running():
-    eprint.plain(f'Check in progress...', end=' ')
-    if not ping_check():
-        return False, None
-    progress = None
-    errcode, outs, errs = ssh_cmd(f"{APEDF_PATH}/test/test.sh", "check_progress")
-    if errcode != 0:
-        eprint.error("FAILURE!")
-        eprint.error(errs)
-        return False, progress
-
-    # Parse progress from STDOUT
-    progress = parse_progress(outs)
-    eprint.ok(f'SUCCESSFUL!')
-    return True, progress
-
-
-def experiment_attempt_start():
-    eprint.plain(f"Attempting to start experiment...", end=" ")
-    errcode, outs, errs = ssh_cmd(f"{APEDF_PATH}/test/test.sh", "start")
-    if errcode != 0:
-        eprint.error("FAILURE!")
-        eprint.error(errs)
+class Board(inventory.Board):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.master = None
+        self.control_path = None
+
+    def ssh_options(self):
+        # Commands are multiplexed on the connection of the control master
+        return ['-o', f'ControlPath={self.control_path}', '-o', 'ControlMaster=no'] \
+            + super().ssh_options()
+
+    def connected(self):
+        return self.is_local() or (self.master is not None and self.master.returncode is None)
+
+    async def connect(self, control_dir):
+        if self.connected():
+            return True
+
+        await self.disconnect()
+        self.control_path = os.path.join(control_dir, f'{self.name}.sock')
+        self.master = await asyncio.create_subprocess_exec(
+            'ssh', '-M', '-N',
+            '-o', f'ControlPath={self.control_path}',
+            '-o', 'BatchMode=yes',
+            '-o', f'ConnectTimeout={SSH_CONNECT_TIMEOUT}',
+            '-o', f'ServerAliveInterval={SSH_ALIVE_INTERVAL}',
+            '-o', f'ServerAliveCountMax={SSH_ALIVE_COUNT}',
+            self.host,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+
+        # Ready as soon as the control socket exists
+        time_begin = time.time()
+        while time.time() - time_begin < SSH_CONNECT_TIMEOUT + 1:
+            if os.path.exists(self.control_path):
+                return True
+            try:
+                await asyncio.wait_for(self.master.wait(), timeout=0.1)
+            except asyncio.TimeoutError:
+                continue
+            errs = (await self.master.stderr.read()).decode(errors='replace').strip()
+            eprint.error(f'{self.name}: could not connect! {errs}')
+            return False
+
+        await self.disconnect()
+        eprint.error(f'{self.name}: could not connect! timed out')
         return False
-    eprint.ok("STARTED!")
-    return True
 
+    async def disconnect(self):
+        if self.master is not None and self.master.returncode is None:
+            self.master.terminate()
+            await self.master.wait()
+        self.master = None
 
-def experiment_start():
-    time_begin = time.time()
-    success = False
-    while (not success) and (time.time() - time_begin < minutes(10)):
-        if experiment_attempt_start():
+    async def wait_disconnected(self, timeout):
+        # Waits for the connection to drop (e.g., because of a reboot)
+        if self.master is None or self.is_local():
             return
-        time.sleep(seconds(30))
-    raise ExperimentError("Could not start experiment for 10 minutes!")
+        try:
+            await asyncio.wait_for(self.master.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self, cmd, timeout=seconds(15)):
+        process = await asyncio.create_subprocess_exec(
+            *self.argv(cmd),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            outs, errs = await asyncio.wait_for(process.communicate(), timeout=timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            return UNREACHABLE, '', 'timed out'
+        return (process.returncode,
+                outs.decode(errors='replace').strip(),
+                errs.decode(errors='replace').strip())
+
+    async def check_progress(self):
+        return await self.run(f"{self.command} check_progress")
+
+    async def start(self):
+        return await self.run(f"{self.command} start")
+
+    async def watch_progress(self):
+        # Yields the progress of the experiments each time it changes, until
+        # they stop or the connection drops
+        process = await asyncio.create_subprocess_exec(
+            *self.argv(f"{self.command} watch_progress"),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            async for line in process.stdout:
+                line = line.decode(errors='replace').strip()
+                if line:
+                    yield line
+        finally:
+            if process.returncode is None:
+                process.kill()
+            await process.wait()
 
 
 # ---------------------------- NOTIFICATION CODE ----------------------------- #
 
-def notify_send(msg):
+def send_message(msg):
     if TELEGRAM_CHATID is None or TELEGRAM_BOT_TOKEN is None:
         return
 
@@ -242,92 +280,172 @@ def notify_send(msg):
     }
 
     # Ignore response or error
-    requests.get(url=url, params=params)
+    try:
+        requests.get(url=url, params=params, timeout=10)
+    except requests.RequestException:
+        pass
+
+
+async def notify_send(msg):
+    # The request blocks, so it runs in a thread to keep watching the boards
+    await asyncio.to_thread(send_message, msg)
 
 
-def notify_finish():
-    msg = "Experiments finished!!"
+async def notify_finish(board):
+    msg = f"{board.name}: Experiments finished!!"
     eprint.ok(msg)
-    notify_send(msg)
+    await notify_send(msg)
     return
 
 
-def notify_progress(progress):
-    msg = f'Current experiment progress {progress}'
+async def notify_progress(board, progress):
+    msg = f'{board.name}: Current experiment progress {progress}'
     eprint.plain(msg)
-    notify_send(msg)
+    await notify_send(msg)
     return
 
 
-def notify_experiment_error():
-    msg = 'More than 20 minutes without a response!'
+async def notify_experiment_error(board):
+    msg = f'{board.name}: More than 20 minutes without a response!'
     eprint.error(msg, file=sys.stderr)
-    notify_send(msg)
+    await notify_send(msg)
     pass
 
 
-def notify_fatal_error(ex):
+async def notify_fatal_error(ex):
     msg = f'{type(ex).__name__}: {ex}'
     eprint.error(msg, file=sys.stderr)
-    notify_send(msg)
+    await notify_send(msg)
     pass
 
 
 # ------------------------------ WATCHDOG CODE ------------------------------- #
 
-def check_and_restart():
-    # Possible states:
-    # - False, 'RESTART': a reboot occurred, attempt to restart the script
-    # - False, None: network connectivity error, try again
-    # - False, '???': other error, try again later
-    # - True, '[XXX/YYY]': everything ok
-    # - True, 'END': experiment is over, get out
-
-    maxcount=0
-    time_start=time.time()
-    status_ok=False
+# How often to try to reconnect to a board that cannot be reached
+RETRY_INTERVAL = seconds(5)
+
+
+async def watch_board(board, control_dir):
+    # Possible progress values:
+    # - 'RESTART': a reboot occurred (or the script crashed), restart it
+    # - 'ERROR': other error, restart the script
+    # - '[XXX/YYY]': everything ok
+    # - 'END': experiment is over, get out
+
+    time_last_ok = time.time()
+    time_last_notification = 0
+
     while True:
-        status_ok, progress = experiment_check_running()
-        if status_ok:
-            return progress
+        if time.time() - time_last_ok > minutes(20):
+            await notify_experiment_error(board)
+            raise ExperimentError(f'{board.name}: could not restart for a while!!')
+
+        if not await board.connect(control_dir):
+            await asyncio.sleep(RETRY_INTERVAL)
+            continue
+
+        retcode, progress, errs = await board.check_progress()
+        if retcode == UNREACHABLE:
+            eprint.error(f'{board.name}: FAILURE! {errs}')
+            await asyncio.sleep(RETRY_INTERVAL)
+            continue
+
+        if progress == 'END':
+            await notify_finish(board)
+            return
 
-        if maxcount > 6 or time.time() - time_start > minutes(20):
-            raise ExperimentError('Could not restart for a while!!')
+        if retcode != 0:
+            retcode, _, errs = await board.start()
+            if retcode != 0:
+                eprint.error(f'{board.name}: could not start experiment! {errs}')
+                await asyncio.sleep(RETRY_INTERVAL)
+                continue
+            eprint.ok(f'{board.name}: experiment started!')
+
+        restart = False
+        # Closed on return, so that the watching process is reaped right away
+        async with contextlib.aclosing(board.watch_progress()) as progresses:
+            async for progress in progresses:
+                if progress == 'END':
+                    await notify_finish(board)
+                    return
+                if progress in ('RESTART', 'ERROR'):
+                    restart = progress == 'RESTART'
+                    continue
+
+                time_last_ok = time.time()
+                eprint.plain(f'{board.name}: {progress}')
+                if time.time() - time_last_notification > minutes(10):
+                    await notify_progress(board, progress)
+                    time_last_notification = time.time()
+
+        if restart:
+            # The board is going to switch kernel, do not start the
+            # experiments again before the reboot
+            eprint.plain(f'{board.name}: swapping kernel...')
+            await board.wait_disconnected(minutes(2))
+        elif not board.connected():
+            eprint.error(f'{board.name}: connection lost!')
+        else:
+            await asyncio.sleep(RETRY_INTERVAL)
+
+
+async def watch_all(boards):
+    # Watches all boards concurrently, returns the number of failed boards
+    failures = 0
+    with tempfile.TemporaryDirectory(prefix='apedf-ssh-') as control_dir:
+        try:
+            results = await asyncio.gather(*[watch_board(board, control_dir) for board in boards],
+                                           return_exceptions=True)
+        finally:
+            for board in boards:
+                await board.disconnect()
+
+    for result in results:
+        if isinstance(result, Exception):
+            await notify_fatal_error(result)
+            failures += 1
+    return failures
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Watches the experiments running on one or more boards, "
+                    "restarting them after reboots",
+    )
+    parser.add_argument('inventory',
+                        nargs='?', default=None,
+                        help="The boards to watch, in the format of test-on-boards.py "
+                             "(default: the board configured at the top of this script)",
+                        )
+    return parser.parse_args()
 
-        experiment_attempt_start()
-        time.sleep(minutes(2))
-        maxcount=maxcount+1
 
 def main():
+    args = parse_args()
+
     # TODO: toggle to enable/disable relay stuff
     relay=False
 
-    progress = ''
-    time_last_notification=0
+    if args.inventory is not None:
+        try:
+            boards = inventory.read_inventory(args.inventory, Board)
+        except (OSError, inventory.InventoryError) as error:
+            eprint.error(f"ERROR: {error}")
+            return 1
+    else:
+        boards = [Board(BOARD_IP, f'{BOARD_USER}@{BOARD_IP}', f'{APEDF_PATH}/test')]
 
     try:
         # Turn on the board
         if relay:
             relay_switch('on')
-
-        while True:
-            progress = check_and_restart()
-
-            if progress == 'END':
-                break
-
-            if time.time() - time_last_notification > minutes(10):
-                notify_progress(progress)
-                time_last_notification = time.time()
-
-            time.sleep(minutes(1))
-
-    except (RelayError, ExperimentError) as ex:
-        notify_fatal_error(ex)
+    except RelayError as ex:
+        asyncio.run(notify_fatal_error(ex))
         return 1
 
-    # Reached when the experiment is over
-    notify_finish()
+    if asyncio.run(watch_all(boards)) > 0:
+        return 1
     return 0
 
 
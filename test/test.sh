@@ -1,8 +1,5 @@
 #!/bin/bash
 
-# TODO:
-# - implement a maximum timeout for the cooldown
-
 # --------------------------- TEST PARAMETERS --------------------------- #
 
 # Used to discard and repeat an experiment
@@ -11,9 +8,20 @@ THERM_DISCARD=70
 # Used to delay the beginning of the next experiment
 THERM_CONTINUE=45
 
+# Maximum time in seconds to wait for the temperature to go below
+# THERM_CONTINUE, the board is rebooted after that
+THERM_COOLDOWN_TIMEOUT=600
+
 # How often in seconds the temperature must be checked during experiments
 THERM_MONITOR_INTERVAL=.5
 
+# How many times a run aborted by the run guard is attempted before leaving it
+# invalid and stopping the experiments
+RUN_GUARD_MAX_ATTEMPTS=3
+
+# CPUs the thermal sampler runs on, outside the cgroup under test
+THERM_MONITOR_CPUS=0-3
+
 # Cgroups that should be created by the script during experiment setup
 CGROUPS=(
 	# Default cgroup cpuset will shrink automatically when setting the
@@ -43,6 +51,16 @@ RTAPP_LOGLEVEL=10
 # What to set as rt-limit for the system (-1 disable rt throttling)
 RTLIMIT=
 
+# How to switch between kernels: 'kexec' loads the next kernel in advance and
+# jumps into it without going through the firmware, 'reboot' installs it as
+# the boot kernel and reboots the board. When kexec cannot be used (e.g., it
+# is not installed or it fails), the script falls back to reboot
+KERNEL_SWITCH=kexec
+
+# Device tree blob passed to the kernel loaded with kexec (empty to let kexec
+# reuse the one of the running kernel)
+KEXEC_DTB=
+
 # ---------------------------- NOTIFICATIONS ---------------------------- #
 
 NOTIFICATION_MULTIPLE=10
@@ -64,72 +82,48 @@ function notify_progress() {
 
 # -------------------- TEMPERATURE CHECK AND MONITOR -------------------- #
 
-function therm_files() {
-	ls -1 /sys/class/thermal/thermal_zone*/temp
+# The cooling model fitted during each cooldown, used to predict the next one
+THERM_COOLDOWN_STATE="$OUTDIR/cooldown.json"
+
+# Waits until the temperature is low enough, sleeping until the time predicted
+# by a cooling model instead of polling (see scripts/execution/thermsampler.py)
+# and logging the duration of the cooldown in the output of the run; returns 2
+# if the temperature did not go down within THERM_COOLDOWN_TIMEOUT
+function therm_cooldown() {
+	"$THERM_SAMPLER" cooldown \
+		--threshold "$THERM_CONTINUE" \
+		--timeout "$THERM_COOLDOWN_TIMEOUT" \
+		--cpus "$THERM_MONITOR_CPUS" \
+		--state "$THERM_COOLDOWN_STATE" \
+		--log "$dir_out/cooldown.log"
 }
 
-# Prints N temperatures in Celsius, one per line
-function therm_get() {
-	therm_files | xargs cat 2>/dev/null | awk '{ print $0 / 1000.0 }'
-}
-
-# Check temperatures in STDIN against the one provided as single argument
-function therm_all_le() {
-	local temperature="$1"
-	if awk '$1 > '"${temperature}"' { print 1 }' | grep '1' >/dev/null; then
-		# Match, which means: temperature too high
-		return 1
-	else
-		# No match, which means: temperature ok
-		return 0
-	fi
-}
-
-function therm_can_begin() {
-	therm_get | therm_all_le "${THERM_CONTINUE}"
-}
-
-function therm_must_discard() {
-	tr -s ' ' '\n' <"$1" | therm_all_le "${THERM_DISCARD}"
-}
-
-# Override the error code to always be a success on SIGINT
-function therm_monitor_signal() {
-	THERM_MONITOR_CONTINUE=0
-}
-
-THERM_MONITOR_CONTINUE=1
 THERM_MONITOR_PID=''
 
-# Process that will continuously monitor the temperature (one sample per
-# line, multiple columns), terminate with SIGUSR1 please
-function therm_monitor() {
-	while [ "$THERM_MONITOR_CONTINUE" = 1 ]; do
-		therm_get | xargs echo
-		sleep "${THERM_MONITOR_INTERVAL}"
-	done
-
-}
-
+# Process that will continuously sample the temperature, keeping the thermal
+# zone files open and writing binary records to THERM_MONITOR_OUT (see
+# scripts/execution/thermsampler.py), terminate with SIGINT please
 function therm_monitor_start() {
-	(
-		trap therm_monitor_signal SIGHUP SIGINT SIGTERM SIGTSTP
-		therm_monitor >"$THERM_MONITOR_OUT"
-	) &
+	"$THERM_SAMPLER" record \
+		--outfile "$THERM_MONITOR_OUT" \
+		--interval "$THERM_MONITOR_INTERVAL" \
+		--cpus "$THERM_MONITOR_CPUS" &
 	THERM_MONITOR_PID="$!"
 	disown -r "$THERM_MONITOR_PID"
 }
 
 function therm_monitor_stop() {
+	if [ -z "$THERM_MONITOR_PID" ]; then
+		return 0
+	fi
+
 	kill -INT "$THERM_MONITOR_PID" >/dev/null 2>/dev/null || true
 
 	# Wait for the process to finish
-	if [ -n "$THERM_MONITOR_PID" ]; then
-		tail --pid="$THERM_MONITOR_PID" -f /dev/null
-	fi
+	tail --pid="$THERM_MONITOR_PID" -f /dev/null
 
 	# For the next iteration
-	THERM_MONITOR_CONTINUE=1
+	THERM_MONITOR_PID=''
 }
 
 # ---------------------------- POWER MONITOR ---------------------------- #
@@ -140,17 +134,23 @@ function therm_monitor_stop() {
 # This implementation is an improvement over previous versions because it
 # runs less programs concurrently to rtapp, delegating most other
 # operations to post-processing.
+#
+# During the run the serial is captured in binary form: large blocks, each
+# one stamped with CLOCK_MONOTONIC like rt-app logs, are written to
+# POWER_MONITOR_BIN; lines are extracted to POWER_MONITOR_OUT only after the
+# run is over.
 
 TMPDIR=''
 POWER_MONITOR_OUT=''
+POWER_MONITOR_BIN=''
 POWER_MONITOR_PID=''
 
 function power_monitor_start() {
-	# Remember in post-processing (collecting) phase to check for:
+	# In post-processing (collecting) phase, collect.py checks:
 	# - the number of fields in each row
 	# - the checksum present in each row
-	# - filter out unneded data columns (we keep it all now to avoid
-	#   doing conformance checks online)
+	# and keeps only the power column (we keep it all now to avoid doing
+	# conformance checks online)
 	"$SERIAL_LOGGER" \
 		--port /dev/ttyUSB0 \
 		--baudrate 230400 \
@@ -158,11 +158,15 @@ function power_monitor_start() {
 		--parity N \
 		--stopbits 1 \
 		--rtscts 0 \
-		>"$POWER_MONITOR_OUT" &
+		--capture "$POWER_MONITOR_BIN" &
 	POWER_MONITOR_PID="$!"
 	disown -r "$POWER_MONITOR_PID"
 }
 
+function power_monitor_decode() {
+	"$SERIAL_LOGGER" --decode "$POWER_MONITOR_BIN" >"$POWER_MONITOR_OUT"
+}
+
 function power_monitor_stop() {
 	if [ -z "$POWER_MONITOR_PID" ]; then
 		return 0
@@ -174,6 +178,60 @@ function power_monitor_stop() {
 	POWER_MONITOR_PID=''
 }
 
+# ------------------------------ RUN GUARD ------------------------------ #
+
+# The run guard follows the output of the power and thermal monitors while
+# rt-app is running, keeping the same state as powerstuck.awk and the maximum
+# temperature of each zone (see scripts/execution/runguard.py); as soon as the
+# run is provably invalid (stuck or empty power meter, temperature above
+# THERM_DISCARD) it kills all processes in the tasksets cgroup and writes the
+# reason in RUN_GUARD_VERDICT, in the output directory of the run.
+
+RUN_GUARD_PID=''
+RUN_GUARD_VERDICT=''
+
+function run_guard_start() {
+	RUN_GUARD_VERDICT="$dir_out/invalid"
+	"$RUN_GUARD" \
+		--verdict "$RUN_GUARD_VERDICT" \
+		--cgroup "$CGROUP_TASKSETS" \
+		--power "$POWER_MONITOR_BIN" \
+		--therm "$THERM_MONITOR_OUT" \
+		--duration "$RTAPP_TIMEOUT" \
+		--rtapp-config "$file_in" \
+		--therm-discard "$THERM_DISCARD" &
+	RUN_GUARD_PID="$!"
+	disown -r "$RUN_GUARD_PID"
+}
+
+function run_guard_stop() {
+	if [ -z "$RUN_GUARD_PID" ]; then
+		return 0
+	fi
+
+	kill -INT "$RUN_GUARD_PID" >/dev/null 2>/dev/null || true
+	tail --pid="$RUN_GUARD_PID" -f /dev/null
+	RUN_GUARD_PID=''
+}
+
+# Marks the run aborted by the run guard as invalid, so that it is executed
+# again right away, unless it was attempted RUN_GUARD_MAX_ATTEMPTS times
+function run_guard_retry() {
+	local reason
+	local state
+	reason="$(cat "$RUN_GUARD_VERDICT")"
+	printf 'INVALID: %s ' "$reason"
+
+	state="$(campaign retry "$run_id" \
+		--reason "$reason" \
+		--max-attempts "$RUN_GUARD_MAX_ATTEMPTS")"
+	if [ "$state" != planned ]; then
+		echo "RUN ABORTED TOO MANY TIMES! ABORTING!"
+		return 1
+	fi
+	printf 'will retry\n'
+}
+
 # --------------------------- MANAGE CGROUPS ---------------------------- #
 
 function cgroupv2_init() {
@@ -236,6 +294,20 @@ function cgroupv2_create_all() {
 	done
 }
 
+# Prints the list of CPUs of the cgroup in which rt-app shall execute
+function cgroup_tasksets_cpus() {
+	local cg
+	local cg_array
+	for cg in "${CGROUPS[@]}"; do
+		IFS=' ' read -r -a cg_array <<<"$cg"
+		if [ "${cg_array[0]}" = "$CGROUP_TASKSETS" ]; then
+			echo "${cg_array[1]}"
+			return 0
+		fi
+	done
+	return 1
+}
+
 # ------------------------ PARAMETER MANAGEMENT ------------------------- #
 
 function scheduler_detect {
@@ -288,60 +360,67 @@ GOVERNORS=(
 TASKSETS_LOCATION="./tasksets"
 KERNELS_LOCATION="./kernels"
 
-function tasksets_get_all() {
-	find "$TASKSETS_LOCATION" -name 'ts_*.json'
-}
+# When this file exists (see generate.sh), tasksets are looked up in it and
+# their rt-app configuration is exported on demand, instead of searching for
+# them in TASKSETS_LOCATION every time; it is not versioned, it is built again
+# before planning when it is missing or older than any taskset file
+TASKSETS_CORPUS="$TASKSETS_LOCATION/corpus.tsc"
+TASKSETS_EXPORT_DIR="/tmp/apedf-tasksets"
 
-function basenames() {
-	xargs -d '\n' -n1 basename
-}
+# When this file exists, only the tasksets listed in it (one name per line)
+# are executed, e.g. the ones chosen by scripts/generation/tsfeatures.py select
+TASKSETS_SELECTION="$TASKSETS_LOCATION/selection.txt"
 
-function tasksets_filter_ntask() {
-	grep -E -o '_n[0-9]+_' | tr -d _n
-}
+# When this file exists (lhs and sobol designs, see generate.sh), the tasksets
+# listed in its first column are executed in that order instead of the grid
+TASKSETS_DESIGN="$TASKSETS_LOCATION/design.tsv"
 
-function tasksets_filter_index() {
-	grep -E -o '_i[0-9]+_' | tr -d _i
-}
+# Run state of the campaign (see scripts/execution/campaign.py): which runs are
+# planned, running, done or invalid and the manifest of the tasksets to run
+CAMPAIGN_DB="$OUTDIR/campaign.db"
 
-function tasksets_filter_utilization() {
-	grep -E -o '_u[0-9]*\.[0-9]+\.json' | tr -d _u | sed 's#\.json##gi'
-}
+# The runs assigned to this board when the campaign is sharded across multiple
+# boards by test-on-boards.py; all runs are executed when it does not exist
+CAMPAIGN_SHARD="$OUTDIR/shard.tsv"
 
-function tasksets_get_param_list() {
-	tasksets_get_all | basenames | tasksets_filter_"$1" | sort -n | uniq
+function campaign() {
+	"$CAMPAIGN" "$1" "$CAMPAIGN_DB" "${@:2}"
 }
 
-NTASKS=()
-INDEXES=()
-UTILIZATIONS=()
-
-N_RUNS=0
-
-function tasksets_fill_data() {
-	if [ -z "${NTASKS[0]}" ]; then
-		readarray -t NTASKS < <(tasksets_get_param_list ntask)
-		readarray -t INDEXES < <(tasksets_get_param_list index)
-		readarray -t UTILIZATIONS < <(tasksets_get_param_list utilization)
+# Packs the tasksets in the corpus if it is missing or older than any taskset
+# file, like generate.sh does; the names of design points do not fit in the
+# corpus, design tasksets are looked up using the design file instead
+function tasksets_corpus_update() {
+	if [ -f "$TASKSETS_DESIGN" ]; then
+		return 0
+	fi
+	if [ -f "$TASKSETS_CORPUS" ] && [ -z "$(find "$TASKSETS_LOCATION" \
+		-name 'ts_*.json' -newer "$TASKSETS_CORPUS" -print -quit)" ]; then
+		return 0
 	fi
-}
 
-function calculate_n_runs() {
-	echo "${#GOVERNORS[@]}" \
-		'*' "${#SCHEDULERS[@]}" \
-		'*' "${#NTASKS[@]}" \
-		'*' "${#UTILIZATIONS[@]}" \
-		'*' "${#INDEXES[@]}" | bc
+	printf 'Building the tasksets corpus...\n'
+	"$TSCORPUS" build -o "$TASKSETS_CORPUS" "$TASKSETS_LOCATION"
 }
 
-function get_list() {
-	tasksets_fill_data
-
-	echo "${NTASKS[*]}"
-	echo "${INDEXES[*]}"
-	echo "${UTILIZATIONS[*]}"
+# Adds the runs of new tasksets to the campaign, runs that are already done are
+# kept as they are
+function campaign_plan() {
+	printf 'Planning the experiments...\n'
+	campaign plan \
+		--outdir "$OUTDIR" \
+		--tasksets "$TASKSETS_LOCATION" \
+		--corpus "$TASKSETS_CORPUS" \
+		--design "$TASKSETS_DESIGN" \
+		--selection "$TASKSETS_SELECTION" \
+		--export-dir "$TASKSETS_EXPORT_DIR" \
+		--shard "$CAMPAIGN_SHARD" \
+		--schedulers "${SCHEDULERS[@]}" \
+		--governors "${GOVERNORS[@]}"
 }
 
+N_RUNS=0
+
 function experiment_is_running() {
 	# Experiments run in screens, so check if there is any screen
 	# running called 'experiment'
@@ -445,10 +524,47 @@ function experiment_check_progress() {
 		fi
 	done <"$tmpfile"
 
+	# Still planning the campaign, before the first run
+	if [ "$running" = 1 ]; then
+		echo STARTING
+		return 0
+	fi
+
 	echo ERROR
 	return 1
 }
 
+# Streams the progress of the experiments: prints the same value of
+# check_progress, then the progress found in each new line of the log while
+# the experiments are running, then the value of check_progress again once
+# they stop. Used by test-on-remote.py instead of polling check_progress; the
+# log is followed with tail, so nothing runs on the board until a line is
+# written
+function experiment_watch_progress() {
+	local progress
+	local pid
+	progress="$(experiment_check_progress)" || true
+	echo "$progress"
+
+	pid="$(screen -ls | grep -o -E '[0-9]+\.experiment' | head -n 1 | cut -d. -f1)" || true
+	if [ -z "$pid" ] || [ "$progress" = END ] || [ "$progress" = RESTART ]; then
+		return 0
+	fi
+
+	local line
+	tail -n 0 -F --pid="$pid" last_experiment.log 2>/dev/null |
+		while IFS= read -r line; do
+			progress="$(get_progress "$line")"
+			if [ -n "$progress" ]; then
+				echo "$progress"
+			fi
+		done
+
+	# Wait for the screen to terminate
+	sleep 1
+	experiment_check_progress || true
+}
+
 function experiment_start() {
 	if experiment_is_running; then
 		echo "Cannot start experiment: already running!" >&2
@@ -502,18 +618,30 @@ function power_meter_stuck_check() {
 function experiment_execute_taskset() {
 	# Relevant variables:
 	# - file_in: taskset json file
-	# - dir_out: where to place the output of the experiment
+	# - dir_out: where to place the output of the experiment (the staging
+	#   directory of the run, see campaign.py)
 
 	# Clean stuff from previous execution
 	rm -f "$TMPDIR/"*
 	mkdir -p "$TMPDIR/rt-app-logs"
 
 	# Check that the temperature is low enough
-	while ! therm_can_begin; do
-		printf 'Cooling down... '
-		# FIXME: put a maximum timeout, then reboot
-		sleep 5
-	done
+	printf 'Cooling down... '
+	local cooldown_time
+	local cooldown_result=0
+	cooldown_time="$(therm_cooldown)" || cooldown_result=$?
+	printf '%s ' "$cooldown_time"
+
+	if [ "$cooldown_result" = 2 ]; then
+		# The run did not start yet, it will be executed again after reboot
+		printf 'COOLDOWN TIMED OUT! REBOOTING!\n'
+		notify reboot
+		sync
+		reboot
+		exit 0
+	elif [ "$cooldown_result" != 0 ]; then
+		return 1
+	fi
 
 	printf 'Starting... '
 
@@ -525,13 +653,23 @@ function experiment_execute_taskset() {
 
 	power_monitor_start
 	therm_monitor_start
+	run_guard_start
 
-	# Run rtapp in the right cgroup
+	# Run rtapp in the right cgroup, the run guard kills it if the run
+	# becomes invalid
+	local rtapp_result=0
 	cgroupv2_run "$CGROUP_TASKSETS" nice -n 20 \
-		"$RTAPP" -t "$RTAPP_TIMEOUT" -l "$RTAPP_LOGLEVEL" "$file_in"
+		"$RTAPP" -t "$RTAPP_TIMEOUT" -l "$RTAPP_LOGLEVEL" "$file_in" ||
+		rtapp_result=$?
+
+	run_guard_stop
+	if [ "$rtapp_result" != 0 ] && [ ! -f "$RUN_GUARD_VERDICT" ]; then
+		return "$rtapp_result"
+	fi
 
 	power_monitor_stop
 	therm_monitor_stop
+	power_monitor_decode
 
 	# Copy back trace buffer
 	cat /sys/kernel/tracing/trace >"$TMPDIR/kernel.trace"
@@ -542,6 +680,7 @@ function experiment_execute_taskset() {
 	# Copy back results
 	cp -a "$TMPDIR/rt-app-logs/"* "$dir_out"
 	cp -a "$POWER_MONITOR_OUT" "$dir_out"
+	cp -a "$POWER_MONITOR_BIN" "$dir_out"
 	cp -a "$THERM_MONITOR_OUT" "$dir_out"
 	cp -a "$TMPDIR/kernel.trace" "$dir_out"
 
@@ -551,60 +690,173 @@ function experiment_execute_taskset() {
 	# Clean stuff from previous execution again, just in case
 	rm -rf "${TMPDIR:?}/"*
 
-	power_meter_stuck_check "$dir_out/power.log"
+	if [ -f "$RUN_GUARD_VERDICT" ]; then
+		run_guard_retry
+		run_aborted=1
+		return 0
+	fi
+
+	# Also checked after the run, in case the guard missed it
+	if ! power_meter_stuck_check "$dir_out/power.log"; then
+		campaign invalid "$run_id" --reason 'power meter check failed'
+		return 1
+	fi
 
 	printf 'DONE!'
 }
 
+# Kernels before 5.9 (like the 5.4 on the Odroid) admit the per-CPU
+# bandwidth times the number of CPUs, regardless of their capacity
+function kernel_dl_per_cpu_bw() {
+	local version
+	version=$(uname -r | cut -d- -f1)
+	[ "$(printf '%s\n' 5.9 "$version" | sort -V | head -n1)" != 5.9 ]
+}
+
+# Checks that SCHED_DEADLINE will accept every taskset in the root domain of
+# the tasksets cgroup (using the capacity of its CPUs and the current rt
+# limits) before starting, so that a rejected sched_setattr cannot waste
+# runs or reboots in the middle of the experiments
+function tasksets_admission_check() {
+	local options=()
+	if kernel_dl_per_cpu_bw; then
+		options+=(--per-cpu-bw)
+	fi
+
+	printf 'Checking SCHED_DEADLINE admission of all tasksets...\n'
+	if ! "$ADMISSION_CHECKER" "${options[@]}" \
+		--cpus "$(cgroup_tasksets_cpus)" \
+		--rt-runtime-us "$(cat /proc/sys/kernel/sched_rt_runtime_us)" \
+		--rt-period-us "$(cat /proc/sys/kernel/sched_rt_period_us)" \
+		"$TASKSETS_LOCATION"; then
+		echo "SOME TASKSETS WOULD BE REJECTED! ABORTING!"
+		return 1
+	fi
+}
+
 function kernel_change() {
 	# The required kernel is expressed by the $scheduler variable
 	cp "$KERNELS_LOCATION"/"$scheduler".zImage /media/boot/zImage
 }
 
-function print_progress() {
-	printf "+ [%0${print_width}d/%d] %s %s %s:" \
-		"$cur_total_index" "$N_RUNS" "$scheduler" "$governor" "$taskset"
+# ------------------------- KEXEC KERNEL SWITCH ------------------------- #
+
+# The token is appended to the command line of the kernel loaded with kexec
+# and saved in RESUME_TOKEN_FILE together with the target scheduler: when the
+# new kernel boots with the same token, the experiment is resumed immediately
+# (see the resume command) without waiting for test-on-remote.py
+RESUME_TOKEN_FILE="$OUTDIR/resume.token"
+RESUME_TOKEN_ARG=apedf.resume
+
+KEXEC_LOADED=''
+KEXEC_TOKEN=''
+
+function kexec_cmdline() {
+	# The command line of the running kernel, without the previous token
+	sed -E "s/ ?${RESUME_TOKEN_ARG}=[^ ]*//g" /proc/cmdline
 }
 
-function experiment_run_step() {
-	taskset="ts_n${ntask}_i${index}_u${utilization}"
-	taskset_fname="${taskset}.json"
-	file_in=$(find "${TASKSETS_LOCATION}" -type f -name "$taskset_fname" -print -quit || true)
+function resume_token_get() {
+	grep -E -o "${RESUME_TOKEN_ARG}=[^ ]+" /proc/cmdline | cut -d= -f2 || true
+}
 
-	print_progress
+# Loads the kernel of the scheduler given as first argument, to be executed
+# later with kexec
+function kexec_load() {
+	local kernel="$KERNELS_LOCATION/$1.zImage"
+	local token
+	token="$(cat /proc/sys/kernel/random/uuid)"
+
+	if ! command -v kexec >/dev/null || [ ! -f "$kernel" ]; then
+		return 1
+	fi
+
+	local args=(-l "$kernel" --append="$(kexec_cmdline) ${RESUME_TOKEN_ARG}=$token")
+	if [ -n "$KEXEC_DTB" ]; then
+		args+=(--dtb="$KEXEC_DTB")
+	fi
+
+	if ! kexec "${args[@]}"; then
+		return 1
+	fi
+
+	KEXEC_LOADED="$1"
+	KEXEC_TOKEN="$token"
+}
 
-	if [ -z "$file_in" ]; then
-		printf 'No input file, skipping...'
+# Loads the kernel that will be needed after the runs of the current one, so
+# that switching takes no time when they are over
+function kernel_preload() {
+	if [ "$KERNEL_SWITCH" != kexec ]; then
 		return 0
 	fi
 
-	# Input file exists
-	dir_out="$OUTDIR/$scheduler/$governor/$taskset.out.d"
+	local upcoming
+	upcoming="$(campaign upcoming --kernel "$(scheduler_detect)")"
+	if [ -z "$upcoming" ]; then
+		return 0
+	fi
 
-	if [ ! -d "$dir_out" ]; then
-		mkdir -p "$dir_out"
+	if kexec_load "$upcoming"; then
+		printf 'Kernel %s loaded with kexec\n' "$upcoming"
+	else
+		printf 'Could not load kernel %s with kexec, will reboot\n' "$upcoming"
+	fi
+}
+
+# Jumps into the kernel of $scheduler, returns only on failure
+function kernel_kexec() {
+	if [ "$KEXEC_LOADED" != "$scheduler" ] && ! kexec_load "$scheduler"; then
+		return 1
 	fi
 
-	if [ -n "$(ls -A "$dir_out" 2>/dev/null)" ]; then
-		printf 'Nonempty directory exists, skipping...'
+	echo "$KEXEC_TOKEN $scheduler" >"$RESUME_TOKEN_FILE"
+	sync
+
+	notify kexec
+
+	# Stop services and unmount file systems properly if possible
+	systemctl kexec || kexec -e
+}
+
+# Called once the experiment is running on the new kernel: if the last kexec
+# did not bring up the expected kernel, kernels are switched by rebooting
+function resume_token_check() {
+	if [ ! -f "$RESUME_TOKEN_FILE" ]; then
 		return 0
 	fi
 
-	# Directory is empty, we must run the experiment
-	if [ "$(scheduler_detect)" != "$scheduler" ]; then
-		# We must change kernel
-		printf '%s\n' 'Swapping kernel!'
-		kernel_change
-		sleep 5
-		sync
+	local token
+	local target
+	read -r token target <"$RESUME_TOKEN_FILE"
+	rm -f "$RESUME_TOKEN_FILE"
 
-		notify reboot
-		sleep 2
+	if [ "$(scheduler_detect)" != "$target" ]; then
+		printf 'Switch to kernel %s with kexec failed, falling back to reboot\n' "$target"
+		KERNEL_SWITCH=reboot
+	fi
+}
 
-		reboot
+# Meant to be executed at boot (e.g., from a @reboot crontab entry): starts
+# the experiment only if the kernel was booted by kexec with the last token
+function experiment_resume() {
+	local token
+	token="$(resume_token_get)"
+	if [ -z "$token" ] || [ ! -f "$RESUME_TOKEN_FILE" ] ||
+		[ "$(cut -d' ' -f1 <"$RESUME_TOKEN_FILE")" != "$token" ]; then
+		return 0
 	fi
 
-	printf 'Must execute...'
+	experiment_start
+}
+
+function print_progress() {
+	printf "+ [%0${print_width}d/%d] %s %s %s:" \
+		"$cur_total_index" "$N_RUNS" "$scheduler" "$governor" "$taskset"
+}
+
+function experiment_run_step() {
+	print_progress
 
 	# The kernel is the right one, let's check that the governor is correct
 	if [ "$(governor_detect)" != "$governor" ] || [ "$(governor_maxfreq_detect)" != "$CPUFREQ_MAXFREQ" ]; then
@@ -612,34 +864,89 @@ function experiment_run_step() {
 		sleep 2
 	fi
 
-	# We have the correct kernel and governor pair, time to start the experiment
+	# We have the correct kernel and governor pair, time to start the
+	# experiment; its output is moved to its final place only once complete
+	run_aborted=0
 	experiment_execute_taskset
+	if [ "$run_aborted" = 1 ]; then
+		# Already planned again by the campaign
+		return 0
+	fi
+	campaign commit "$run_id"
 
 	# We notify only on successful execution
 	notify_progress "$cur_total_index" "$N_RUNS"
 }
 
+function experiment_swap_kernel() {
+	# The required kernel is expressed by the $scheduler variable
+	printf '+ %s kernel: %s\n' "$scheduler" 'Swapping kernel!'
+
+	# Installed also when using kexec, so that the board keeps running the
+	# same kernel if it is rebooted
+	kernel_change
+	sleep 5
+	sync
+
+	if [ "$KERNEL_SWITCH" = kexec ] && kernel_kexec; then
+		exit 0
+	fi
+
+	notify reboot
+	sleep 2
+
+	reboot
+	exit 0
+}
+
+# Runs are handed out by the campaign grouped by kernel, so that each kernel
+# is booted only once; after a reboot (or a crash) the campaign resumes from
+# the first run that was not committed
 function experiment_run() {
 	setup
-	tasksets_fill_data
-	N_RUNS="$(calculate_n_runs)"
-
-	# Get the number of digits in N_RUNS
-	local print_width=${#N_RUNS}
-
-	cur_total_index=0
-	for index in "${INDEXES[@]}"; do
-		for governor in "${GOVERNORS[@]}"; do
-			for scheduler in "${SCHEDULERS[@]}"; do
-				for ntask in "${NTASKS[@]}"; do
-					for utilization in "${UTILIZATIONS[@]}"; do
-						cur_total_index=$((cur_total_index + 1))
-						experiment_run_step
-						printf '\n'
-					done
-				done
-			done
-		done
+	resume_token_check
+	tasksets_admission_check
+	tasksets_corpus_update
+	campaign_plan
+	kernel_preload
+
+	local next_run
+	local fields
+	local print_width
+
+	while true; do
+		next_run="$(campaign next --kernel "$(scheduler_detect)")"
+		IFS=$'\t' read -r -a fields <<<"$next_run"
+
+		case "${fields[0]}" in
+		RUN)
+			run_id="${fields[1]}"
+			cur_total_index=$((fields[2] + 1))
+			N_RUNS="${fields[3]}"
+			scheduler="${fields[4]}"
+			governor="${fields[5]}"
+			taskset="${fields[6]}"
+			file_in="${fields[7]}"
+			dir_out="${fields[8]}"
+
+			# Get the number of digits in N_RUNS
+			print_width=${#N_RUNS}
+
+			experiment_run_step
+			printf '\n'
+			;;
+		KERNEL)
+			scheduler="${fields[1]}"
+			experiment_swap_kernel
+			;;
+		END)
+			break
+			;;
+		*)
+			echo "UNEXPECTED CAMPAIGN OUTPUT: $next_run"
+			return 1
+			;;
+		esac
 	done
 
 	printf " + All tests successful!!\n"
@@ -654,6 +961,7 @@ function cleanup() {
 
 	printf "Cleaning up..." >&2
 
+	run_guard_stop || true
 	therm_monitor_stop || true
 	power_monitor_stop || true
 
@@ -711,8 +1019,9 @@ function setup() {
 	TMPDIR=/mnt/ramfs
 	setup_cleanup
 	setup_ramfs
-	THERM_MONITOR_OUT="$TMPDIR/therm.log"
+	THERM_MONITOR_OUT="$TMPDIR/therm.bin"
 	POWER_MONITOR_OUT="$TMPDIR/power.log"
+	POWER_MONITOR_BIN="$TMPDIR/power.bin"
 	cgroupv2_create_all
 	if [ -n "$RTLIMIT" ]; then
 		echo + Setting kernel.sched_rt_runtime_us="$RTLIMIT"
@@ -733,7 +1042,12 @@ function main() {
 	RTAPP="$APPS_PATH/rt-app/src/rt-app"
 	SERIAL_LOGGER="$HELPERS_PATH/slogger.py"
 	NOTIFIER="$HELPERS_PATH/notifier.py"
+	THERM_SAMPLER="$HELPERS_PATH/thermsampler.py"
+	RUN_GUARD="$HELPERS_PATH/runguard.py"
 	STUCK_CHECKER="$HELPERS_PATH/powerstuck.awk"
+	ADMISSION_CHECKER="$TEST_PATH/scripts/generation/dladmission.py"
+	TSCORPUS="$TEST_PATH/scripts/generation/tscorpus.py"
+	CAMPAIGN="$HELPERS_PATH/campaign.py"
 
 	# Move to the correct directory
 	cd "$TEST_PATH"
@@ -742,9 +1056,15 @@ function main() {
 	check_progress)
 		experiment_check_progress
 		;;
+	watch_progress)
+		experiment_watch_progress
+		;;
 	start)
 		experiment_start
 		;;
+	resume)
+		experiment_resume
+		;;
 	# start_if_rebooted)
 	# 	experiment_start_if_rebooted
 	# 	;;
@@ -753,7 +1073,7 @@ function main() {
 		;;
 	*)
 		echo "Unsupported command: $1" >&2
-		echo "Supported commands: start, check_progress." >&2
+		echo "Supported commands: start, resume, check_progress, watch_progress." >&2
 		echo "Commands accepted for internal use only: run." >&2
 		return 1
 		;;
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+"""\
+Drives test-on-boards.py plan and run against fake boards (see
+scripts/execution/fakeboard.py), one of which dies in the middle of the
+campaign, and checks that every run of the campaign is merged exactly once
+and that invalid inventories are refused.
+
+Run from the test directory with:
+  python3 -m unittest discover tests
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+TESTDIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+SUPERVISOR = os.path.join(TESTDIR, 'test-on-boards.py')
+FAKEBOARD = os.path.join(TESTDIR, 'scripts', 'execution', 'fakeboard.py')
+
+TASKSETS = ['ts_n06_i00_u1.0000', 'ts_n06_i00_u1.1500', 'ts_n08_i00_u1.0000', 'ts_n08_i01_u1.0000']
+SCHEDULERS = ['global', 'apedf-ff', 'apedf-wf']
+GOVERNORS = ['performance', 'schedutil']
+NUM_BOARDS = 3
+
+# Seconds, short enough to complete the campaign in a few seconds
+RUN_TIME = 0.05
+INTERVAL = 0.2
+DEAD_AFTER = 3
+
+
+class TestBoards(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = self.tmpdir.name
+
+        # Fakeboard only plans the tasksets, their content is never read
+        tasksets = os.path.join(self.root, 'tasksets')
+        os.makedirs(tasksets)
+        for name in TASKSETS:
+            open(os.path.join(tasksets, name + '.json'), 'w').close()
+
+        self.inventory = os.path.join(self.root, 'inventory')
+        with open(self.inventory, 'w') as outfile:
+            for i in range(NUM_BOARDS):
+                board = os.path.join(self.root, f"fake{i}")
+                os.makedirs(board)
+                os.symlink(tasksets, os.path.join(board, 'tasksets'))
+                command = f"{sys.executable} {FAKEBOARD} -r {RUN_TIME}"
+                if i == 1:
+                    command += ' -d 5'
+                print(f"fake{i} - {board} {command}", file=outfile)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def supervisor(self, *args, timeout=120):
+        return subprocess.run([sys.executable, SUPERVISOR, *args],
+                              cwd=self.root, timeout=timeout, text=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def test_plan_run_merge(self):
+        workdir = os.path.join(self.root, 'boards.d')
+        outdir = os.path.join(self.root, 'out')
+        total = len(TASKSETS) * len(SCHEDULERS) * len(GOVERNORS)
+
+        result = self.supervisor('plan', self.inventory, '-w', workdir,
+                                 '-t', os.path.join(self.root, 'tasksets'),
+                                 '-s', *SCHEDULERS, '-g', *GOVERNORS)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(len(result.stdout.splitlines()), NUM_BOARDS)
+
+        result = self.supervisor('run', '-w', workdir, '-o', outdir,
+                                 '-i', str(INTERVAL), '-d', str(DEAD_AFTER))
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('fake1: no response', result.stderr)
+        self.assertIn(f"{total} runs merged in {outdir}, 0 already there", result.stdout)
+
+        merged = [(scheduler, governor, dname)
+                  for scheduler in os.listdir(outdir)
+                  for governor in os.listdir(os.path.join(outdir, scheduler))
+                  for dname in os.listdir(os.path.join(outdir, scheduler, governor))]
+        expected = [(scheduler, governor, name + '.out.d')
+                    for scheduler in SCHEDULERS
+                    for governor in GOVERNORS
+                    for name in TASKSETS]
+        self.assertCountEqual(merged, expected)
+
+    def test_invalid_inventory(self):
+        workdir = os.path.join(self.root, 'boards.d')
+        for lines in (["fake0 -"], ["fake0 - /tmp/fake0", "fake0 - /tmp/fake1"]):
+            with open(self.inventory, 'w') as outfile:
+                print('\n'.join(lines), file=outfile)
+            result = self.supervisor('plan', self.inventory, '-w', workdir,
+                                     '-t', os.path.join(self.root, 'tasksets'))
+            self.assertEqual(result.returncode, 1, result.stderr)
+            self.assertTrue(result.stderr.startswith('ERROR: '), result.stderr)
+            self.assertFalse(os.path.exists(workdir))
+
+
+if __name__ == '__main__':
+    unittest.main()